@@ -9,6 +9,7 @@ from selenium.common.exceptions import StaleElementReferenceException, TimeoutEx
 import os
 import re
 import time
+import hashlib
 import unicodedata
 import pandas as pd
 import requests
@@ -124,6 +125,35 @@ def upload_to_bucket(file_path, bucket_name, file_name=None):
     response.raise_for_status()
     return True
 
+def file_sha256(file_path, block_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def notify_processor(file_path, bucket_name, file_name):
+    """
+    Avisa o processador (POST PROCESSOR_INGEST_URL, rota /ingest) de que ha um CSV
+    novo no bucket, para nao esperar pelo proximo polling.
+    """
+    env = load_env()
+    ingest_url = env.get("PROCESSOR_INGEST_URL") or os.getenv("PROCESSOR_INGEST_URL")
+    if not ingest_url:
+        return False
+    token = env.get("INGEST_TOKEN") or os.getenv("INGEST_TOKEN")
+    headers = {"X-Ingest-Token": token} if token else {}
+    payload = {"bucket": bucket_name, "path": file_name, "sha256": file_sha256(file_path)}
+    try:
+        response = requests.post(ingest_url, json=payload, headers=headers, timeout=5)
+    except requests.RequestException as exc:
+        print(f"Aviso: notificacao ao processador falhou: {exc}")
+        return False
+    if not response.ok:
+        print(f"Aviso: notificacao ao processador falhou: {response.status_code} {response.text}")
+        return False
+    return True
+
 def run_crawler():
     os.makedirs(os.path.dirname(CSV_PATH), exist_ok=True)
     options = Options()
@@ -428,6 +458,8 @@ def main_loop():
             uploaded = upload_to_bucket(CSV_PATH, BUCKET_NAME, BUCKET_FILE_PATH)
             if uploaded:
                 print("CSV atualizado e enviado.")
+                if notify_processor(CSV_PATH, BUCKET_NAME, BUCKET_FILE_PATH):
+                    print("Processador notificado.")
             else:
                 print("CSV atualizado, mas o upload falhou.")
         except Exception as exc:
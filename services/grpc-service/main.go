@@ -20,6 +20,8 @@ func (s *hintServer) GetHints(ctx context.Context, req *processingpb.HintsReques
 	chunkSize := getEnvInt("GRPC_CHUNK_SIZE", 200)
 	batchSize := getEnvInt("GRPC_BATCH_SIZE", 20)
 	batchDelay := getEnvFloat("GRPC_BATCH_DELAY", 0.05)
+	chunkWorkers := getEnvInt("GRPC_CHUNK_WORKERS", 4)
+	cpuWorkers := getEnvInt("GRPC_CPU_WORKERS", 0)
 
 	note := "hints_from_grpc"
 	if req.GetSource() != "" {
@@ -27,10 +29,12 @@ func (s *hintServer) GetHints(ctx context.Context, req *processingpb.HintsReques
 	}
 
 	return &processingpb.HintsResponse{
-		ChunkSize:  int32(chunkSize),
-		BatchSize:  int32(batchSize),
-		BatchDelay: batchDelay,
-		Note:       note,
+		ChunkSize:    int32(chunkSize),
+		BatchSize:    int32(batchSize),
+		BatchDelay:   batchDelay,
+		Note:         note,
+		ChunkWorkers: int32(chunkWorkers),
+		CpuWorkers:   int32(cpuWorkers),
 	}, nil
 }
 
@@ -72,10 +72,12 @@ type HintsResponse struct {
 	sizeCache     protoimpl.SizeCache
 	unknownFields protoimpl.UnknownFields
 
-	ChunkSize  int32   `protobuf:"varint,1,opt,name=chunk_size,json=chunkSize,proto3" json:"chunk_size,omitempty"`
-	BatchSize  int32   `protobuf:"varint,2,opt,name=batch_size,json=batchSize,proto3" json:"batch_size,omitempty"`
-	BatchDelay float64 `protobuf:"fixed64,3,opt,name=batch_delay,json=batchDelay,proto3" json:"batch_delay,omitempty"`
-	Note       string  `protobuf:"bytes,4,opt,name=note,proto3" json:"note,omitempty"`
+	ChunkSize    int32   `protobuf:"varint,1,opt,name=chunk_size,json=chunkSize,proto3" json:"chunk_size,omitempty"`
+	BatchSize    int32   `protobuf:"varint,2,opt,name=batch_size,json=batchSize,proto3" json:"batch_size,omitempty"`
+	BatchDelay   float64 `protobuf:"fixed64,3,opt,name=batch_delay,json=batchDelay,proto3" json:"batch_delay,omitempty"`
+	Note         string  `protobuf:"bytes,4,opt,name=note,proto3" json:"note,omitempty"`
+	ChunkWorkers int32   `protobuf:"varint,5,opt,name=chunk_workers,json=chunkWorkers,proto3" json:"chunk_workers,omitempty"`
+	CpuWorkers   int32   `protobuf:"varint,6,opt,name=cpu_workers,json=cpuWorkers,proto3" json:"cpu_workers,omitempty"`
 }
 
 func (x *HintsResponse) Reset() {
@@ -138,6 +140,20 @@ func (x *HintsResponse) GetNote() string {
 	return ""
 }
 
+func (x *HintsResponse) GetChunkWorkers() int32 {
+	if x != nil {
+		return x.ChunkWorkers
+	}
+	return 0
+}
+
+func (x *HintsResponse) GetCpuWorkers() int32 {
+	if x != nil {
+		return x.CpuWorkers
+	}
+	return 0
+}
+
 var File_processing_hints_proto protoreflect.FileDescriptor
 
 var file_processing_hints_proto_rawDesc = []byte{
@@ -145,7 +161,7 @@ var file_processing_hints_proto_rawDesc = []byte{
 	0x74, 0x73, 0x2e, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x12, 0x0a, 0x70, 0x72, 0x6f, 0x63, 0x65, 0x73,
 	0x73, 0x69, 0x6e, 0x67, 0x22, 0x26, 0x0a, 0x0c, 0x48, 0x69, 0x6e, 0x74, 0x73, 0x52, 0x65, 0x71,
 	0x75, 0x65, 0x73, 0x74, 0x12, 0x16, 0x0a, 0x06, 0x73, 0x6f, 0x75, 0x72, 0x63, 0x65, 0x18, 0x01,
-	0x20, 0x01, 0x28, 0x09, 0x52, 0x06, 0x73, 0x6f, 0x75, 0x72, 0x63, 0x65, 0x22, 0x82, 0x01, 0x0a,
+	0x20, 0x01, 0x28, 0x09, 0x52, 0x06, 0x73, 0x6f, 0x75, 0x72, 0x63, 0x65, 0x22, 0xc8, 0x01, 0x0a,
 	0x0d, 0x48, 0x69, 0x6e, 0x74, 0x73, 0x52, 0x65, 0x73, 0x70, 0x6f, 0x6e, 0x73, 0x65, 0x12, 0x1d,
 	0x0a, 0x0a, 0x63, 0x68, 0x75, 0x6e, 0x6b, 0x5f, 0x73, 0x69, 0x7a, 0x65, 0x18, 0x01, 0x20, 0x01,
 	0x28, 0x05, 0x52, 0x09, 0x63, 0x68, 0x75, 0x6e, 0x6b, 0x53, 0x69, 0x7a, 0x65, 0x12, 0x1d, 0x0a,
@@ -154,14 +170,18 @@ var file_processing_hints_proto_rawDesc = []byte{
 	0x62, 0x61, 0x74, 0x63, 0x68, 0x5f, 0x64, 0x65, 0x6c, 0x61, 0x79, 0x18, 0x03, 0x20, 0x01, 0x28,
 	0x01, 0x52, 0x0a, 0x62, 0x61, 0x74, 0x63, 0x68, 0x44, 0x65, 0x6c, 0x61, 0x79, 0x12, 0x12, 0x0a,
 	0x04, 0x6e, 0x6f, 0x74, 0x65, 0x18, 0x04, 0x20, 0x01, 0x28, 0x09, 0x52, 0x04, 0x6e, 0x6f, 0x74,
-	0x65, 0x32, 0x52, 0x0a, 0x0f, 0x50, 0x72, 0x6f, 0x63, 0x65, 0x73, 0x73, 0x69, 0x6e, 0x67, 0x48,
-	0x69, 0x6e, 0x74, 0x73, 0x12, 0x3f, 0x0a, 0x08, 0x47, 0x65, 0x74, 0x48, 0x69, 0x6e, 0x74, 0x73,
-	0x12, 0x18, 0x2e, 0x70, 0x72, 0x6f, 0x63, 0x65, 0x73, 0x73, 0x69, 0x6e, 0x67, 0x2e, 0x48, 0x69,
-	0x6e, 0x74, 0x73, 0x52, 0x65, 0x71, 0x75, 0x65, 0x73, 0x74, 0x1a, 0x19, 0x2e, 0x70, 0x72, 0x6f,
-	0x63, 0x65, 0x73, 0x73, 0x69, 0x6e, 0x67, 0x2e, 0x48, 0x69, 0x6e, 0x74, 0x73, 0x52, 0x65, 0x73,
-	0x70, 0x6f, 0x6e, 0x73, 0x65, 0x42, 0x1a, 0x5a, 0x18, 0x74, 0x70, 0x33, 0x2d, 0x67, 0x72, 0x70,
-	0x63, 0x2f, 0x70, 0x62, 0x3b, 0x70, 0x72, 0x6f, 0x63, 0x65, 0x73, 0x73, 0x69, 0x6e, 0x67, 0x70,
-	0x62, 0x62, 0x06, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x33,
+	0x65, 0x12, 0x23, 0x0a, 0x0d, 0x63, 0x68, 0x75, 0x6e, 0x6b, 0x5f, 0x77, 0x6f, 0x72, 0x6b, 0x65,
+	0x72, 0x73, 0x18, 0x05, 0x20, 0x01, 0x28, 0x05, 0x52, 0x0c, 0x63, 0x68, 0x75, 0x6e, 0x6b, 0x57,
+	0x6f, 0x72, 0x6b, 0x65, 0x72, 0x73, 0x12, 0x1f, 0x0a, 0x0b, 0x63, 0x70, 0x75, 0x5f, 0x77, 0x6f,
+	0x72, 0x6b, 0x65, 0x72, 0x73, 0x18, 0x06, 0x20, 0x01, 0x28, 0x05, 0x52, 0x0a, 0x63, 0x70, 0x75,
+	0x57, 0x6f, 0x72, 0x6b, 0x65, 0x72, 0x73, 0x32, 0x52, 0x0a, 0x0f, 0x50, 0x72, 0x6f, 0x63, 0x65,
+	0x73, 0x73, 0x69, 0x6e, 0x67, 0x48, 0x69, 0x6e, 0x74, 0x73, 0x12, 0x3f, 0x0a, 0x08, 0x47, 0x65,
+	0x74, 0x48, 0x69, 0x6e, 0x74, 0x73, 0x12, 0x18, 0x2e, 0x70, 0x72, 0x6f, 0x63, 0x65, 0x73, 0x73,
+	0x69, 0x6e, 0x67, 0x2e, 0x48, 0x69, 0x6e, 0x74, 0x73, 0x52, 0x65, 0x71, 0x75, 0x65, 0x73, 0x74,
+	0x1a, 0x19, 0x2e, 0x70, 0x72, 0x6f, 0x63, 0x65, 0x73, 0x73, 0x69, 0x6e, 0x67, 0x2e, 0x48, 0x69,
+	0x6e, 0x74, 0x73, 0x52, 0x65, 0x73, 0x70, 0x6f, 0x6e, 0x73, 0x65, 0x42, 0x1a, 0x5a, 0x18, 0x74,
+	0x70, 0x33, 0x2d, 0x67, 0x72, 0x70, 0x63, 0x2f, 0x70, 0x62, 0x3b, 0x70, 0x72, 0x6f, 0x63, 0x65,
+	0x73, 0x73, 0x69, 0x6e, 0x67, 0x70, 0x62, 0x62, 0x06, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x33,
 }
 
 var (
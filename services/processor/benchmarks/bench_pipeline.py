@@ -0,0 +1,356 @@
+"""
+Benchmark ponta a ponta do processador sem Supabase nem FMP: gera um CSV sintético
+no formato do crawler da Euronext, serve-o a partir de um stub local do bucket e
+responde a /profile e /search-symbol com um stub local da FMP (latência e taxa de
+429 configuráveis). Corre process_csv_stream_async sobre o stream do bucket e
+reporta linhas/s, RSS máximo e contagem de pedidos.
+
+Uso (a partir de services/processor):
+    python benchmarks/bench_pipeline.py [--rows 10000 100000 1000000] [--duplicates 0.5]
+        [--fmp-latency 0.05] [--rate-429 0.01] [--isin-ratio 0.1]
+        [--set OUTPUT_FORMAT=parquet --set TYPED_INGESTION=1]
+
+Cada tamanho corre num subprocesso próprio (cache, snapshot e RSS limpos); os stubs
+correm no processo do benchmark e não contam para o RSS.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+
+PROCESSOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROCESSOR_DIR)
+
+from aiohttp import web
+
+HEADER = ["Name", "Símbolo", "Mercado", "Último (Preço)", "%", "Data/Hora", "Link"]
+MARKETS = ["XPAR", "XAMS", "XBRU", "XLIS", "XOSL", "XMSM"]
+SECTORS = ["Technology", "Healthcare", "Finance", "Energy", "Consumer", "Industrial"]
+RESULT_PREFIX = "BENCH_RESULT "
+
+def ticker_for(company):
+    """Ticker só com letras (3 a 5), único por empresa."""
+    n = company + 26 * 26
+    chars = []
+    while n:
+        n, rest = divmod(n, 26)
+        chars.append(chr(ord("A") + rest))
+    return "".join(reversed(chars))
+
+def isin_for(company):
+    return f"NL{company:010d}"
+
+def company_for_isin(isin):
+    try:
+        return int(isin[2:])
+    except ValueError:
+        return None
+
+def _isin_only(company, isin_ratio):
+    # Empresas sem ticker utilizável: só o ISIN do Link (FMP_RESOLVE_ISIN)
+    return isin_ratio > 0 and (zlib.crc32(isin_for(company).encode()) % 10_000) < isin_ratio * 10_000
+
+def generate_csv(path, rows, duplicates=0.5, isin_ratio=0.0, seed=42):
+    """
+    CSV sintético com `rows` linhas; `duplicates` é a fração de linhas que repete o
+    ticker de uma linha anterior (ex.: a mesma ação em vários mercados).
+    Devolve o número de empresas distintas.
+    """
+    rng = random.Random(seed)
+    unique = max(1, round(rows * (1 - duplicates)))
+    companies = list(range(unique)) + [rng.randrange(unique) for _ in range(rows - unique)]
+    rng.shuffle(companies)
+
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for company in companies:
+            market = MARKETS[company % len(MARKETS)]
+            price = f"{rng.uniform(0.5, 500):.2f}".replace(".", ",")
+            change = f"{rng.uniform(-8, 8):+.2f}%".replace(".", ",")
+            writer.writerow([
+                f"Company {company}",
+                "-" if _isin_only(company, isin_ratio) else ticker_for(company),
+                market,
+                f"EUR {price}",
+                change,
+                "18/10/2026 17:35",
+                f"https://live.euronext.com/pt/product/equities/{isin_for(company)}-{market}",
+            ])
+    return unique
+
+class FmpStub:
+    """/profile (um ou vários símbolos) e /search-symbol com latência e 429 aleatórios."""
+    def __init__(self, latency=0.05, rate_429=0.0, retry_after=1, seed=42):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.counts = Counter()
+
+    def register(self, app, prefix="/fmp"):
+        app.router.add_get(f"{prefix}/profile", self.profile)
+        app.router.add_get(f"{prefix}/search-symbol", self.search_symbol)
+
+    def reset(self):
+        self.counts.clear()
+
+    def _rate_limited(self):
+        if self.rate_429 and self.random.random() < self.rate_429:
+            self.counts["rate_limited"] += 1
+            return web.Response(status=429, headers={"Retry-After": str(self.retry_after)})
+        return None
+
+    @staticmethod
+    def _profile(symbol):
+        h = zlib.crc32(symbol.encode())
+        return {
+            "symbol": symbol,
+            "mktCap": 10_000_000 + h % 50_000_000_000,
+            "sector": SECTORS[h % len(SECTORS)],
+            "industry": f"Industry {h % 40}",
+            "trailingPE": round(5 + (h % 4000) / 100, 2),
+        }
+
+    async def profile(self, request):
+        self.counts["profile"] += 1
+        limited = self._rate_limited()
+        if limited is not None:
+            return limited
+        await asyncio.sleep(self.latency)
+        symbols = [s for s in request.query.get("symbol", "").split(",") if s]
+        self.counts["profile_symbols"] += len(symbols)
+        return web.json_response([self._profile(symbol) for symbol in symbols])
+
+    async def search_symbol(self, request):
+        self.counts["search_symbol"] += 1
+        limited = self._rate_limited()
+        if limited is not None:
+            return limited
+        await asyncio.sleep(self.latency)
+        company = company_for_isin(request.query.get("query", "").upper())
+        if company is None:
+            return web.json_response([])
+        return web.json_response([{"symbol": ticker_for(company)}])
+
+class BucketStub:
+    """GET de objetos do Supabase Storage servido a partir de um ficheiro local."""
+    def __init__(self):
+        self.path = None
+        self.counts = Counter()
+
+    def register(self, app):
+        app.router.add_get("/storage/v1/object/{tail:.*}", self.get_object)
+
+    def reset(self):
+        self.counts.clear()
+
+    async def get_object(self, request):
+        self.counts["get"] += 1
+        if not self.path or not os.path.exists(self.path):
+            return web.Response(status=404)
+        self.counts["bytes"] += os.path.getsize(self.path)
+        return web.FileResponse(self.path)
+
+def _peak_rss_mb(who):
+    import resource
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux devolve KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+async def worker_main(args):
+    """Corre no subprocesso: um ciclo completo do processador sobre o stub do bucket."""
+    import resource
+    import metrics
+    from bucket import open_bucket_stream_async
+    from cpu_pool import shutdown_cpu_pool
+    from http_client import close_http_client, start_http_client
+    from processing import process_csv_stream_async
+
+    session = await start_http_client()
+    metrics.start_cycle()
+    started = time.perf_counter()
+    try:
+        async with open_bucket_stream_async(session) as stream:
+            if stream is None:
+                raise SystemExit("[BENCH] Stub do bucket não devolveu o CSV")
+            output_path = await process_csv_stream_async(
+                stream,
+                chunk_size=args.chunk_size,
+                batch_size=args.batch_size,
+                chunk_workers=args.chunk_workers,
+                cpu_workers=args.cpu_workers,
+            )
+    finally:
+        shutdown_cpu_pool()
+        await close_http_client()
+    elapsed = time.perf_counter() - started
+
+    summary = metrics.cycle_summary()
+    result = {
+        "seconds": elapsed,
+        "output": output_path,
+        "output_bytes": os.path.getsize(output_path) if output_path else 0,
+        "rows_written": summary["counters"].get("rows_total", 0),
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "counters": summary["counters"],
+        "stages": summary["stages"],
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+def worker_env(base_url, run_dir, args):
+    env = dict(os.environ)
+    env.update({
+        "FMP_API_KEY": "benchmark",
+        "FMP_API_BASE": f"{base_url}/fmp",
+        "URL": base_url,
+        "KEY": "benchmark",
+        "LEGACY_KEY": "benchmark",
+        "BUCKET_NAME": "bench",
+        "FILE_NAME": "euronext_acoes.csv",
+        "PROCESSED_PATH": os.path.join(run_dir, "Processed", "acoes_enriched.csv"),
+        "BUCKET_STATE_PATH": os.path.join(run_dir, "bucket_state.json"),
+        "SNAPSHOT_STATE_PATH": os.path.join(run_dir, "snapshot_state.json"),
+        "FMP_CACHE_PATH": os.path.join(run_dir, "fmp_cache.json"),
+        "FMP_CACHE_DB_PATH": os.path.join(run_dir, "fmp_cache.sqlite3"),
+        "ISIN_INDEX_PATH": os.path.join(run_dir, "isin_index.tsv.gz"),
+        "ISIN_INDEX_SEED": "",
+        # Sem quota nem limite de tickers: mede-se o pipeline, não o plano gratuito
+        "FMP_DAILY_LIMIT": "0",
+        "ENRICH_MAX_TICKERS": str(10 ** 9),
+        "FMP_RATE_PER_SEC": str(args.fmp_rate),
+        "FMP_RATE_BURST": str(args.fmp_rate),
+        "FMP_RESOLVE_ISIN": "1" if args.isin_ratio > 0 else "0",
+    })
+    for item in args.set:
+        key, _, value = item.partition("=")
+        env[key.strip()] = value
+    return env
+
+async def run_worker(args, env, run_dir):
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--chunk-size", str(args.chunk_size),
+        "--batch-size", str(args.batch_size),
+        "--chunk-workers", str(args.chunk_workers),
+        "--cpu-workers", str(args.cpu_workers),
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *command, cwd=run_dir, env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+    output, _ = await proc.communicate()
+    lines = output.decode("utf-8", errors="replace").splitlines()
+    if args.verbose:
+        print("\n".join(line for line in lines if not line.startswith(RESULT_PREFIX)))
+    result = next((line for line in reversed(lines) if line.startswith(RESULT_PREFIX)), None)
+    if proc.returncode != 0 or result is None:
+        print("\n".join(lines[-20:]))
+        raise SystemExit(f"[BENCH] Subprocesso terminou com código {proc.returncode}")
+    return json.loads(result[len(RESULT_PREFIX):])
+
+async def run_benchmark(args):
+    fmp = FmpStub(args.fmp_latency, args.rate_429, args.retry_after, args.seed)
+    bucket = BucketStub()
+    app = web.Application()
+    fmp.register(app)
+    bucket.register(app)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    base_url = f"http://{host}:{port}"
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    results = []
+    print(
+        f"{'linhas':>10} {'empresas':>9} {'tempo (s)':>10} {'linhas/s':>10} {'RSS (MB)':>9} "
+        f"{'pedidos FMP':>12} {'429':>5} {'search':>7} {'coalesc.':>9}"
+    )
+    try:
+        for rows in args.rows:
+            run_dir = os.path.join(workdir, f"run_{rows}")
+            os.makedirs(run_dir)
+            bucket.path = os.path.join(run_dir, "euronext_acoes.csv")
+            companies = generate_csv(bucket.path, rows, args.duplicates, args.isin_ratio, args.seed)
+            fmp.reset()
+            bucket.reset()
+
+            result = await run_worker(args, worker_env(base_url, run_dir, args), run_dir)
+            counters = result["counters"]
+            coalesced = sum(v for k, v in counters.items() if k.startswith("fmp_coalesced_total"))
+            result.update({
+                "rows": rows,
+                "companies": companies,
+                "rows_per_sec": rows / result["seconds"] if result["seconds"] else None,
+                "fmp_stub": dict(fmp.counts),
+                "bucket_stub": dict(bucket.counts),
+            })
+            results.append(result)
+            print(
+                f"{rows:>10} {companies:>9} {result['seconds']:>10.2f} {result['rows_per_sec']:>10.0f} "
+                f"{max(result['peak_rss_mb'], result['peak_rss_children_mb']):>9.1f} "
+                f"{fmp.counts['profile'] + fmp.counts['search_symbol']:>12} "
+                f"{fmp.counts['rate_limited']:>5} {fmp.counts['search_symbol']:>7} {coalesced:>9}"
+            )
+    finally:
+        await runner.cleanup()
+        if args.keep:
+            print(f"[BENCH] Ficheiros mantidos em {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.min_rows_per_sec:
+        slow = [r for r in results if (r["rows_per_sec"] or 0) < args.min_rows_per_sec]
+        if slow:
+            raise SystemExit(
+                f"[BENCH] Abaixo de {args.min_rows_per_sec} linhas/s: "
+                + ", ".join(f"{r['rows']} linhas ({r['rows_per_sec']:.0f}/s)" for r in slow)
+            )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--duplicates", type=float, default=0.5, help="fração de linhas com ticker repetido")
+    parser.add_argument("--isin-ratio", type=float, default=0.0, help="fração de empresas só com ISIN")
+    parser.add_argument("--fmp-latency", type=float, default=0.05, help="latência do stub FMP (s)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probabilidade de 429 por pedido")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After das respostas 429 (s)")
+    parser.add_argument("--fmp-rate", type=float, default=1000, help="FMP_RATE_PER_SEC do processador")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--chunk-workers", type=int, default=4)
+    parser.add_argument("--cpu-workers", type=int, default=0)
+    parser.add_argument("--set", action="append", default=[], metavar="VAR=VALOR",
+                        help="variável de ambiente extra para o processador")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--json", help="grava os resultados completos neste ficheiro")
+    parser.add_argument("--min-rows-per-sec", type=float, default=0,
+                        help="falha (código 1) se algum tamanho ficar abaixo deste débito")
+    parser.add_argument("--keep", action="store_true", help="não apaga os ficheiros gerados")
+    parser.add_argument("--verbose", action="store_true", help="mostra o output do processador")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        asyncio.run(worker_main(args))
+    else:
+        asyncio.run(run_benchmark(args))
+
+if __name__ == "__main__":
+    main()
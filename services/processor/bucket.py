@@ -1,57 +1,276 @@
 import asyncio
-import ssl
-import aiohttp
-from config import BUCKET_NAME, FILE_NAME, get_supabase_config
+import hashlib
+import json
+import os
+import time
+import tempfile
+from contextlib import asynccontextmanager
+from config import BUCKET_NAME, FILE_NAME, BUCKET_STATE_PATH, PROCESSED_PATH, get_supabase_config
+from http_client import SSL_CONTEXT, http_session
+from ingest import INGEST_RETRIES, INGEST_RETRY_DELAY, PollSchedule
+import metrics
+STREAM_BLOCK_SIZE = int(os.getenv("BUCKET_STREAM_BLOCK_SIZE", str(64 * 1024)))
+# Tentativas falhadas do mesmo snapshot antes de o dar como tratado
+BUCKET_MAX_FAILURES = int(os.getenv("BUCKET_MAX_FAILURES", "5"))
 
-try:
-    import certifi
-except ImportError:
-    certifi = None
+def _load_bucket_state(path=BUCKET_STATE_PATH):
+    try:
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"[BUCKET] Estado do snapshot ilegível, ignorando: {e}")
+    return {}
 
-def _build_ssl_context():
-    if not certifi:
-        return None
-    return ssl.create_default_context(cafile=certifi.where())
+def _save_bucket_state(state, path=BUCKET_STATE_PATH):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=True)
+    os.replace(tmp_path, path)
 
-SSL_CONTEXT = _build_ssl_context()
+def _conditional_headers(validators):
+    headers = {}
+    if not validators:
+        return headers
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
 
-async def download_from_bucket_async(session, bucket_name=BUCKET_NAME, file_name=FILE_NAME):
+def _update_validators(validators, resp):
+    if validators is None:
+        return
+    validators["etag"] = resp.headers.get("ETag")
+    validators["last_modified"] = resp.headers.get("Last-Modified")
+
+class BucketStream:
+    """
+    Corpo de um objeto do bucket lido em blocos. Calcula o SHA-256 à medida que os
+    bytes passam, sem nunca manter o ficheiro inteiro em memória. O consumidor marca
+    `processed` quando o snapshot foi tratado; só então poll_bucket_async avança o estado.
+    """
+    def __init__(self, resp, previous_digest=None, previous_size=None, block_size=STREAM_BLOCK_SIZE):
+        self._resp = resp
+        self._hasher = hashlib.sha256()
+        self._spool_path = None
+        self.block_size = block_size
+        self.previous_digest = previous_digest
+        self.previous_size = previous_size
+        self.etag = resp.headers.get("ETag")
+        # Com Content-Encoding o Content-Length conta os bytes comprimidos
+        self.content_length = None if resp.headers.get("Content-Encoding") else resp.content_length
+        self.bytes_read = 0
+        self.complete = False
+        self.processed = False
+
+    async def _read_response(self):
+        # O tempo de "download" inclui o consumo do stream (parse corre em paralelo)
+        started = time.perf_counter()
+        async for block in self._resp.content.iter_chunked(self.block_size):
+            self._hasher.update(block)
+            self.bytes_read += len(block)
+            metrics.inc("bytes_downloaded_total", len(block))
+            yield block
+        self.complete = True
+        metrics.observe("stage_seconds", time.perf_counter() - started, stage="download")
+
+    async def __aiter__(self):
+        if self._spool_path is None:
+            async for block in self._read_response():
+                yield block
+            return
+        with open(self._spool_path, "rb") as f:
+            while True:
+                block = await asyncio.to_thread(f.read, self.block_size)
+                if not block:
+                    return
+                yield block
+
+    async def matches_previous(self):
+        """
+        Compara o conteúdo com o último snapshot antes de o processar. Um tamanho
+        diferente (Content-Length) chega para saber que mudou e o stream segue direto;
+        com o mesmo tamanho (ou sem Content-Length) o objeto é copiado para disco
+        enquanto se calcula o SHA-256, e o pipeline lê depois essa cópia.
+        """
+        if not self.previous_digest:
+            return False
+        if None not in (self.content_length, self.previous_size) and self.content_length != self.previous_size:
+            return False
+        fd, self._spool_path = tempfile.mkstemp(
+            prefix="bucket_", suffix=".part", dir=os.path.dirname(PROCESSED_PATH) or None
+        )
+        with os.fdopen(fd, "wb") as f:
+            async for block in self._read_response():
+                await asyncio.to_thread(f.write, block)
+        return self.unchanged
+
+    def close(self):
+        if self._spool_path and os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+        self._spool_path = None
+
+    @property
+    def digest(self):
+        return self._hasher.hexdigest() if self.complete else None
+
+    @property
+    def unchanged(self):
+        return self.complete and self.digest == self.previous_digest
+
+@asynccontextmanager
+async def open_bucket_stream_async(session, bucket_name=BUCKET_NAME, file_name=FILE_NAME, validators=None, previous_digest=None, previous_size=None):
+    """
+    Pedido (condicional, com `validators`) ao objeto do bucket: devolve um BucketStream
+    com a resposta aberta (ou None em 304/404/erro) e atualiza os validadores.
+    """
     url, key = get_supabase_config()
     if not url or not key:
         print("[ERROR] Configuração Supabase inválida.")
-        return None
+        yield None
+        return
 
     storage_url = f"{url}/storage/v1/object/{bucket_name}/{file_name}"
-    headers = {"Authorization": f"Bearer {key}", "apikey": key}
+    conditional = _conditional_headers(validators)
+    headers = {"Authorization": f"Bearer {key}", "apikey": key, **conditional}
 
     async with session.get(storage_url, headers=headers, ssl=SSL_CONTEXT) as resp:
-        if resp.status == 404:
-            return None
         if resp.status in (400, 401, 403):
             storage_url = f"{url}/storage/v1/object/public/{bucket_name}/{file_name}"
-            async with session.get(storage_url, ssl=SSL_CONTEXT) as resp_public:
-                if resp_public.status != 200:
+            async with session.get(storage_url, headers=conditional, ssl=SSL_CONTEXT) as resp_public:
+                if resp_public.status not in (200, 304):
                     print(f"[ERROR] Download público falhou: {resp_public.status}")
-                    return None
-                return await resp_public.read()
-        if resp.status != 200:
+                if resp_public.status != 200:
+                    yield None
+                    return
+                _update_validators(validators, resp_public)
+                stream = BucketStream(resp_public, previous_digest, previous_size)
+                try:
+                    yield stream
+                finally:
+                    stream.close()
+                return
+        if resp.status not in (200, 304, 404):
             print(f"[ERROR] Download falhou: {resp.status}")
+        if resp.status != 200:
+            yield None
+            return
+        _update_validators(validators, resp)
+        stream = BucketStream(resp, previous_digest, previous_size)
+        try:
+            yield stream
+        finally:
+            stream.close()
+
+async def _wait_for_trigger(trigger, delay, state):
+    """
+    Espera `delay` segundos ou por uma notificação de um objeto ainda não processado.
+    Devolve a notificação, ou None no fim do intervalo.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + delay
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
             return None
-        return await resp.read()
+        if trigger is None:
+            await asyncio.sleep(remaining)
+            return None
+        notification = await trigger.wait(remaining)
+        if notification is None:
+            return None
+        if notification["digest"] and notification["digest"] == state.get("sha256"):
+            print("[BUCKET] Notificação de um objeto já processado (mesmo SHA-256), ignorando.")
+            continue
+        return notification
+
+async def poll_bucket_async(interval=None, trigger=None):
+    """
+    Faz polling condicional do bucket e devolve o objeto como BucketStream, para ser
+    consumido em stream. Objetos sem alterações custam um 304. O estado (validadores
+    + SHA-256) só é persistido se o consumidor marcar `stream.processed`, por isso um
+    restart não reprocessa o mesmo ficheiro e um snapshot que falhou volta a ser pedido
+    no próximo poll, até BUCKET_MAX_FAILURES vezes (contadas por SHA-256 no estado). `await stream.matches_previous()` diz, antes de processar, se o
+    conteúdo é igual ao último snapshot apesar de o ETag ter mudado.
 
-async def poll_bucket_async(interval=60):
-    last_hash = None
-    async with aiohttp.ClientSession() as session:
+    Com `trigger` (IngestTrigger) uma notificação /ingest faz o próximo poll de
+    imediato; o polling periódico fica como recurso, com intervalo adaptativo
+    (PollSchedule, mínimo `interval`) e jitter.
+    """
+    state = _load_bucket_state()
+    schedule = PollSchedule(min_interval=interval)
+    if trigger is not None:
+        trigger.bind()
+    notified = False
+    expected_digest = None
+    retries = 0
+    async with http_session() as session:
         while True:
-            content = await download_from_bucket_async(session)
-            if content:
-                new_hash = hash(content)
-                if new_hash != last_hash:
-                    last_hash = new_hash
-                    yield content
-            await asyncio.sleep(interval)
-
-async def delete_from_bucket_async(bucket_name=BUCKET_NAME, file_name=FILE_NAME):
+            metrics.inc("bucket_polls_total", reason="notification" if notified else "fallback")
+            found = False
+            validators = {"etag": state.get("etag"), "last_modified": state.get("last_modified")}
+            async with open_bucket_stream_async(
+                session, validators=validators,
+                previous_digest=state.get("sha256"), previous_size=state.get("size"),
+            ) as stream:
+                if stream is not None:
+                    yield stream
+                    if stream.processed and stream.complete:
+                        found = True
+                        state = {**validators, "sha256": stream.digest, "size": stream.bytes_read}
+                        _save_bucket_state(state)
+                    else:
+                        state = _record_failure(state, stream, validators)
+                        found = "failures" not in state
+
+            # Notificação de um digest que o bucket ainda não serviu (upload a propagar):
+            # repete daqui a pouco em vez de esperar pelo polling de recurso
+            if expected_digest and expected_digest != state.get("sha256") and retries < INGEST_RETRIES:
+                retries += 1
+                delay = INGEST_RETRY_DELAY
+            else:
+                expected_digest, retries = None, 0
+                delay = schedule.next_delay(found, notified)
+
+            notification = await _wait_for_trigger(trigger, delay, state)
+            notified = notification is not None
+            if notified:
+                print(f"[BUCKET] Notificação de ingestão recebida ({notification['path']}).")
+                if notification["digest"] != expected_digest:
+                    expected_digest, retries = notification["digest"], 0
+
+def _record_failure(state, stream, validators):
+    """
+    Falha no processamento ou no envio: o estado fica como estava e o objeto volta a
+    ser pedido (o intervalo cresce como sem novidades). Ao fim de BUCKET_MAX_FAILURES
+    falhas do mesmo conteúdo (SHA-256, ou o ETag se o stream não chegou ao fim) o
+    snapshot fica dado como tratado, para não ser descarregado e processado para sempre.
+    """
+    key = stream.digest or f"etag:{validators.get('etag')}"
+    failures = state.get("failures") or {}
+    count = failures.get(key, 0) + 1
+    if count < BUCKET_MAX_FAILURES:
+        print(f"[BUCKET] Snapshot não processado ({count}/{BUCKET_MAX_FAILURES}), será repetido no próximo poll.")
+        state = {**state, "failures": {key: count}}
+    else:
+        print(f"[BUCKET] Snapshot falhou {count} vezes ({key}), marcado como tratado sem envio.")
+        metrics.inc("bucket_snapshots_abandoned_total")
+        state = {**validators, "sha256": stream.digest, "size": stream.bytes_read if stream.complete else None}
+    _save_bucket_state(state)
+    return state
+
+def _normalize_etag(tag):
+    return tag.strip().removeprefix("W/").strip('"')
+
+async def delete_from_bucket_async(bucket_name=BUCKET_NAME, file_name=FILE_NAME, etag=None):
+    """
+    Apaga o objeto do bucket. Com `etag` (o do objeto que foi processado) só apaga se
+    o objeto ainda for esse: um snapshot mais recente com o mesmo nome fica intacto.
+    """
     url, key = get_supabase_config()
     if not url or not key:
         print("[ERROR] Configuração Supabase inválida para delete.")
@@ -59,8 +278,23 @@ async def delete_from_bucket_async(bucket_name=BUCKET_NAME, file_name=FILE_NAME)
 
     storage_url = f"{url}/storage/v1/object/{bucket_name}/{file_name}"
     headers = {"Authorization": f"Bearer {key}", "apikey": key}
-    async with aiohttp.ClientSession() as session:
+    async with http_session() as session:
+        if etag:
+            async with session.head(storage_url, headers=headers, ssl=SSL_CONTEXT) as resp:
+                if resp.status == 404:
+                    return True
+                current = resp.headers.get("ETag")
+                if resp.status != 200 or not current:
+                    print(f"[BUCKET] Delete adiado: ETag atual indisponível (HTTP {resp.status}).")
+                    return False
+                if _normalize_etag(current) != _normalize_etag(etag):
+                    print(f"[BUCKET] {file_name} foi substituído por um snapshot mais recente, não apagado.")
+                    return False
+            headers["If-Match"] = etag
         async with session.delete(storage_url, headers=headers, ssl=SSL_CONTEXT) as resp:
+            if resp.status == 412:
+                print(f"[BUCKET] {file_name} foi substituído por um snapshot mais recente, não apagado.")
+                return False
             if resp.status not in (200, 204):
                 print(f"[ERROR] Delete bucket falhou: {resp.status}")
                 return False
@@ -0,0 +1,121 @@
+import os
+import json
+import sqlite3
+
+def _read_json(path):
+    try:
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"[CACHE] Ficheiro de cache ilegível ({path}): {e}")
+    return {}
+
+class JsonCacheStore:
+    """
+    Cache num único ficheiro JSON (formato original). Cada flush reescreve o
+    ficheiro inteiro, por isso só deve ser chamado de forma agrupada.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, namespaces):
+        data = _read_json(self.path)
+        return {
+            "meta": {"date": data.get("date"), "count": data.get("count")},
+            **{ns: dict(data.get(ns, {})) for ns in namespaces},
+        }
+
+    def flush(self, state, dirty):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        payload = {**state["meta"], **{ns: state[ns] for ns in state if ns != "meta"}}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=True, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+class SqliteCacheStore:
+    """
+    Cache em SQLite: cada flush só grava as entradas alteradas (upsert/delete)
+    numa única transação. Na primeira utilização importa o JSON antigo, se existir.
+    """
+    def __init__(self, path, import_path=None):
+        self.path = path
+        self.import_path = import_path
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _is_empty(self, conn):
+        has_entries = conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone()
+        has_meta = conn.execute("SELECT 1 FROM meta LIMIT 1").fetchone()
+        return not has_entries and not has_meta
+
+    def load(self, namespaces):
+        conn = self._connect()
+        if self._is_empty(conn) and self.import_path and os.path.exists(self.import_path):
+            state = JsonCacheStore(self.import_path).load(namespaces)
+            self.flush(state, {ns: set(state[ns]) for ns in namespaces} | {"meta": True})
+            print(f"[CACHE] Cache importada de {self.import_path} para {self.path}")
+
+        state = {ns: {} for ns in namespaces}
+        for namespace, key, value in conn.execute("SELECT namespace, key, value FROM entries"):
+            if namespace in state:
+                state[namespace][key] = json.loads(value)
+        state["meta"] = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+        return state
+
+    def flush(self, state, dirty):
+        conn = self._connect()
+        with conn:
+            for namespace, keys in dirty.items():
+                if namespace == "meta":
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        [(key, json.dumps(value)) for key, value in state["meta"].items()],
+                    )
+                    continue
+                entries = state.get(namespace, {})
+                upserts = [
+                    (namespace, key, json.dumps(entries[key], ensure_ascii=True))
+                    for key in keys if key in entries
+                ]
+                deletes = [(namespace, key) for key in keys if key not in entries]
+                if upserts:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO entries (namespace, key, value) VALUES (?, ?, ?)",
+                        upserts,
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", deletes)
+
+def get_cache_store():
+    """
+    Escolhe o backend por FMP_CACHE_BACKEND (sqlite | json). Lido na chamada, depois
+    de os ficheiros .env terem sido carregados.
+    """
+    backend = os.getenv("FMP_CACHE_BACKEND", "sqlite").lower()
+    json_path = os.getenv("FMP_CACHE_PATH", "data/cache/fmp_cache.json")
+    if backend == "json":
+        return JsonCacheStore(json_path)
+    if backend != "sqlite":
+        print(f"[CACHE] Backend desconhecido '{backend}', usando sqlite.")
+    db_path = os.getenv("FMP_CACHE_DB_PATH", "data/cache/fmp_cache.sqlite3")
+    return SqliteCacheStore(db_path, import_path=json_path)
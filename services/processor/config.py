@@ -37,6 +37,28 @@ for key, value in load_env().items():
 BUCKET_NAME = os.getenv("BUCKET_NAME", "data")
 FILE_NAME = os.getenv("FILE_NAME", "Crawler/euronext_acoes.csv")
 PROCESSED_PATH = os.getenv("PROCESSED_PATH", "data/Processed/acoes_enriched.csv")
+# Estado do último snapshot do bucket (ETag/Last-Modified + SHA-256), sobrevive a restarts
+BUCKET_STATE_PATH = os.getenv(
+    "BUCKET_STATE_PATH",
+    os.path.join(os.path.dirname(PROCESSED_PATH), "bucket_state.json"),
+)
+# Último snapshot processado (fingerprint + enriquecimento por linha) para delta processing
+SNAPSHOT_STATE_PATH = os.getenv(
+    "SNAPSHOT_STATE_PATH",
+    os.path.join(os.path.dirname(PROCESSED_PATH), "snapshot_state.json"),
+)
+
+# Pedidos enviados ao XML Service à espera de webhook (SQLite), sobrevivem a restarts
+PENDING_STATE_PATH = os.getenv(
+    "PENDING_STATE_PATH",
+    os.path.join(os.path.dirname(PROCESSED_PATH), "pending_requests.sqlite3"),
+)
+
+# Outbox: cópias (nome único) dos ficheiros cujo envio ao XML Service falhou
+OUTBOX_DIR = os.getenv(
+    "OUTBOX_DIR",
+    os.path.join(os.path.dirname(PROCESSED_PATH), "outbox"),
+)
 
 WEBHOOK_XML_URL = os.getenv("WEBHOOK_XML_URL") or os.getenv("XML_SERVICE_URL")
 JAVA_WEBHOOK_URL = os.getenv("JAVA_WEBHOOK_URL")
@@ -45,8 +67,6 @@ MAPPER_VERSION = os.getenv("MAPPER_VERSION", "1.0")
 RPC_SERVICE_URL = os.getenv("RPC_SERVICE_URL")
 GRPC_SERVICE_ADDR = os.getenv("GRPC_SERVICE_ADDR")
 
-PENDING_REQUESTS = {}
-
 # Supabase config
 def get_supabase_config():
     env = load_env()
@@ -0,0 +1,51 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Start method dos workers: "spawn" evita herdar threads/sockets do processo principal
+CPU_POOL_START_METHOD = os.getenv("CPU_POOL_START_METHOD", "spawn")
+
+_EXECUTOR = None
+_EXECUTOR_WORKERS = 0
+_CAPPED_WARNED = False
+
+def configure_cpu_pool(workers):
+    """
+    Cria (ou redimensiona) o ProcessPoolExecutor das etapas CPU dos chunks.
+    Com 0 workers as etapas correm no próprio event loop, como antes. O pool nunca
+    passa dos cores livres (cpu_count - 1): sem eles só acrescenta pickling.
+    """
+    global _EXECUTOR, _EXECUTOR_WORKERS, _CAPPED_WARNED
+    requested = max(0, int(workers or 0))
+    workers = min(requested, max(0, (os.cpu_count() or 1) - 1))
+    if workers < requested and not _CAPPED_WARNED:
+        print(f"[PROCESSOR] {requested} processos CPU pedidos, só {workers} cores livres")
+        _CAPPED_WARNED = True
+    if workers == _EXECUTOR_WORKERS:
+        return _EXECUTOR
+    shutdown_cpu_pool()
+    if workers > 0:
+        context = multiprocessing.get_context(CPU_POOL_START_METHOD)
+        _EXECUTOR = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        _EXECUTOR_WORKERS = workers
+        print(f"[PROCESSOR] Pool de {workers} processos para as etapas CPU dos chunks")
+    return _EXECUTOR
+
+def shutdown_cpu_pool():
+    global _EXECUTOR, _EXECUTOR_WORKERS
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown(wait=True, cancel_futures=True)
+    _EXECUTOR = None
+    _EXECUTOR_WORKERS = 0
+
+async def run_cpu(func, *args):
+    """
+    Corre `func(*args)` no pool de processos (argumentos e resultado vão em pickle:
+    DataFrames viajam como blocos numpy), ou diretamente se o pool estiver desligado.
+    `func` tem de ser uma função de topo de módulo.
+    """
+    if _EXECUTOR is None:
+        return func(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, func, *args)
@@ -1,3 +1,4 @@
+import os
 from grpc import aio
 from config import GRPC_SERVICE_ADDR
 from processing_hints_pb2 import HintsRequest
@@ -7,6 +8,8 @@ DEFAULT_HINTS = {
     "chunk_size": 200,
     "batch_size": 20,
     "batch_delay": 0.05,
+    "chunk_workers": 4,
+    "cpu_workers": int(os.getenv("CPU_WORKERS", "0")),
 }
 
 async def fetch_processing_hints(source="euronext"):
@@ -20,6 +23,8 @@ async def fetch_processing_hints(source="euronext"):
                 "chunk_size": response.chunk_size or DEFAULT_HINTS["chunk_size"],
                 "batch_size": response.batch_size or DEFAULT_HINTS["batch_size"],
                 "batch_delay": response.batch_delay or DEFAULT_HINTS["batch_delay"],
+                "chunk_workers": response.chunk_workers or DEFAULT_HINTS["chunk_workers"],
+                "cpu_workers": response.cpu_workers or DEFAULT_HINTS["cpu_workers"],
             }
     except Exception as exc:
         print(f"[gRPC] Falha ao obter hints: {exc}")
@@ -0,0 +1,59 @@
+import os
+import ssl
+import asyncio
+from contextlib import asynccontextmanager
+import aiohttp
+
+try:
+    import certifi
+except ImportError:
+    certifi = None
+
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where()) if certifi else None
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+
+_SESSION = None
+_SESSION_LOOP = None
+
+def _build_connector():
+    return aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        ssl=SSL_CONTEXT,
+    )
+
+async def start_http_client():
+    """
+    Cria a sessão HTTP partilhada pelo processador (bucket, FMP e XML Service):
+    um único pool de ligações keep-alive, com limite por host e cache de DNS.
+    """
+    global _SESSION, _SESSION_LOOP
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(connector=_build_connector())
+        _SESSION_LOOP = asyncio.get_running_loop()
+    return _SESSION
+
+async def close_http_client():
+    global _SESSION, _SESSION_LOOP
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+    _SESSION_LOOP = None
+
+@asynccontextmanager
+async def http_session():
+    """
+    Devolve a sessão partilhada quando existe neste event loop; caso contrário (scripts,
+    benchmarks, outras threads) abre uma sessão temporária com a mesma configuração.
+    """
+    if _SESSION is not None and not _SESSION.closed and _SESSION_LOOP is asyncio.get_running_loop():
+        yield _SESSION
+        return
+    async with aiohttp.ClientSession(connector=_build_connector()) as session:
+        yield session
@@ -0,0 +1,99 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from config import BUCKET_NAME, FILE_NAME
+import metrics
+
+# Token partilhado com quem notifica (header X-Ingest-Token); vazio aceita qualquer um
+INGEST_TOKEN = os.getenv("INGEST_TOKEN")
+# Notificação com um digest que o bucket ainda não serve: novas tentativas curtas
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "5"))
+INGEST_RETRIES = int(os.getenv("INGEST_RETRIES", "3"))
+# Polling de recurso: intervalo adaptativo com jitter
+BUCKET_POLL_MIN_INTERVAL = float(os.getenv("BUCKET_POLL_MIN_INTERVAL", "60"))
+BUCKET_POLL_MAX_INTERVAL = float(os.getenv("BUCKET_POLL_MAX_INTERVAL", "900"))
+BUCKET_POLL_BACKOFF = float(os.getenv("BUCKET_POLL_BACKOFF", "2"))
+BUCKET_POLL_JITTER = float(os.getenv("BUCKET_POLL_JITTER", "0.2"))
+
+def _is_watched_object(path, bucket=None):
+    if bucket and bucket != BUCKET_NAME:
+        return False
+    if not path:
+        return True
+    path = path.lstrip("/")
+    return path in (FILE_NAME, f"{BUCKET_NAME}/{FILE_NAME}")
+
+class IngestTrigger:
+    """
+    Notificações /ingest (crawler ou webhook do bucket) que acordam o poll do bucket.
+    notify() é thread-safe; só a última notificação conta.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._event = None
+        self._pending = None
+
+    def bind(self):
+        """Liga o trigger ao event loop corrente (chamado por poll_bucket_async)."""
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        with self._lock:
+            if self._pending is not None:
+                self._event.set()
+
+    def notify(self, path=None, digest=None, bucket=None):
+        """Regista uma notificação. Devolve False se for de outro objeto do bucket."""
+        if not _is_watched_object(path, bucket):
+            return False
+        with self._lock:
+            self._pending = {
+                "path": path or FILE_NAME,
+                "digest": (digest or "").lower() or None,
+                "received": time.time(),
+            }
+        metrics.inc("ingest_notifications_total")
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._event.set)
+        return True
+
+    async def wait(self, timeout):
+        """Espera até `timeout` segundos por uma notificação; devolve-a, ou None."""
+        if self._event is None:
+            await asyncio.sleep(timeout)
+            return None
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        with self._lock:
+            pending, self._pending = self._pending, None
+        return pending
+
+class PollSchedule:
+    """
+    Intervalo do polling de recurso. Volta ao mínimo quando o polling encontra um
+    objeto novo sem notificação, vai para o máximo quando as notificações funcionam
+    e cresce BUCKET_POLL_BACKOFF vezes a cada poll sem novidades.
+    """
+    def __init__(self, min_interval=None, max_interval=None, backoff=None, jitter=None):
+        self.min_interval = min_interval or BUCKET_POLL_MIN_INTERVAL
+        self.max_interval = max(self.min_interval, max_interval or BUCKET_POLL_MAX_INTERVAL)
+        self.backoff = max(1.0, backoff or BUCKET_POLL_BACKOFF)
+        self.jitter = min(1.0, max(0.0, BUCKET_POLL_JITTER if jitter is None else jitter))
+        self.interval = self.min_interval
+
+    def next_delay(self, found, notified):
+        if notified:
+            self.interval = self.max_interval
+        elif found:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+INGEST_TRIGGER = IngestTrigger()
@@ -0,0 +1,160 @@
+"""
+Índice local ISIN -> símbolo, para FMP_RESOLVE_ISIN não gastar um pedido
+/search-symbol por cada ISIN novo.
+
+Guardado em ISIN_INDEX_PATH como TSV comprimido (gzip, uma linha "ISIN\\tSÍMBOLO")
+e carregado no arranque do processador numa thread (`await load_async()`), ou na
+primeira consulta se não tiver sido pré-carregado. Semeado a partir de um ficheiro
+de referência (CSV com colunas isin e symbol/ticker, ex.: export do profile-bulk da
+FMP) ou do download do profile-bulk:
+
+    python isin_index.py --seed referencia.csv [outro.csv ...]
+    python isin_index.py --download
+
+Se o índice não existir e ISIN_INDEX_SEED apontar para um ficheiro de referência,
+é construído a partir dele ao carregar.
+"""
+import os
+import re
+import gzip
+import argparse
+import asyncio
+import pandas as pd
+
+ISIN_RE = re.compile(r"^[A-Z]{2}[A-Z0-9]{10}$")
+DEFAULT_INDEX_PATH = "data/cache/isin_index.tsv.gz"
+
+def read_reference(path):
+    """Lê um CSV de referência (delimitador detetado) e devolve {ISIN: símbolo}."""
+    wanted = ("isin", "symbol", "ticker")
+    df = pd.read_csv(
+        path,
+        sep=None,
+        engine="python",
+        dtype=str,
+        usecols=lambda col: str(col).strip().lower() in wanted,
+    )
+    df.columns = [str(col).strip().lower() for col in df.columns]
+    symbol_col = "symbol" if "symbol" in df.columns else "ticker"
+    if "isin" not in df.columns or symbol_col not in df.columns:
+        raise ValueError(f"{path}: colunas 'isin' e 'symbol'/'ticker' não encontradas")
+
+    isin = df["isin"].str.strip().str.upper()
+    symbol = df[symbol_col].str.strip().str.upper()
+    valid = isin.str.match(ISIN_RE.pattern, na=False) & symbol.notna() & (symbol != "")
+    return dict(zip(isin[valid], symbol[valid]))
+
+class IsinIndex:
+    """Mapa ISIN -> símbolo carregado do disco na primeira consulta."""
+    def __init__(self, path=None, seed_path=None):
+        self.path = path or os.getenv("ISIN_INDEX_PATH", DEFAULT_INDEX_PATH)
+        self.seed_path = seed_path if seed_path is not None else os.getenv("ISIN_INDEX_SEED")
+        self._entries = None
+
+    @property
+    def loaded(self):
+        return self._entries is not None
+
+    def _load(self):
+        entries = {}
+        try:
+            if self.path and os.path.exists(self.path):
+                with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        isin, _, symbol = line.rstrip("\n").partition("\t")
+                        if symbol:
+                            entries[isin] = symbol
+            elif self.seed_path and os.path.exists(self.seed_path):
+                entries = read_reference(self.seed_path)
+                self._entries = entries
+                self.save()
+                print(f"[ISIN] Índice criado a partir de {self.seed_path} ({len(entries)} ISINs)")
+        except Exception as e:
+            print(f"[ISIN] Índice ilegível ({self.path}): {e}")
+        self._entries = entries
+        return entries
+
+    async def load_async(self):
+        """Carrega o índice numa thread (gzip + parse do CSV de referência fora do event loop)."""
+        if self._entries is None:
+            await asyncio.to_thread(self._load)
+        return self
+
+    def get(self, isin):
+        entries = self._entries if self._entries is not None else self._load()
+        return entries.get(isin)
+
+    def __len__(self):
+        return len(self._entries) if self._entries is not None else 0
+
+    def update(self, mapping):
+        entries = self._entries if self._entries is not None else self._load()
+        entries.update(mapping)
+
+    def save(self):
+        if not self.path or self._entries is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for isin in sorted(self._entries):
+                f.write(f"{isin}\t{self._entries[isin]}\n")
+        os.replace(tmp_path, self.path)
+
+_INDEX = None
+
+def get_isin_index():
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = IsinIndex()
+    return _INDEX
+
+async def download_bulk(dest_dir, max_parts=100):
+    """
+    Descarrega as partes do profile-bulk da FMP para `dest_dir` (uma vez, fora do
+    ciclo normal) e devolve os caminhos gravados.
+    """
+    from http_client import SSL_CONTEXT, http_session
+    from utils import FMP_API_BASE, FMP_API_KEY
+
+    os.makedirs(dest_dir, exist_ok=True)
+    paths = []
+    async with http_session() as session:
+        for part in range(max_parts):
+            url = f"{FMP_API_BASE}/profile-bulk?part={part}&apikey={FMP_API_KEY}"
+            async with session.get(url, timeout=300, ssl=SSL_CONTEXT) as resp:
+                if resp.status != 200:
+                    if part == 0:
+                        print(f"[ISIN] profile-bulk indisponível: HTTP {resp.status}")
+                    break
+                body = await resp.read()
+            if not body.strip() or body.count(b"\n") < 1:
+                break
+            path = os.path.join(dest_dir, f"profile_bulk_{part}.csv")
+            with open(path, "wb") as f:
+                f.write(body)
+            paths.append(path)
+            print(f"[ISIN] profile-bulk parte {part} gravada em {path}")
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Cria/atualiza o índice local ISIN -> símbolo.")
+    parser.add_argument("--seed", nargs="+", default=[], help="CSV(s) de referência com isin e symbol")
+    parser.add_argument("--download", action="store_true", help="descarrega o profile-bulk da FMP")
+    parser.add_argument("--bulk-dir", default="data/cache/profile_bulk")
+    args = parser.parse_args()
+
+    sources = list(args.seed)
+    if args.download:
+        sources += asyncio.run(download_bulk(args.bulk_dir))
+    if not sources:
+        parser.error("indique --seed e/ou --download")
+
+    index = IsinIndex(seed_path="")
+    for path in sources:
+        index.update(read_reference(path))
+    index.save()
+    print(f"[ISIN] Índice gravado em {index.path} ({len(index)} ISINs)")
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,98 @@
 import asyncio
-from webhook import start_flask_webhook
+from webhook import start_webhook_server, stop_webhook_server
 from bucket import poll_bucket_async
-from processing import process_csv_stream_async
-from xml_client import send_to_xml_service_async
+from processing import process_csv_stream_async, open_snapshot, ProcessingError
+from xml_client import send_to_xml_service_async, resend_pending_request
 from config import PROCESSOR_WEBHOOK_PORT
 from grpc_client import fetch_processing_hints
+from http_client import start_http_client, close_http_client
+from cpu_pool import shutdown_cpu_pool
+from ingest import INGEST_TRIGGER
+from pending_store import get_pending_store, run_pending_sweeper
+from outbox import get_outbox
+from isin_index import get_isin_index
+from utils import FMP_RESOLVE_ISIN
+import metrics
 
-async def main_loop_async():
-    start_flask_webhook(PROCESSOR_WEBHOOK_PORT)
-    print("[PROCESSOR] Monitorização do bucket iniciada...")
+def _commit_snapshot(snapshot):
+    if snapshot is not None:
+        snapshot.commit()
+
+async def process_cycle(stream):
+    """
+    Processa e envia um snapshot. Devolve True se ficou tratado (enviado, em fila no
+    outbox ou sem nada a enviar); False deixa o snapshot por processar. O snapshot do
+    delta processing só é gravado quando o ciclo fica tratado.
+    """
+    try:
+        unchanged = await stream.matches_previous()
+    except Exception as e:
+        print(f"[PROCESSOR] Erro ao descarregar o CSV, o snapshot será repetido: {e}")
+        return False
+    if unchanged:
+        # Mesmo conteúdo com outro ETag: nada de enriquecimento nem envio
+        print("[PROCESSOR] Conteudo igual ao ultimo snapshot (SHA-256), ignorando.")
+        return True
 
-    async for content in poll_bucket_async(interval=60):
-        print("[PROCESSOR] Novo CSV detectado. Processando...")
-        hints = await fetch_processing_hints()
+    hints = await fetch_processing_hints()
+    snapshot = open_snapshot()
+    try:
         csv_path = await process_csv_stream_async(
-            content,
+            stream,
             chunk_size=hints["chunk_size"],
             batch_size=hints["batch_size"],
-            batch_delay=hints["batch_delay"]
+            batch_delay=hints["batch_delay"],
+            chunk_workers=hints["chunk_workers"],
+            cpu_workers=hints["cpu_workers"],
+            snapshot=snapshot
         )
-        if not csv_path:
-            print("[PROCESSOR] CSV processado invalido, ignorando envio.")
-            continue
+    except ProcessingError as e:
+        print(f"[PROCESSOR] Processamento falhou, o snapshot será repetido: {e}")
+        return False
+    if not csv_path:
+        print("[PROCESSOR] Nenhuma linha a enviar, ignorando envio.")
+        _commit_snapshot(snapshot)
+        return True
+
+    print("[PROCESSOR] Enviando dados para XML Service...")
+    try:
+        id_req = await send_to_xml_service_async(csv_path, bucket_etag=stream.etag)
+        print(f"[PROCESSOR] Requisição enviada: {id_req}")
+    except Exception as e:
+        print(f"[PROCESSOR] Erro ao enviar para XML Service: {e}")
+        return False
+    _commit_snapshot(snapshot)
+    return True
+
+async def main_loop_async():
+    await start_http_client()
+    background = []
+    webhook_runner = None
+    try:
+        if FMP_RESOLVE_ISIN:
+            # Carregado já, numa thread, para a primeira consulta não bloquear o event loop
+            await get_isin_index().load_async()
+        pending = get_pending_store().load()
+        background.append(asyncio.create_task(run_pending_sweeper(pending, resend_pending_request)))
+        # Envios falhados ficam no outbox; o ciclo segue para o próximo snapshot
+        background.append(asyncio.create_task(get_outbox().load().run(resend_pending_request)))
+        webhook_runner = await start_webhook_server(PROCESSOR_WEBHOOK_PORT)
+        print("[PROCESSOR] Monitorização do bucket iniciada...")
 
-        print("[PROCESSOR] Enviando dados para XML Service...")
-        try:
-            id_req = await send_to_xml_service_async(csv_path)
-            print(f"[PROCESSOR] Requisição enviada: {id_req}")
-        except Exception as e:
-            print(f"[PROCESSOR] Erro ao enviar para XML Service: {e}")
+        async for stream in poll_bucket_async(trigger=INGEST_TRIGGER):
+            print("[PROCESSOR] Novo CSV detectado. Processando...")
+            metrics.start_cycle()
+            try:
+                stream.processed = await process_cycle(stream)
+            finally:
+                metrics.log_cycle_summary()
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await stop_webhook_server(webhook_runner)
+        shutdown_cpu_pool()
+        await close_http_client()
 
 if __name__ == "__main__":
     asyncio.run(main_loop_async())
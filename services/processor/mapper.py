@@ -1,4 +1,6 @@
+from functools import lru_cache
 import pandas as pd
+from config import MAPPER_VERSION
 
 MAPPER_SCHEMA = {
     "Nome": ["Name", "name", "Nome"],
@@ -10,14 +12,64 @@ MAPPER_SCHEMA = {
     "Link": ["Link"],
 }
 
-def first_existing_column(df, columns):
-    for col in columns:
-        if col in df.columns:
-            return df[col]
-    return pd.Series([None] * len(df))
+# Esquemas por versão: coluna de destino -> colunas de origem por ordem de preferência
+MAPPER_SCHEMAS = {
+    "1.0": MAPPER_SCHEMA,
+}
+DEFAULT_SCHEMA_VERSION = "1.0"
+
+# Valor e dtype das colunas de destino sem nenhuma coluna de origem no CSV
+MAPPER_DEFAULTS = {
+    "1.0": {col: (None, "object") for col in MAPPER_SCHEMA},
+}
+
+class MappingPlan:
+    """
+    Plano compilado para um cabeçalho: colunas de origem a selecionar e renomear e
+    colunas de destino a criar com o valor por omissão. Aplicar o plano a um chunk é
+    uma única seleção/renomeação vetorizada.
+    """
+    def __init__(self, version, sources, targets, defaults, columns):
+        self.version = version
+        self.sources = sources
+        self.targets = targets
+        self.defaults = defaults
+        self.columns = columns
 
-def map_dataframe(df, schema=MAPPER_SCHEMA):
-    mapped = pd.DataFrame()
+    def apply(self, df):
+        mapped = df[self.sources].set_axis(self.targets, axis=1)
+        if not self.defaults:
+            return mapped
+        mapped = mapped.assign(**{
+            col: pd.Series(value, index=df.index, dtype=dtype)
+            for col, (value, dtype) in self.defaults.items()
+        })
+        return mapped[self.columns]
+
+@lru_cache(maxsize=64)
+def compile_plan(header, version=MAPPER_VERSION):
+    """Compila (e guarda) o plano para um cabeçalho (tuplo de colunas) e versão."""
+    if version not in MAPPER_SCHEMAS:
+        print(f"[MAPPER] Versão {version} sem esquema, usando {DEFAULT_SCHEMA_VERSION}")
+        version = DEFAULT_SCHEMA_VERSION
+    schema = MAPPER_SCHEMAS[version]
+    version_defaults = MAPPER_DEFAULTS.get(version, {})
+    present = set(header)
+
+    sources, targets, defaults = [], [], {}
     for target_col, source_cols in schema.items():
-        mapped[target_col] = first_existing_column(df, source_cols)
-    return mapped
+        source = next((col for col in source_cols if col in present), None)
+        if source is None:
+            defaults[target_col] = version_defaults.get(target_col, (None, "object"))
+        else:
+            sources.append(source)
+            targets.append(target_col)
+    return MappingPlan(version, sources, targets, defaults, list(schema))
+
+def output_columns(version=None):
+    """Colunas de destino (pela ordem do esquema) produzidas para `version`."""
+    return list(compile_plan((), version or MAPPER_VERSION).columns)
+
+def map_dataframe(df, version=None):
+    plan = compile_plan(tuple(df.columns), version or MAPPER_VERSION)
+    return plan.apply(df)
@@ -0,0 +1,152 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRIC_PREFIX = "processor"
+
+# nome -> (tipo Prometheus, descrição)
+METRICS = {
+    "stage_seconds": ("summary", "Tempo gasto por etapa do pipeline"),
+    "cycles_total": ("counter", "Ciclos de processamento (CSV novo no bucket)"),
+    "chunks_total": ("counter", "Chunks processados"),
+    "chunk_errors_total": ("counter", "Chunks descartados por erro"),
+    "rows_total": ("counter", "Linhas escritas no resultado"),
+    "fmp_cache_hits_total": ("counter", "Símbolos servidos pela cache de perfis"),
+    "fmp_cache_misses_total": ("counter", "Símbolos sem entrada fresca na cache de perfis"),
+    "fmp_negative_hits_total": ("counter", "Pedidos evitados pela cache negativa"),
+    "fmp_coalesced_total": ("counter", "Pedidos evitados por single-flight"),
+    "fmp_requests_total": ("counter", "Pedidos feitos à FMP"),
+    "fmp_rate_limited_total": ("counter", "Respostas 429 da FMP"),
+    "fmp_quota_used": ("gauge", "Pedidos à FMP gastos hoje"),
+    "fmp_quota_remaining": ("gauge", "Pedidos à FMP ainda disponíveis hoje"),
+    "ingest_notifications_total": ("counter", "Notificações /ingest aceites"),
+    "bucket_polls_total": ("counter", "Pedidos ao bucket, por motivo (notification | fallback)"),
+    "bucket_snapshots_abandoned_total": ("counter", "Snapshots dados como tratados após BUCKET_MAX_FAILURES falhas"),
+    "pending_open": ("gauge", "Pedidos ao XML Service à espera de webhook"),
+    "pending_closed_total": ("counter", "Pedidos fechados, por estado (acknowledged | failed | expired)"),
+    "pending_resent_total": ("counter", "Pedidos reenviados pelo sweeper"),
+    "outbox_depth": ("gauge", "Envios falhados em fila no outbox"),
+    "outbox_spooled_total": ("counter", "Envios falhados guardados no outbox"),
+    "outbox_delivered_total": ("counter", "Envios do outbox aceites pelo XML Service"),
+    "outbox_retry_errors_total": ("counter", "Tentativas do outbox falhadas"),
+    "outbox_dropped_total": ("counter", "Envios descartados do outbox (fila cheia, recusados, tentativas esgotadas ou ficheiro em falta)"),
+    "bytes_downloaded_total": ("counter", "Bytes lidos do bucket"),
+    "bytes_uploaded_total": ("counter", "Bytes enviados ao XML Service"),
+    "xml_send_errors_total": ("counter", "Envios ao XML Service falhados"),
+}
+
+# Valores protegidos por lock: podem ser atualizados fora do event loop (to_thread)
+_LOCK = threading.Lock()
+_VALUES = {}
+_SUMMARIES = {}
+_CYCLE = None
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, value=1, **labels):
+    if not value:
+        return
+    key = _key(name, labels)
+    with _LOCK:
+        _VALUES[key] = _VALUES.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _LOCK:
+        if value is None:
+            _VALUES.pop(key, None)
+        else:
+            _VALUES[key] = value
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _LOCK:
+        count, total = _SUMMARIES.get(key, (0, 0.0))
+        _SUMMARIES[key] = (count + 1, total + seconds)
+
+@contextmanager
+def timed(stage):
+    """Mede o tempo (de relógio) do bloco em processor_stage_seconds{stage=...}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=stage)
+
+def snapshot():
+    with _LOCK:
+        return dict(_VALUES), dict(_SUMMARIES)
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def render_prometheus():
+    """Métricas no formato de texto do Prometheus (0.0.4)."""
+    values, summaries = snapshot()
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {description}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        if kind == "summary":
+            for (metric, labels), (count, total) in sorted(summaries.items()):
+                if metric == name:
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(total)}")
+            continue
+        for (metric, labels), value in sorted(values.items()):
+            if metric == name:
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def _summary_name(name, labels):
+    return ".".join([name, *(v for _, v in labels)])
+
+def start_cycle():
+    """Marca o início de um ciclo; cycle_summary() devolve o que mudou desde aqui."""
+    global _CYCLE
+    _CYCLE = (time.perf_counter(), *snapshot())
+    inc("cycles_total")
+
+def cycle_summary():
+    started, values_before, summaries_before = _CYCLE or (time.perf_counter(), {}, {})
+    values, summaries = snapshot()
+    counters, gauges, stages = {}, {}, {}
+    for (name, labels), value in values.items():
+        kind = METRICS.get(name, ("counter",))[0]
+        if kind == "gauge":
+            gauges[_summary_name(name, labels)] = value
+            continue
+        delta = value - values_before.get((name, labels), 0)
+        if delta:
+            counters[_summary_name(name, labels)] = delta
+    for (name, labels), (count, total) in summaries.items():
+        count_before, total_before = summaries_before.get((name, labels), (0, 0.0))
+        if count > count_before:
+            stages[_summary_name(name, labels).split(".", 1)[-1]] = {
+                "count": count - count_before,
+                "seconds": round(total - total_before, 4),
+            }
+    return {
+        "seconds": round(time.perf_counter() - started, 4),
+        "stages": stages,
+        "counters": counters,
+        "gauges": gauges,
+    }
+
+def log_cycle_summary(**extra):
+    """Escreve o resumo JSON do ciclo (uma linha [METRICS]) e devolve-o."""
+    summary = {**cycle_summary(), **extra}
+    print(f"[METRICS] {json.dumps(summary, ensure_ascii=False, sort_keys=True)}")
+    return summary
@@ -0,0 +1,243 @@
+import os
+import time
+import random
+import shutil
+import asyncio
+from config import OUTBOX_DIR
+from pending_store import get_pending_store, STATE_QUEUED
+import metrics
+
+# Máximo de envios em fila; acima disto o mais antigo é descartado (o snapshot
+# seguinte já contém os mesmos dados)
+OUTBOX_MAX_DEPTH = int(os.getenv("OUTBOX_MAX_DEPTH", "100"))
+# Backoff exponencial entre tentativas: base * 2^(n-1), até ao máximo, com jitter
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "15"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "900"))
+OUTBOX_RETRY_JITTER = float(os.getenv("OUTBOX_RETRY_JITTER", "0.2"))
+# Tentativas por envio antes de o descartar (0 = sem limite)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+# Erros 4xx que ainda valem nova tentativa; os outros são definitivos
+OUTBOX_RETRYABLE_4XX = (408, 429)
+# Intervalo máximo entre passagens do worker (limpeza de ficheiros órfãos)
+OUTBOX_IDLE_INTERVAL = float(os.getenv("OUTBOX_IDLE_INTERVAL", "60"))
+
+def _permanent_error(error):
+    """Recusa definitiva do XML Service (4xx que não seja 408/429): repetir não adianta."""
+    status = getattr(error, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in OUTBOX_RETRYABLE_4XX
+
+def _link_or_copy(src, dst):
+    # O output_writer publica com os.replace: um hard link fica com o snapshot
+    # atual mesmo depois de o próximo ciclo reescrever PROCESSED_PATH
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class Outbox:
+    """
+    Envios ao XML Service que falharam, guardados em disco (OUTBOX_DIR/<ID_Requisicao>.<ext>)
+    e reenviados em background com backoff exponencial e jitter. A entrega é FIFO: um
+    envio de cada vez, sempre o mais antigo, para o XML Service receber os snapshots
+    pela ordem em que foram gerados. Para um envio recusado não bloquear a fila, um
+    erro 4xx definitivo ou OUTBOX_MAX_ATTEMPTS tentativas falhadas descartam-no. O
+    estado (queued) vive no PendingRequestStore, por isso a fila sobrevive a restarts;
+    aqui ficam só os tempos da próxima tentativa.
+    """
+    def __init__(self, store=None, directory=None, max_depth=None):
+        # Um store vazio tem len() 0: `store or ...` trocava-o pelo singleton
+        self.store = store if store is not None else get_pending_store()
+        self.directory = directory or OUTBOX_DIR
+        self.max_depth = max(1, max_depth or OUTBOX_MAX_DEPTH)
+        self._due = {}
+        self._tries = {}
+        self._inflight = None
+        self._wake = None
+
+    def __len__(self):
+        return len(self._due)
+
+    def load(self):
+        """Agenda (para já) os envios em fila de uma execução anterior e limpa órfãos."""
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        for record in self.store.queued():
+            self._due[record["id"]] = now
+            self._tries[record["id"]] = 0
+        if self._due:
+            print(f"[OUTBOX] {len(self._due)} envios em fila recuperados de {self.directory}")
+        self._remove_orphans()
+        self._publish()
+        return self
+
+    def _publish(self):
+        metrics.set_gauge("outbox_depth", len(self._due))
+
+    def _wakeup(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def _backoff(self, tries):
+        delay = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** max(0, tries - 1))
+        jitter = min(1.0, max(0.0, OUTBOX_RETRY_JITTER))
+        return delay * random.uniform(1 - jitter, 1 + jitter)
+
+    def _forget(self, id_req):
+        self._due.pop(id_req, None)
+        self._tries.pop(id_req, None)
+        self._publish()
+
+    def _prune(self):
+        """Esquece pedidos que o webhook ou o sweeper já fecharam."""
+        for id_req in list(self._due):
+            record = self.store.get(id_req)
+            if record is None or record["state"] != STATE_QUEUED:
+                self._forget(id_req)
+
+    def _drop(self, id_req, reason):
+        record = self.store.expire(id_req, reason)
+        self._forget(id_req)
+        metrics.inc("outbox_dropped_total")
+        if record and record.get("csv"):
+            self._remove_file(record["csv"])
+
+    async def spool(self, id_req, path, reason=None):
+        """
+        Guarda o ficheiro de um envio falhado sob um nome único e põe-no na fila.
+        Devolve False se não foi possível (o pedido fica como estava).
+        """
+        if self.store.get(id_req) is None or not path:
+            return False
+        extension = os.path.splitext(path)[1] or ".csv"
+        spool_path = os.path.join(self.directory, f"{id_req}{extension}")
+        try:
+            await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+            await asyncio.to_thread(_link_or_copy, path, spool_path)
+        except OSError as e:
+            print(f"[OUTBOX] Não foi possível guardar {path}: {e}")
+            return False
+
+        self._prune()
+        while len(self._due) >= self.max_depth:
+            # O envio em curso não é descartado: pode já ter chegado ao XML Service
+            oldest = next((r["id"] for r in self.store.queued() if r["id"] != self._inflight), None)
+            if oldest is None:
+                break
+            print(f"[OUTBOX] Fila cheia ({self.max_depth}), descartando o envio {oldest}.")
+            self._drop(oldest, "outbox cheio")
+
+        self.store.queue(id_req, spool_path, reason)
+        self._tries[id_req] = 1
+        self._due[id_req] = time.time() + self._backoff(1)
+        self._publish()
+        metrics.inc("outbox_spooled_total")
+        print(f"[OUTBOX] Envio {id_req} em fila ({len(self._due)}/{self.max_depth}).")
+        self._wakeup()
+        return True
+
+    def _head(self):
+        """O envio mais antigo em fila (o próximo a tentar), ou None."""
+        self._prune()
+        for record in self.store.queued():
+            if record["id"] in self._due:
+                return record
+        return None
+
+    async def _attempt(self, record, deliver):
+        id_req = record["id"]
+        try:
+            if not await asyncio.to_thread(os.path.exists, record["csv"]):
+                print(f"[OUTBOX] Ficheiro {record['csv']} do envio {id_req} em falta, descartando.")
+                self._drop(id_req, "ficheiro do outbox em falta")
+                return
+            try:
+                await deliver(record)
+            except Exception as e:
+                tries = self._tries.get(id_req, 0) + 1
+                self._tries[id_req] = tries
+                if _permanent_error(e):
+                    print(f"[OUTBOX] Envio {id_req} recusado pelo XML Service, descartando: {e}")
+                    self._drop(id_req, f"recusado pelo XML Service (HTTP {e.status})")
+                    return
+                if OUTBOX_MAX_ATTEMPTS > 0 and tries >= OUTBOX_MAX_ATTEMPTS:
+                    print(f"[OUTBOX] Envio {id_req} falhou {tries} vezes, descartando: {e}")
+                    self._drop(id_req, f"{tries} tentativas falhadas")
+                    return
+                delay = self._backoff(tries)
+                if id_req in self._due:
+                    self._due[id_req] = time.time() + delay
+                metrics.inc("outbox_retry_errors_total")
+                print(f"[OUTBOX] Envio {id_req} falhou (tentativa {tries}), nova tentativa em {delay:.0f}s: {e}")
+                return
+            self.store.mark_delivered(id_req)
+            self._forget(id_req)
+            metrics.inc("outbox_delivered_total")
+            print(f"[OUTBOX] Envio {id_req} aceite pelo XML Service.")
+            # O serviço voltou: os seguintes seguem já, sem esperar pelo backoff
+            now = time.time()
+            for other in self._due:
+                self._due[other] = min(self._due[other], now)
+        finally:
+            self._inflight = None
+            self._wakeup()
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[OUTBOX] Erro ao remover {path}: {e}")
+
+    def _remove_orphans(self):
+        """Remove ficheiros de pedidos já fechados (expirados, falhados ou sem webhook de limpeza)."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if self.store.get(os.path.splitext(name)[0]) is None:
+                self._remove_file(os.path.join(self.directory, name))
+
+    async def run(self, deliver):
+        """
+        Worker: reenvia (`deliver(pedido)`, corrotina) o envio mais antigo em fila quando
+        chega a sua vez; os mais recentes esperam que ele seja aceite ou descartado.
+        """
+        self._wake = asyncio.Event()
+        task = None
+        last_cleanup = time.monotonic()
+        try:
+            while True:
+                self._wake.clear()
+                head = self._head() if self._inflight is None else None
+                timeout = OUTBOX_IDLE_INTERVAL
+                if head is not None:
+                    wait = self._due[head["id"]] - time.time()
+                    if wait <= 0:
+                        self._inflight = head["id"]
+                        task = asyncio.create_task(self._attempt(head, deliver))
+                    else:
+                        timeout = min(timeout, wait)
+
+                if time.monotonic() - last_cleanup >= OUTBOX_IDLE_INTERVAL:
+                    await asyncio.to_thread(self._remove_orphans)
+                    last_cleanup = time.monotonic()
+
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            self._wake = None
+
+_OUTBOX = None
+
+def get_outbox():
+    global _OUTBOX
+    if _OUTBOX is None:
+        _OUTBOX = Outbox()
+    return _OUTBOX
@@ -0,0 +1,171 @@
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv").lower()
+
+CONTENT_TYPES = {
+    ".csv": "text/csv",
+    ".parquet": "application/vnd.apache.parquet",
+    ".arrow": "application/vnd.apache.arrow.file",
+}
+# Colunas numéricas no esquema colunar; as restantes são texto
+NUMERIC_OUTPUT_COLUMNS = {"MarketCap", "PERatio", "Ultimo_Preco_Valor", "Variacao_Valor"}
+
+def content_type_for(path):
+    return CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+def output_path(base_path, extension):
+    return f"{os.path.splitext(base_path)[0]}{extension}"
+
+class CsvOutputWriter:
+    """
+    CSV UTF-8 com BOM (formato original), escrito chunk a chunk num ficheiro
+    temporário e renomeado no fim. `columns` fixa as colunas (e a ordem) do ficheiro;
+    sem ele valem as do primeiro chunk. Um chunk com uma coluna fora delas levanta
+    ValueError em vez de desalinhar o ficheiro.
+    """
+    extension = ".csv"
+
+    def __init__(self, base_path, columns=None):
+        self.path = self._target_path(base_path)
+        self.tmp_path = f"{self.path}.tmp"
+        self.content_type = content_type_for(self.path)
+        self.columns = list(columns) if columns is not None else None
+        self.chunks = 0
+
+    def _target_path(self, base_path):
+        return base_path
+
+    def _conform(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+        unexpected = [col for col in df.columns if col not in self.columns]
+        if unexpected:
+            raise ValueError(f"Colunas fora do esquema de saída: {unexpected}")
+        return df.reindex(columns=self.columns)
+
+    def write(self, df):
+        if df.empty:
+            return
+        df = self._conform(df)
+        df.to_csv(
+            self.tmp_path,
+            mode="w" if self.chunks == 0 else "a",
+            header=(self.chunks == 0),
+            index=False,
+            encoding="utf-8-sig"
+        )
+        self.chunks += 1
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        """Fecha e publica o ficheiro (rename atómico). Devolve o caminho, ou None se vazio."""
+        self._finish()
+        if self.chunks == 0:
+            self.abort()
+            return None
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self._finish()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class _ColumnarOutputWriter(CsvOutputWriter):
+    """
+    Base dos formatos colunares: o esquema vem de `columns` (ou do primeiro chunk),
+    com as colunas numéricas em float64 e o resto em string, e cada chunk é
+    convertido para ele.
+    """
+    def __init__(self, base_path, columns=None):
+        super().__init__(base_path, columns)
+        self.schema = None
+        self._writer = None
+
+    def _target_path(self, base_path):
+        return output_path(base_path, self.extension)
+
+    def _schema_for(self, columns):
+        return pa.schema([
+            (col, pa.float64() if col in NUMERIC_OUTPUT_COLUMNS else pa.string())
+            for col in columns
+        ])
+
+    def _to_table(self, df):
+        arrays = []
+        for field in self.schema:
+            if field.name not in df.columns:
+                arrays.append(pa.nulls(len(df), type=field.type))
+                continue
+            series = df[field.name]
+            if pa.types.is_floating(field.type):
+                values = pd.to_numeric(series, errors="coerce").astype("float64")
+                arrays.append(pa.array(values, type=field.type, from_pandas=True))
+            else:
+                arrays.append(pa.array(series.astype("string"), type=field.type, from_pandas=True))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def write(self, df):
+        if df.empty:
+            return
+        df = self._conform(df)
+        if self._writer is None:
+            self.schema = self._schema_for(self.columns)
+            self._writer = self._open_writer()
+        self._write_table(self._to_table(df))
+        self.chunks += 1
+
+    def _finish(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+class ParquetOutputWriter(_ColumnarOutputWriter):
+    """Parquet com um row group por chunk."""
+    extension = ".parquet"
+
+    def _open_writer(self):
+        return pq.ParquetWriter(self.tmp_path, self.schema, compression="zstd")
+
+    def _write_table(self, table):
+        self._writer.write_table(table)
+
+class ArrowOutputWriter(_ColumnarOutputWriter):
+    """Arrow IPC (formato ficheiro) com um record batch por chunk."""
+    extension = ".arrow"
+
+    def _open_writer(self):
+        return pa.ipc.new_file(self.tmp_path, self.schema)
+
+    def _write_table(self, table):
+        self._writer.write_table(table)
+
+WRITERS = {
+    "csv": CsvOutputWriter,
+    "parquet": ParquetOutputWriter,
+    "arrow": ArrowOutputWriter,
+}
+
+def get_output_writer(base_path, fmt=None, columns=None):
+    """
+    Writer para OUTPUT_FORMAT (csv | parquet | arrow); sem pyarrow volta a CSV.
+    `columns` são as colunas do ficheiro final (esquema de saída).
+    """
+    fmt = (fmt or OUTPUT_FORMAT).lower()
+    if fmt not in WRITERS:
+        print(f"[PROCESSOR] OUTPUT_FORMAT desconhecido '{fmt}', usando csv.")
+        fmt = "csv"
+    if fmt != "csv" and pa is None:
+        print(f"[PROCESSOR] pyarrow não instalado, {fmt} indisponível, usando csv.")
+        fmt = "csv"
+    return WRITERS[fmt](base_path, columns)
@@ -0,0 +1,250 @@
+import os
+import time
+import sqlite3
+import asyncio
+from config import PENDING_STATE_PATH
+import metrics
+
+STATE_SENT = "sent"
+STATE_QUEUED = "queued"
+STATE_ACKNOWLEDGED = "acknowledged"
+STATE_FAILED = "failed"
+STATE_EXPIRED = "expired"
+
+# Segundos sem webhook até o sweeper reenviar (ou expirar) um pedido
+PENDING_ACK_TIMEOUT = float(os.getenv("PENDING_ACK_TIMEOUT", "300"))
+# Envios no total (o primeiro incluído) antes de expirar
+PENDING_MAX_ATTEMPTS = int(os.getenv("PENDING_MAX_ATTEMPTS", "3"))
+# Estados de erro do XML Service que justificam reenviar (os outros são definitivos)
+PENDING_RETRY_STATUSES = {
+    item.strip()
+    for item in os.getenv("PENDING_RETRY_STATUSES", "ERRO_PERSISTENCIA").split(",")
+    if item.strip()
+}
+PENDING_RETRY_DELAY = float(os.getenv("PENDING_RETRY_DELAY", "30"))
+PENDING_SWEEP_INTERVAL = float(os.getenv("PENDING_SWEEP_INTERVAL", "60"))
+# Pedidos terminados ficam guardados este tempo (segundos) para diagnóstico
+PENDING_RETENTION = float(os.getenv("PENDING_RETENTION", str(7 * 86400)))
+
+COLUMNS = (
+    "id", "state", "open", "csv", "bucket", "bucket_etag", "attempts", "created", "updated",
+    "status", "doc_id", "reason",
+)
+
+class PendingRequestStore:
+    """
+    Pedidos enviados ao XML Service à espera de webhook, persistidos em SQLite para
+    sobreviverem a restarts. Estados: sent -> acknowledged | failed | expired; um envio
+    que falhou fica queued (no outbox) até voltar a ser aceite pelo XML Service.
+    Os pedidos em aberto ficam também num dict por ID_Requisicao (lookup O(1) no
+    webhook); o SQLite só é lido no arranque.
+    """
+    def __init__(self, path=None):
+        self.path = path or PENDING_STATE_PATH
+        self._conn = None
+        self._open = {}
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS requests ("
+                " id TEXT PRIMARY KEY, state TEXT NOT NULL, open INTEGER NOT NULL, csv TEXT, bucket TEXT,"
+                " bucket_etag TEXT, attempts INTEGER NOT NULL DEFAULT 1, created REAL NOT NULL,"
+                " updated REAL NOT NULL, status TEXT, doc_id TEXT, reason TEXT)"
+            )
+            # Bases criadas antes de bucket_etag (CREATE TABLE IF NOT EXISTS não acrescenta colunas)
+            existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(requests)")}
+            if "bucket_etag" not in existing:
+                self._conn.execute("ALTER TABLE requests ADD COLUMN bucket_etag TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS requests_open ON requests (open, updated)")
+            self._conn.commit()
+        return self._conn
+
+    def load(self):
+        """Carrega os pedidos em aberto (sent e failed ainda reenviáveis)."""
+        conn = self._connect()
+        rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM requests WHERE open = 1")
+        self._open = {row["id"]: dict(row) for row in rows}
+        if self._open:
+            print(f"[PENDING] {len(self._open)} pedidos em aberto recuperados de {self.path}")
+        self._publish()
+        return self
+
+    def __len__(self):
+        return len(self._open)
+
+    def get(self, id_req):
+        return self._open.get(id_req)
+
+    def _save(self, record):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO requests ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+                tuple(record.get(col) for col in COLUMNS),
+            )
+
+    def _publish(self):
+        metrics.set_gauge("pending_open", len(self._open))
+
+    def _close(self, record, state, **changes):
+        record.update(state=state, open=0, updated=time.time(), **changes)
+        self._save(record)
+        self._open.pop(record["id"], None)
+        self._publish()
+        metrics.inc("pending_closed_total", state=state)
+        return record
+
+    @staticmethod
+    def _retryable(record):
+        return record["state"] == STATE_FAILED and record.get("status") in PENDING_RETRY_STATUSES
+
+    def add(self, id_req, csv_path, bucket=None, bucket_etag=None):
+        """
+        Regista um envio novo (estado sent). `bucket_etag` é o ETag do objeto do bucket
+        de onde veio o ficheiro: só esse objeto pode ser apagado quando chegar o OK.
+        Pedidos em aberto para o mesmo ficheiro ficam expirados: o ficheiro já foi
+        reescrito e um reenvio mandaria o novo.
+        """
+        for record in list(self._open.values()):
+            if csv_path and record["csv"] == csv_path:
+                self._close(record, STATE_EXPIRED, reason="substituído por um envio mais recente")
+        now = time.time()
+        record = {
+            "id": id_req, "state": STATE_SENT, "open": 1, "csv": csv_path, "bucket": bucket,
+            "bucket_etag": bucket_etag, "attempts": 1, "created": now, "updated": now,
+            "status": None, "doc_id": None, "reason": None,
+        }
+        self._save(record)
+        self._open[id_req] = record
+        self._publish()
+        return record
+
+    def acknowledge(self, id_req, doc_id=None):
+        """Webhook OK: devolve o pedido (para limpar CSV/bucket), ou None se não estiver em aberto."""
+        record = self._open.get(id_req)
+        if record is None:
+            return None
+        return self._close(record, STATE_ACKNOWLEDGED, status="OK",
+                           doc_id=None if doc_id is None else str(doc_id))
+
+    def fail(self, id_req, status):
+        """Webhook com erro: failed (reenviável se `status` estiver em PENDING_RETRY_STATUSES)."""
+        record = self._open.get(id_req)
+        if record is None:
+            return None
+        record.update(state=STATE_FAILED, status=status, updated=time.time())
+        if self._retryable(record) and record["attempts"] < PENDING_MAX_ATTEMPTS:
+            self._save(record)
+            return record
+        return self._close(record, STATE_FAILED, reason=f"XML Service: {status}")
+
+    def queue(self, id_req, spool_path, reason=None):
+        """Envio falhado: o pedido passa ao outbox (queued), com o ficheiro em `spool_path`."""
+        record = self._open.get(id_req)
+        if record is None:
+            return None
+        record.update(state=STATE_QUEUED, csv=spool_path, reason=reason, updated=time.time())
+        self._save(record)
+        return record
+
+    def mark_delivered(self, id_req):
+        """POST do outbox aceite: volta a sent, à espera do webhook. None se já não estiver queued."""
+        record = self._open.get(id_req)
+        if record is None or record["state"] != STATE_QUEUED:
+            return None
+        record.update(state=STATE_SENT, reason=None, updated=time.time())
+        self._save(record)
+        return record
+
+    def queued(self):
+        """Pedidos no outbox, do mais antigo para o mais recente."""
+        records = [r for r in self._open.values() if r["state"] == STATE_QUEUED]
+        return sorted(records, key=lambda r: r["created"])
+
+    def expire(self, id_req, reason):
+        record = self._open.get(id_req)
+        if record is None:
+            return None
+        return self._close(record, STATE_EXPIRED, reason=reason)
+
+    def mark_retry(self, id_req):
+        """Conta mais um envio do pedido (antes de o reenviar) e volta a sent."""
+        record = self._open[id_req]
+        record.update(state=STATE_SENT, attempts=record["attempts"] + 1, updated=time.time())
+        self._save(record)
+        metrics.inc("pending_resent_total")
+        return record
+
+    def due(self, now=None):
+        """Pedidos a tratar pelo sweeper: (pedido, "retry" | "expire")."""
+        now = now or time.time()
+        actions = []
+        for record in list(self._open.values()):
+            if record["state"] == STATE_QUEUED:
+                continue  # tratados pelo outbox
+            if record["state"] == STATE_FAILED:
+                wait = PENDING_RETRY_DELAY
+            else:
+                wait = PENDING_ACK_TIMEOUT
+            if now - record["updated"] < wait:
+                continue
+            if record["attempts"] >= PENDING_MAX_ATTEMPTS:
+                actions.append((record, "expire"))
+            else:
+                actions.append((record, "retry"))
+        return actions
+
+    def purge(self, older_than=PENDING_RETENTION):
+        """Apaga pedidos terminados há mais de `older_than` segundos."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM requests WHERE open = 0 AND updated < ?", (time.time() - older_than,)
+            )
+
+async def sweep_pending(store, resend):
+    """
+    Uma passagem do sweeper: reenvia (`resend(pedido)`, corrotina) os pedidos sem
+    webhook há mais de PENDING_ACK_TIMEOUT ou com erro reenviável, e expira os que
+    já gastaram PENDING_MAX_ATTEMPTS envios ou cujo CSV já não existe.
+    """
+    for record, action in store.due():
+        id_req = record["id"]
+        if action == "expire":
+            print(f"[PENDING] Pedido {id_req} expirado após {record['attempts']} envios sem confirmação.")
+            store.expire(id_req, f"sem confirmação após {record['attempts']} envios")
+            continue
+        if not record["csv"] or not os.path.exists(record["csv"]):
+            print(f"[PENDING] Pedido {id_req} expirado: CSV {record['csv']} já não existe.")
+            store.expire(id_req, "CSV em falta para reenvio")
+            continue
+        store.mark_retry(id_req)
+        print(f"[PENDING] Reenviando pedido {id_req} (envio {record['attempts']}/{PENDING_MAX_ATTEMPTS})")
+        try:
+            await resend(record)
+        except Exception as e:
+            print(f"[PENDING] Reenvio do pedido {id_req} falhou: {e}")
+    store.purge()
+
+async def run_pending_sweeper(store, resend, interval=PENDING_SWEEP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep_pending(store, resend)
+        except Exception as e:
+            print(f"[PENDING] Erro no sweeper: {e}")
+
+_STORE = None
+
+def get_pending_store():
+    global _STORE
+    if _STORE is None:
+        _STORE = PendingRequestStore()
+    return _STORE
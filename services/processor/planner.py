@@ -0,0 +1,218 @@
+import os
+import math
+import asyncio
+from http_client import http_session
+import metrics
+from utils import (
+    ENRICH_TOTAL_MAX,
+    cached_sentiment,
+    get_financial_sentiments,
+    remaining_quota,
+    reserve_enrichment_slots,
+    symbol_cache_status,
+    symbols_per_request,
+)
+
+ENRICH_PLANNING = os.getenv("ENRICH_PLANNING", "1").lower() in ("1", "true", "yes")
+PRIORITY_KEYS = ("never_seen", "cache_age", "market", "market_cap")
+ENRICH_PRIORITY = [
+    item.strip()
+    for item in os.getenv("ENRICH_PRIORITY", ",".join(PRIORITY_KEYS)).split(",")
+    if item.strip() in PRIORITY_KEYS
+]
+# Mercados por ordem de preferência (ex.: "XPAR,XAMS"); os restantes ficam no fim
+ENRICH_PRIORITY_MARKETS = [
+    item.strip().upper()
+    for item in os.getenv("ENRICH_PRIORITY_MARKETS", "").split(",")
+    if item.strip()
+]
+
+def _market_rank(market):
+    market = str(market or "").strip().upper()
+    if market in ENRICH_PRIORITY_MARKETS:
+        return ENRICH_PRIORITY_MARKETS.index(market)
+    return len(ENRICH_PRIORITY_MARKETS)
+
+def _as_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+def _priority_key(status, market_rank):
+    """Menor é mais prioritário; a ordem dos critérios vem de ENRICH_PRIORITY."""
+    values = {
+        "never_seen": 0 if status["state"] == "missing" else 1,
+        "cache_age": -(status["age"] if status["age"] is not None else math.inf),
+        "market": market_rank,
+        "market_cap": -_as_float(status["market_cap"]),
+    }
+    return tuple(values[name] for name in ENRICH_PRIORITY)
+
+class EnrichmentPlan:
+    """
+    Enriquecimento planeado de um ficheiro, sem uma segunda leitura. Antes do stream
+    começar, os símbolos já conhecidos (linhas do último snapshot que vão voltar a ser
+    enriquecidas) são ordenados por ENRICH_PRIORITY com os metadados da cache, e a
+    quota diária fica reservada por essa ordem. Durante o stream cada símbolo reservado
+    vai à FMP quando o seu chunk chega; os restantes (novos neste ficheiro ou fora da
+    reserva) só usam a quota que a reserva deixou livre e, se não couberem, ficam para
+    o fim do stream, onde a quota que sobrou (reservas de símbolos que não apareceram)
+    é gasta por ordem de prioridade (aquece a cache para o próximo ciclo). Os frescos
+    em cache e os da cache negativa não gastam pedidos; cada símbolo é pedido uma
+    única vez por ficheiro.
+    """
+    def __init__(self, quota=None, per_request=1):
+        self.quota = quota
+        self.per_request = max(1, per_request)
+        self.candidates = 0
+        self.cache_hits = 0
+        self.negatives = 0
+        self.skipped = 0
+        self.selected = []
+        self.results = {}
+        self.reserved = {}
+        self.deferred = {}
+        self.late = []
+        self._seen = set()
+        self._fetching = {}
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def start(cls, snapshot=None):
+        """
+        Plano com a quota restante e os símbolos por pedido neste momento, com a quota
+        já reservada para os símbolos do último snapshot (`snapshot`: SnapshotStore).
+        """
+        plan = cls(quota=remaining_quota(), per_request=symbols_per_request())
+        if snapshot is not None:
+            plan.reserve(snapshot.planning_candidates())
+        return plan
+
+    def _cost(self, statuses):
+        """Custo real: um pedido por lote de perfis + um pedido por ISIN por resolver."""
+        lookups = sum(1 for status in statuses if status["isin_lookup"])
+        return math.ceil(len(statuses) / self.per_request) + lookups
+
+    def _take(self, ranked, budget):
+        """Símbolos de `ranked` ((prioridade, símbolo, estado) ordenado) que cabem em `budget`."""
+        taken = {}
+        for _, symbol, status in ranked:
+            if budget is not None and self._cost([*taken.values(), status]) > budget:
+                continue
+            taken[symbol] = status
+        return taken
+
+    def reserve(self, known):
+        """
+        Reserva a quota para os símbolos conhecidos (`known`: [(símbolo, mercado)]) por
+        ordem de prioridade; o que sobra fica para os restantes.
+        """
+        ranked = {}
+        for symbol, market in known:
+            if symbol in ranked:
+                continue
+            status = symbol_cache_status(symbol)
+            if (status["state"] == "fresh" and not status["isin_lookup"]) or status["negative"]:
+                continue
+            ranked[symbol] = (_priority_key(status, _market_rank(market)), symbol, status)
+        self.reserved = self._take(sorted(ranked.values(), key=lambda item: item[0]), self.quota)
+        if self.quota is not None:
+            self.quota -= self._cost(list(self.reserved.values()))
+
+    def _select(self, symbols, markets):
+        reserved = []
+        ranked = []
+        hits = 0
+        for symbol in symbols:
+            if symbol in self._seen:
+                continue
+            self._seen.add(symbol)
+            self.candidates += 1
+            status = symbol_cache_status(symbol)
+            if status["state"] == "fresh" and not status["isin_lookup"]:
+                hits += 1
+                continue
+            if status["negative"]:
+                self.negatives += 1
+                continue
+            if symbol in self.reserved:
+                reserved.append(symbol)
+                continue
+            ranked.append((_priority_key(status, _market_rank(markets.get(symbol))), symbol, status))
+        ranked.sort(key=lambda item: item[0])
+        self.cache_hits += hits
+        metrics.inc("fmp_cache_hits_total", hits)
+
+        # Fora da reserva: só a quota que ficou livre, sem tirar nada aos reservados
+        selected = self._take(ranked, self.quota)
+        if self.quota is not None:
+            self.quota -= self._cost(list(selected.values()))
+        for key, symbol, status in ranked:
+            if symbol not in selected:
+                self.deferred[symbol] = (key, symbol, status)
+        return reserved + list(selected)
+
+    async def _fetch(self, selected):
+        if ENRICH_TOTAL_MAX > 0:
+            reserved = set(await reserve_enrichment_slots(selected))
+            self.skipped += len(selected) - len(reserved)
+            selected = [symbol for symbol in selected if symbol in reserved]
+        if not selected:
+            return {}
+        async with http_session() as session:
+            return dict(zip(selected, await get_financial_sentiments(session, selected, use_cache=False)))
+
+    async def enrich(self, symbols, markets=None):
+        """
+        Enriquece os símbolos de um chunk (`markets`: {símbolo: mercado}) e devolve
+        {símbolo: sentiment}; os não planeados respondem a partir da cache.
+        """
+        async with self._lock:
+            selected = self._select(symbols, markets or {})
+            loop = asyncio.get_running_loop()
+            for symbol in selected:
+                self._fetching[symbol] = loop.create_future()
+            self.selected.extend(selected)
+
+        if selected:
+            fetched = {}
+            try:
+                fetched = await self._fetch(selected)
+            finally:
+                for symbol in selected:
+                    self.results[symbol] = fetched.get(symbol)
+                    self._fetching.pop(symbol).set_result(None)
+
+        # Símbolos planeados por outro chunk cujo pedido ainda está em curso
+        waiting = [self._fetching[symbol] for symbol in symbols if symbol in self._fetching]
+        if waiting:
+            await asyncio.gather(*[asyncio.shield(future) for future in waiting])
+        return {
+            symbol: self.results.get(symbol) or cached_sentiment(symbol)
+            for symbol in symbols
+        }
+
+    async def finish(self):
+        """
+        Fim do stream: a quota das reservas que não apareceram no ficheiro, mais a livre,
+        vai para os símbolos adiados, por ordem de prioridade. Os restantes contam como
+        fora da quota.
+        """
+        if self.deferred and self.quota is not None:
+            used = [status for symbol, status in self.reserved.items() if symbol in self._seen]
+            budget = self.quota + self._cost(list(self.reserved.values())) - self._cost(used)
+            ranked = sorted(self.deferred.values(), key=lambda item: item[0])
+            self.late = list(self._take(ranked, budget))
+            self.quota = budget - self._cost([self.deferred[symbol][2] for symbol in self.late])
+            if self.late:
+                await self._fetch(self.late)
+        self.skipped += len(self.deferred) - len(self.late)
+
+    def summary(self):
+        print(
+            f"[PLAN] símbolos={self.candidates} em_cache={self.cache_hits} negativos={self.negatives} "
+            f"reservados={len(self.reserved)} planeados={len(self.selected)} "
+            f"no_fim={len(self.late)} fora_da_quota={self.skipped}"
+        )
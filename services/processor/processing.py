@@ -1,13 +1,31 @@
 import os
 import io
+import codecs
 import hashlib
+import numpy as np
 import pandas as pd
 import asyncio
-from mapper import map_dataframe
-from utils import enrich_chunk
+from mapper import map_dataframe, output_columns
+from utils import enrich_chunk, chunk_symbols, flush_cache, coalesce_stats, cache_stats
 from config import PROCESSED_PATH
+from snapshot import SnapshotStore, ROW_UNCHANGED, ENRICH_STATES, ENRICHED_COLUMNS
+from planner import ENRICH_PLANNING, EnrichmentPlan
+from output_writer import get_output_writer
+from cpu_pool import configure_cpu_pool, run_cpu
+import metrics
+
+class ProcessingError(RuntimeError):
+    """Falha do pipeline (leitura, processamento ou escrita): o snapshot não foi processado."""
 
 DEMO_MODE = os.getenv("DEMO_MODE", "0").lower() in ("1", "true", "yes")
+DELTA_PROCESSING = os.getenv("DELTA_PROCESSING", "1").lower() in ("1", "true", "yes")
+# Escreve só linhas novas/alteradas (o BI lê o último documento, por isso vem desligado)
+DELTA_ONLY_OUTPUT = os.getenv("DELTA_ONLY_OUTPUT", "0").lower() in ("1", "true", "yes")
+# Ingestão tipada: strings pyarrow na leitura, preço/variação numéricos e categorias
+TYPED_INGESTION = os.getenv("TYPED_INGESTION", "1").lower() in ("1", "true", "yes")
+CATEGORY_COLUMNS = ["Mercado", "Sector", "Industry"]
+NUMERIC_COLUMNS = ["MarketCap", "PERatio"]
+TYPED_COLUMNS = ["Moeda", "Ultimo_Preco_Valor", "Variacao_Valor"]
 DEMO_LAST_PRICE = os.getenv("DEMO_LAST_PRICE", "EUR 10.00")
 DEMO_SECTOR = os.getenv("DEMO_SECTOR", "Technology")
 DEMO_INDUSTRY = os.getenv("DEMO_INDUSTRY", "Software")
@@ -74,126 +92,537 @@ def _demo_price(seed, mercado):
     text = f"{price:.2f}".replace(".", ",")
     return f"{_demo_currency(mercado)} {text}"
 
+# Tabelas pré-calculadas: o valor demo só depende de `seed % N`
+_DEMO_PRICE_TEXT = np.array(
+    [f"{5 + i / 100:.2f}".replace(".", ",") for i in range(5000)], dtype=object
+)
+_DEMO_MARKET_CAP_TEXT = np.array([_demo_market_cap(i) for i in range(900)], dtype=object)
+_DEMO_PE_RATIO_TEXT = np.array([_demo_pe_ratio(i) for i in range(260)], dtype=object)
+_MISSING_TEXT = ["", "-", "--", "nan", "None"]
+
+def _is_na_scalar(value):
+    return value is None or value is pd.NA or (isinstance(value, float) and value != value)
+
+def _text_rows(df, rows):
+    """
+    Linhas (de `rows`) que o iterrows devolve como Series de texto: pelo menos uma
+    string e tudo o resto None/NaN/pd.NA. Nessas o pandas converte None e pd.NA em NaN.
+    """
+    has_text = np.zeros(int(rows.sum()), dtype=bool)
+    only_text = np.ones(int(rows.sum()), dtype=bool)
+    for column in df.columns:
+        values = df[column].to_numpy(dtype=object)[rows]
+        is_text = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+        is_na = np.fromiter((_is_na_scalar(v) for v in values), dtype=bool, count=len(values))
+        has_text |= is_text
+        only_text &= is_text | is_na
+    return has_text & only_text
+
+def _seed_values(df, column):
+    """Valores de `column` como o antigo `row.get(column)` do iterrows os via."""
+    if column not in df.columns:
+        return [""] * len(df)
+    values = df[column].to_numpy(dtype=object).copy()
+    na = np.fromiter((v is None or v is pd.NA for v in values), dtype=bool, count=len(values))
+    if na.any():
+        text = _text_rows(df, na)
+        rows = np.flatnonzero(na)[text]
+        values[rows] = np.nan
+    return values.tolist()
+
+def _demo_seeds(df):
+    tickers = _seed_values(df, "Ticker")
+    names = _seed_values(df, "Nome")
+    return np.fromiter(
+        (
+            int(hashlib.md5(f"{ticker}-{name}".encode("utf-8")).hexdigest()[:8], 16)
+            for ticker, name in zip(tickers, names)
+        ),
+        dtype=np.int64,
+        count=len(df),
+    )
+
+def _demo_fill_mask(series, placeholder):
+    """
+    Versão vetorizada de `_is_missing(v) or _is_placeholder(v, placeholder)`.
+    """
+    values = series.astype(object)
+    text = values.map(str).str.strip()
+    na = values.isna().to_numpy()
+    is_none = np.zeros(len(values), dtype=bool)
+    is_nan = np.zeros(len(values), dtype=bool)
+    if na.any():
+        # Só None e NaN float contam como vazios (pd.NA/NaT não, como em _is_missing)
+        na_values = values[na].tolist()
+        is_none[na] = [v is None for v in na_values]
+        is_nan[na] = [isinstance(v, float) for v in na_values]
+    missing = is_none | is_nan | text.isin(_MISSING_TEXT).to_numpy()
+    return missing | (~is_none & (text == str(placeholder).strip()).to_numpy())
+
+def _demo_fill(df, column, mask, values):
+    if mask.any():
+        df[column] = df[column].where(~mask, pd.Series(values, index=df.index, dtype=object))
+
 def apply_demo_defaults(df: pd.DataFrame) -> pd.DataFrame:
     """
     Preenche apenas campos vazios para modo demonstracao.
+    Vetorizado por coluna; o resultado é idêntico ao preenchimento linha a linha.
     """
-    updates = 0
-    for idx, row in df.iterrows():
-        seed = _demo_seed(row)
-
-        if "Último_Preço" in df.columns and (
-            _is_missing(row.get("Último_Preço"))
-            or _is_placeholder(row.get("Último_Preço"), DEMO_LAST_PRICE)
-        ):
-            df.at[idx, "Último_Preço"] = _demo_price(seed, row.get("Mercado"))
-            updates += 1
-
-        if "Sector" in df.columns and (
-            _is_missing(row.get("Sector"))
-            or _is_placeholder(row.get("Sector"), DEMO_SECTOR)
-        ):
-            sector = _demo_pick(DEMO_SECTORS, seed) or DEMO_SECTOR
-            df.at[idx, "Sector"] = sector
-            updates += 1
+    if df.empty:
+        return df
+    seeds = _demo_seeds(df)
+
+    if "Último_Preço" in df.columns:
+        mask = _demo_fill_mask(df["Último_Preço"], DEMO_LAST_PRICE)
+        mercados = df["Mercado"].tolist() if "Mercado" in df.columns else [None] * len(df)
+        currency = np.array([_demo_currency(m) for m in mercados], dtype=object)
+        _demo_fill(df, "Último_Preço", mask, currency + " " + _DEMO_PRICE_TEXT[seeds % 5000])
+
+    if "Sector" in df.columns:
+        mask = _demo_fill_mask(df["Sector"], DEMO_SECTOR)
+        if DEMO_SECTORS:
+            options = np.array([item or DEMO_SECTOR for item in DEMO_SECTORS], dtype=object)
+            picked = options[seeds % len(options)]
         else:
-            sector = row.get("Sector")
-
-        if "Industry" in df.columns and (
-            _is_missing(row.get("Industry"))
-            or _is_placeholder(row.get("Industry"), DEMO_INDUSTRY)
-        ):
-            sector_key = str(sector or DEMO_SECTOR)
-            industries = DEMO_INDUSTRIES.get(sector_key, [DEMO_INDUSTRY])
-            df.at[idx, "Industry"] = _demo_pick(industries, seed, offset=3) or DEMO_INDUSTRY
-            updates += 1
-
-        if "MarketCap" in df.columns and (
-            _is_missing(row.get("MarketCap"))
-            or _is_placeholder(row.get("MarketCap"), DEMO_MARKET_CAP)
-        ):
-            df.at[idx, "MarketCap"] = _demo_market_cap(seed)
-            updates += 1
-
-        if "PERatio" in df.columns and (
-            _is_missing(row.get("PERatio"))
-            or _is_placeholder(row.get("PERatio"), DEMO_PE_RATIO)
-        ):
-            df.at[idx, "PERatio"] = _demo_pe_ratio(seed)
-            updates += 1
+            picked = np.full(len(df), DEMO_SECTOR, dtype=object)
+        sectors = np.where(mask, picked, df["Sector"].to_numpy(dtype=object))
+        _demo_fill(df, "Sector", mask, picked)
+    else:
+        sectors = np.full(len(df), None, dtype=object)
+
+    if "Industry" in df.columns:
+        mask = _demo_fill_mask(df["Industry"], DEMO_INDUSTRY)
+        sector_keys = np.array([str(sector or DEMO_SECTOR) for sector in sectors], dtype=object)
+        industries = np.full(len(df), DEMO_INDUSTRY, dtype=object)
+        for sector_key in pd.unique(sector_keys[mask]):
+            rows = mask & (sector_keys == sector_key)
+            options = np.array(
+                [item or DEMO_INDUSTRY for item in DEMO_INDUSTRIES.get(sector_key, [DEMO_INDUSTRY])],
+                dtype=object,
+            )
+            if len(options):
+                industries[rows] = options[(seeds[rows] + 3) % len(options)]
+        _demo_fill(df, "Industry", mask, industries)
+
+    if "MarketCap" in df.columns:
+        mask = _demo_fill_mask(df["MarketCap"], DEMO_MARKET_CAP)
+        _demo_fill(df, "MarketCap", mask, _DEMO_MARKET_CAP_TEXT[seeds % 900])
+
+    if "PERatio" in df.columns:
+        mask = _demo_fill_mask(df["PERatio"], DEMO_PE_RATIO)
+        _demo_fill(df, "PERatio", mask, _DEMO_PE_RATIO_TEXT[seeds % 260])
 
     return df
 
-async def process_chunk(chunk, batch_size=20, batch_delay=0.05):
+async def _enrich_with_snapshot(chunk_mapped, snapshot, batch_size, batch_delay, plan=None):
     """
-    Processa um chunk de CSV: mapeia colunas e enriquece via API externa.
+    Enriquece só as linhas novas ou com outra identidade face ao snapshot anterior; as
+    restantes (incluindo as que só mudaram de preço) reutilizam o enriquecimento
+    guardado. Devolve (financial_df, máscara das linhas diferentes do snapshot).
     """
-    try:
-        # Mapeia colunas do chunk para o schema padrão
-        chunk_mapped = map_dataframe(chunk)
+    keys, fps, status = snapshot.classify(chunk_mapped)
+    records = snapshot.stored_enrichment(keys)
+    stale = np.array([state in ENRICH_STATES for state in status], dtype=bool)
+    changed = np.array([state != ROW_UNCHANGED for state in status], dtype=bool)
 
-        # Verifica se existe coluna "Ticker"
-        if "Ticker" not in chunk_mapped.columns:
-            print("[PROCESSOR] WARNING: coluna 'Ticker' não encontrada neste chunk")
-            chunk_mapped["Ticker"] = None
-
-        # Enriquecimento financeiro via API externa
-        financial_df = await enrich_chunk(
-            chunk_mapped,
+    if stale.any():
+        enriched = await enrich_chunk(
+            chunk_mapped[stale],
             batch_size=batch_size,
-            batch_delay=batch_delay
+            batch_delay=batch_delay,
+            plan=plan
         )
+        for pos, record in zip(np.flatnonzero(stale), enriched.to_dict("records")):
+            records[pos] = record
 
-        # Concatenar dados originais + enriquecidos
-        chunk_enriched = pd.concat(
-            [chunk_mapped.reset_index(drop=True), financial_df.reset_index(drop=True)],
-            axis=1
+    # Símbolo e mercado por linha: o EnrichmentPlan do próximo ficheiro ordena-os à partida
+    symbols = [None] * len(keys)
+    for pos, symbol in chunk_symbols(chunk_mapped):
+        symbols[pos] = symbol
+    markets = chunk_mapped["Mercado"].tolist() if "Mercado" in chunk_mapped.columns else None
+    snapshot.remember(keys, fps, records, stale, symbols=symbols, markets=markets)
+    return pd.DataFrame(records, columns=ENRICHED_COLUMNS), changed
+
+def _map_chunk(chunk):
+    """Mapeamento do chunk (seleção/renomeação vetorizada: barato, fica no event loop)."""
+    # Mapeia colunas do chunk para o schema padrão
+    chunk_mapped = map_dataframe(chunk)
+
+    # Verifica se existe coluna "Ticker"
+    if "Ticker" not in chunk_mapped.columns:
+        print("[PROCESSOR] WARNING: coluna 'Ticker' não encontrada neste chunk")
+        chunk_mapped["Ticker"] = None
+    return chunk_mapped
+
+async def _ingest_chunk(chunk):
+    """Mapeia o chunk e tipa as colunas da origem, antes do enriquecimento."""
+    chunk_mapped = _map_chunk(chunk)
+    if TYPED_INGESTION and not chunk_mapped.empty:
+        values = await run_cpu(
+            _typed_values, chunk_mapped.get("Último_Preço"), chunk_mapped.get("Variacao_%")
         )
+        chunk_mapped = _with_typed_values(chunk_mapped, values)
+    return chunk_mapped
+
+def _output_columns():
+    """Esquema de saída: colunas do mapper, do enriquecimento e (com TYPED_INGESTION) as tipadas."""
+    return [*output_columns(), *ENRICHED_COLUMNS, *(TYPED_COLUMNS if TYPED_INGESTION else [])]
+
+def _finish_chunk(chunk_mapped, financial_df, changed):
+    """Etapa CPU depois do enriquecimento: junta, filtra o delta e aplica demo/tipos."""
+    # Concatenar dados originais + enriquecidos (colunas tipadas no fim, como no ficheiro final)
+    chunk_mapped = chunk_mapped.reset_index(drop=True)
+    typed = [col for col in TYPED_COLUMNS if col in chunk_mapped.columns]
+    chunk_enriched = pd.concat(
+        [chunk_mapped.drop(columns=typed), financial_df.reset_index(drop=True), chunk_mapped[typed]],
+        axis=1
+    )
 
+    if DELTA_ONLY_OUTPUT and changed is not None:
+        chunk_enriched = chunk_enriched[changed].reset_index(drop=True)
+
+    if DEMO_MODE:
+        chunk_enriched = apply_demo_defaults(chunk_enriched)
+
+    if TYPED_INGESTION and not chunk_enriched.empty:
         if DEMO_MODE:
-            chunk_enriched = apply_demo_defaults(chunk_enriched)
+            # Os preços preenchidos pelo modo demo ainda não têm valor numérico
+            chunk_enriched = _type_source_columns(chunk_enriched)
+        chunk_enriched = _type_enriched_columns(chunk_enriched)
+
+    return chunk_enriched
+
+async def process_chunk(chunk, batch_size=20, batch_delay=0.05, snapshot=None, plan=None):
+    """
+    Processa um chunk de CSV: mapeia colunas e enriquece via API externa.
+    Com `snapshot` (SnapshotStore) só as linhas novas/alteradas são enriquecidas;
+    com `plan` (EnrichmentPlan) o enriquecimento segue o plano do ficheiro.
+    Só o parse tipado de preço/variação vai ao pool de processos (cpu_pool), se ativo;
+    mapeamento, enriquecimento (I/O) e montagem final ficam no event loop.
+    """
+    try:
+        with metrics.timed("map"):
+            chunk_mapped = await _ingest_chunk(chunk)
+
+        # Enriquecimento financeiro via API externa
+        changed = None
+        with metrics.timed("enrich"):
+            if snapshot is not None:
+                financial_df, changed = await _enrich_with_snapshot(
+                    chunk_mapped, snapshot, batch_size, batch_delay, plan=plan
+                )
+            else:
+                financial_df = await enrich_chunk(
+                    chunk_mapped,
+                    batch_size=batch_size,
+                    batch_delay=batch_delay,
+                    plan=plan
+                )
 
-        return chunk_enriched
+        with metrics.timed("finish"):
+            return _finish_chunk(chunk_mapped, financial_df, changed)
 
     except Exception as e:
         print(f"[PROCESSOR] Erro ao processar chunk: {e}")
+        metrics.inc("chunk_errors_total")
         return pd.DataFrame()  # Retorna dataframe vazio para não quebrar o loop
 
 
-async def process_csv_stream_async(content, chunk_size=200, batch_size=20, batch_delay=0.05):
+async def _iter_bytes(content):
+    if isinstance(content, (bytes, bytearray)):
+        yield bytes(content)
+        return
+    async for block in content:
+        yield block
+
+def _string_dtype():
+    """Strings pyarrow com NaN como valor em falta (None se o pyarrow não existir)."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError:
+        return "string[pyarrow_numpy]"
+
+_STRING_DTYPE = _string_dtype() if TYPED_INGESTION else None
+
+def _parse_decimal(text):
+    """
+    Converte números em texto ("1.234,56", "12,30", "10.00", "-1,23") para float.
+    Com vírgula e ponto, o separador decimal é o último; só com vírgula, é a vírgula.
+    """
+    text = text.str.replace(r"\s", "", regex=True)
+    has_comma = text.str.contains(",", regex=False, na=False)
+    has_dot = text.str.contains(".", regex=False, na=False)
+    comma_decimal = has_comma & (~has_dot | (text.str.rfind(",") > text.str.rfind(".")))
+    text = text.where(
+        ~comma_decimal,
+        text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+    )
+    text = text.where(~(has_comma & ~comma_decimal), text.str.replace(",", "", regex=False))
+    return pd.to_numeric(text, errors="coerce")
+
+def _typed_values(price, variation):
+    """
+    Parte CPU da ingestão tipada (regex + parse decimal): separa "EUR 12,30" em Moeda +
+    Ultimo_Preco_Valor e "-1,23%" em Variacao_Valor. Recebe só as duas colunas de
+    texto (pouco pickle) e corre no pool de processos, se ativo.
+    """
+    values = {}
+    if price is not None:
+        price = price.astype(object).where(price.notna(), None)
+        parts = price.str.extract(r"^\s*(?P<currency>[A-Z]{2,4}|[^\d\s+\-.,]+)?\s*(?P<number>[+\-]?[\d.,\s]*\d)")
+        values["Moeda"] = parts["currency"].astype("category")
+        values["Ultimo_Preco_Valor"] = _parse_decimal(parts["number"])
+    if variation is not None:
+        variation = variation.astype(object).where(variation.notna(), None)
+        variation = variation.str.replace("\u2212", "-", regex=False)
+        number = variation.str.extract(r"(?P<number>[+\-]?[\d.,\s]*\d)", expand=False)
+        values["Variacao_Valor"] = _parse_decimal(number)
+    return pd.DataFrame(values)
+
+def _with_typed_values(df, values):
+    for col in values.columns:
+        df[col] = values[col].array
+    if "Mercado" in df.columns:
+        df["Mercado"] = df["Mercado"].astype("category")
+    return df
+
+def _type_source_columns(df):
+    """Colunas tipadas de preço/variação e Mercado como categoria."""
+    return _with_typed_values(df, _typed_values(df.get("Último_Preço"), df.get("Variacao_%")))
+
+def _type_enriched_columns(df):
+    """MarketCap/PERatio para números e Sector/Industry para categorias."""
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+def _records_to_frame(header, records, start):
+    with metrics.timed("parse"):
+        frame = pd.read_csv(io.StringIO("\n".join([header, *records, ""])), dtype=_STRING_DTYPE)
+        frame.index = pd.RangeIndex(start, start + len(frame))
+    return frame
+
+async def iter_csv_chunks_async(content, chunk_size=200):
+    """
+    Lê um CSV (bytes ou stream assíncrono de bytes) e devolve DataFrames de
+    `chunk_size` linhas assim que ficam completos. Só o chunk corrente fica em memória;
+    quebras de linha dentro de campos entre aspas são respeitadas.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    header = None
+    records = []
+    current = []
+    quoted = False
+    tail = ""
+    start = 0
+
+    def feed(lines):
+        nonlocal header, records, current, quoted, start
+        for line in lines:
+            if not current and not line.strip():
+                continue
+            current.append(line)
+            if line.count('"') % 2:
+                quoted = not quoted
+            if quoted:
+                continue
+            record = "\n".join(current)
+            current = []
+            if header is None:
+                header = record
+                continue
+            records.append(record)
+
+    async for block in _iter_bytes(content):
+        lines = (tail + decoder.decode(block)).split("\n")
+        tail = lines.pop()
+        feed(lines)
+        while len(records) >= chunk_size:
+            batch, records = records[:chunk_size], records[chunk_size:]
+            yield _records_to_frame(header, batch, start)
+            start += len(batch)
+
+    tail += decoder.decode(b"", final=True)
+    feed([tail] if tail else [])
+    if current:
+        records.append("\n".join(current))
+    while records:
+        batch, records = records[:chunk_size], records[chunk_size:]
+        yield _records_to_frame(header, batch, start)
+        start += len(batch)
+
+def open_snapshot():
+    """SnapshotStore do último snapshot processado, ou None sem DELTA_PROCESSING."""
+    return SnapshotStore().load() if DELTA_PROCESSING else None
+
+async def process_csv_stream_async(content, chunk_size=200, batch_size=20, batch_delay=0.05, chunk_workers=4, cpu_workers=None, snapshot=None):
     """
-    Processa um CSV completo em chunks assíncronos e salva no caminho PROCESSED_PATH.
+    Processa um CSV em chunks assíncronos e salva no caminho PROCESSED_PATH (com a
+    extensão do OUTPUT_FORMAT: csv, parquet ou arrow). Devolve o caminho gravado, ou
+    None se não houver linhas a escrever; falhas levantam ProcessingError.
+    `content` pode ser bytes ou um stream assíncrono de bytes (ex.: BucketStream).
+
+    Pipeline produtor -> workers -> writer: o produtor lê chunks do stream para uma
+    fila limitada, `chunk_workers` workers processam-nos e o writer escreve-os pela
+    ordem original. No máximo 2 * chunk_workers chunks estão em memória de cada vez,
+    independentemente do tamanho do ficheiro.
+
+    Com DELTA_PROCESSING, as linhas iguais ao último snapshot reutilizam o
+    enriquecimento guardado e o snapshot só é atualizado se o ficheiro for até ao fim.
+    Com `snapshot` (open_snapshot) o commit fica a cargo de quem chama, depois de o
+    resultado ter sido tratado (enviado ou em fila no outbox): se o envio falhar, a
+    repetição do mesmo objeto volta a ver essas linhas como novas/alteradas.
+
+    Com ENRICH_PLANNING, cada chunk passa por um EnrichmentPlan do ficheiro: a quota é
+    reservada antes do stream pela prioridade (ENRICH_PRIORITY) dos símbolos do último
+    snapshot; os restantes ficam com o que sobra, no fim do stream.
+
+    `cpu_workers` (hint) dimensiona o pool de processos das etapas CPU; None mantém
+    o pool atual.
     """
     print("[PROCESSOR] Processando CSV em stream assíncrono...")
+    if cpu_workers is not None:
+        configure_cpu_pool(cpu_workers)
     os.makedirs(os.path.dirname(PROCESSED_PATH), exist_ok=True)
+    owned = snapshot is None
+    if owned:
+        snapshot = open_snapshot()
 
-    # Lê CSV em chunks
+    plan = EnrichmentPlan.start(snapshot) if ENRICH_PLANNING else None
     try:
-        chunks = [chunk for chunk in pd.read_csv(io.BytesIO(content), chunksize=chunk_size)]
-    except Exception as e:
-        print(f"[PROCESSOR] Erro ao ler CSV: {e}")
-        return None
+        output_path = await _process_stream(
+            content, chunk_size, batch_size, batch_delay, chunk_workers, snapshot, plan=plan
+        )
+        if plan is not None:
+            await plan.finish()
+        if owned and snapshot is not None:
+            snapshot.commit()
+        return output_path
+    finally:
+        if plan is not None:
+            plan.summary()
+
+async def _process_stream(content, chunk_size, batch_size, batch_delay, chunk_workers, snapshot, plan=None):
+    chunk_workers = max(1, int(chunk_workers or 1))
+    work_queue = asyncio.Queue(maxsize=chunk_workers)
+    done_queue = asyncio.Queue()
+    in_flight = asyncio.Semaphore(chunk_workers * 2)
+    output = get_output_writer(PROCESSED_PATH, columns=_output_columns())
+
+    async def produce():
+        index = 0
+        async for chunk in iter_csv_chunks_async(content, chunk_size=chunk_size):
+            await in_flight.acquire()  # backpressure: espera que o writer liberte espaço
+            await work_queue.put((index, chunk))
+            index += 1
+        for _ in range(chunk_workers):
+            await work_queue.put(None)
+
+    finished_workers = 0
 
-    # Cria tarefas assíncronas para cada chunk
-    tasks = [
-        process_chunk(chunk, batch_size=batch_size, batch_delay=batch_delay)
-        for chunk in chunks
-    ]
-
-    # Executa todos os chunks em paralelo
-    results = await asyncio.gather(*tasks)
-
-    # Salva CSV final
-    for i, chunk_enriched in enumerate(results):
-        if chunk_enriched.empty:
-            continue
-        chunk_enriched.to_csv(
-            PROCESSED_PATH,
-            mode="w" if i == 0 else "a",
-            header=(i == 0),
-            index=False,
-            encoding="utf-8-sig"
+    async def work():
+        nonlocal finished_workers
+        while True:
+            item = await work_queue.get()
+            if item is None:
+                finished_workers += 1
+                if finished_workers == chunk_workers:
+                    await done_queue.put(None)  # último worker: o writer pode terminar
+                return
+            index, chunk = item
+            result = await process_chunk(
+                chunk, batch_size=batch_size, batch_delay=batch_delay,
+                snapshot=snapshot, plan=plan
+            )
+            metrics.inc("chunks_total")
+            await done_queue.put((index, result))
+
+    async def write():
+        buffered = {}
+        next_index = 0
+        written = 0
+        while True:
+            item = await done_queue.get()
+            if item is None:
+                return written
+            index, result = item
+            buffered[index] = result
+            # Escreve por ordem os chunks que já terminaram
+            while next_index in buffered:
+                result = buffered.pop(next_index)
+                if not result.empty:
+                    # Serialização/escrita numa thread para não bloquear o event loop
+                    with metrics.timed("write"):
+                        await asyncio.to_thread(output.write, result)
+                    metrics.inc("rows_total", len(result))
+                    written += 1
+                next_index += 1
+                in_flight.release()
+
+    # Supervisão conjunta: se uma etapa falhar (stream, worker ou escrita), as outras
+    # são canceladas em vez de ficarem bloqueadas na fila ou no semáforo
+    producer = asyncio.create_task(produce())
+    writer = asyncio.create_task(write())
+    workers = [asyncio.create_task(work()) for _ in range(chunk_workers)]
+    tasks = [producer, writer, *workers]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except asyncio.CancelledError:
+        output.abort()
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    failed = next(
+        (task for task in tasks if not task.cancelled() and task.exception() is not None), None
+    )
+    if failed is not None:
+        stage = "escrita" if failed is writer else "leitura" if failed is producer else "worker"
+        e = failed.exception()
+        print(f"[PROCESSOR] Erro no pipeline ({stage}): {e}")
+        output.abort()
+        raise ProcessingError(f"{stage}: {e}") from e
+    written = writer.result()
+    with metrics.timed("write"):
+        output_path = output.close()
+    flush_cache()
+
+    stats = cache_stats()
+    print(
+        f"[CACHE] perfis={stats['profile']} isin={stats['isin']} índice_isin={stats['isin_index']} "
+        f"negativos={stats['negative']} hits_negativos={stats['negative_hits']} "
+        f"pedidos_hoje={stats['requests_today']}"
+    )
+
+    coalesced = coalesce_stats(reset=True)
+    if any(coalesced.values()):
+        print(
+            f"[API] Pedidos coalescidos (single-flight): perfis={coalesced['profile']} "
+            f"isin={coalesced['isin']}"
         )
 
-    print(f"[PROCESSOR] CSV processado salvo em {PROCESSED_PATH}")
-    return PROCESSED_PATH
+    if snapshot is not None:
+        counts = snapshot.counts
+        print(
+            f"[DELTA] novas={counts['new']} alteradas={counts['changed']} "
+            f"só_mercado={counts['updated']} inalteradas={counts['unchanged']}"
+        )
+
+    if written == 0 or output_path is None:
+        if DELTA_ONLY_OUTPUT and snapshot is not None:
+            print("[PROCESSOR] Nenhuma linha nova ou alterada.")
+        else:
+            print("[PROCESSOR] Nenhum chunk processado.")
+        return None
+
+    print(f"[PROCESSOR] Resultado processado salvo em {output_path}")
+    return output_path
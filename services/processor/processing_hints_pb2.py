@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16processing_hints.proto\x12\nprocessing\"\x1e\n\x0cHintsRequest\x12\x0e\n\x06source\x18\x01 \x01(\t\"Z\n\rHintsResponse\x12\x12\n\nchunk_size\x18\x01 \x01(\x05\x12\x12\n\nbatch_size\x18\x02 \x01(\x05\x12\x13\n\x0b\x62\x61tch_delay\x18\x03 \x01(\x01\x12\x0c\n\x04note\x18\x04 \x01(\t2R\n\x0fProcessingHints\x12?\n\x08GetHints\x12\x18.processing.HintsRequest\x1a\x19.processing.HintsResponseB\x1aZ\x18tp3-grpc/pb;processingpbb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16processing_hints.proto\x12\nprocessing\"\x1e\n\x0cHintsRequest\x12\x0e\n\x06source\x18\x01 \x01(\t\"\x86\x01\n\rHintsResponse\x12\x12\n\nchunk_size\x18\x01 \x01(\x05\x12\x12\n\nbatch_size\x18\x02 \x01(\x05\x12\x13\n\x0b\x62\x61tch_delay\x18\x03 \x01(\x01\x12\x0c\n\x04note\x18\x04 \x01(\t\x12\x15\n\rchunk_workers\x18\x05 \x01(\x05\x12\x13\n\x0b\x63pu_workers\x18\x06 \x01(\x05\x32R\n\x0fProcessingHints\x12?\n\x08GetHints\x12\x18.processing.HintsRequest\x1a\x19.processing.HintsResponseB\x1aZ\x18tp3-grpc/pb;processingpbb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -34,8 +34,8 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['DESCRIPTOR']._serialized_options = b'Z\030tp3-grpc/pb;processingpb'
   _globals['_HINTSREQUEST']._serialized_start=38
   _globals['_HINTSREQUEST']._serialized_end=68
-  _globals['_HINTSRESPONSE']._serialized_start=70
-  _globals['_HINTSRESPONSE']._serialized_end=160
-  _globals['_PROCESSINGHINTS']._serialized_start=162
-  _globals['_PROCESSINGHINTS']._serialized_end=244
+  _globals['_HINTSRESPONSE']._serialized_start=71
+  _globals['_HINTSRESPONSE']._serialized_end=205
+  _globals['_PROCESSINGHINTS']._serialized_start=207
+  _globals['_PROCESSINGHINTS']._serialized_end=289
 # @@protoc_insertion_point(module_scope)
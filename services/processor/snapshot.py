@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from config import SNAPSHOT_STATE_PATH
+from utils import LINK_ISIN_RE, FMP_TTL_FUNDAMENTALS
+
+# O enriquecimento só depende da identidade; preço/variação/hora mudam a cada crawl
+IDENTITY_COLUMNS = ["Nome", "Ticker", "Mercado", "Link"]
+SOURCE_COLUMNS = ["Nome", "Ticker", "Mercado", "Último_Preço", "Variacao_%", "Data_Hora", "Link"]
+ENRICHED_COLUMNS = ["MarketCap", "Sector", "Industry", "PERatio"]
+
+ROW_NEW = "new"
+ROW_CHANGED = "changed"
+ROW_UPDATED = "updated"
+ROW_UNCHANGED = "unchanged"
+# Estados que voltam a passar por enrich_chunk
+ENRICH_STATES = (ROW_NEW, ROW_CHANGED)
+
+def _clean(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+class SnapshotStore:
+    """
+    Último snapshot processado, indexado por ISIN+Mercado (do Link) ou Ticker+Mercado.
+    Para cada linha guarda dois fingerprints e o enriquecimento: o da identidade
+    (IDENTITY_COLUMNS) decide se a linha volta a passar por enrich_chunk; o da linha
+    inteira (SOURCE_COLUMNS) só distingue as linhas atualizadas (preço, variação, hora),
+    que reutilizam o enriquecimento guardado mas contam como alteradas no output delta.
+    Enriquecimento mais antigo que `max_age` segundos volta a ser pedido (respeita o
+    TTL da cache).
+
+    Estados: new | changed (identidade diferente ou enriquecimento expirado/vazio) |
+    updated (só colunas de mercado mudaram) | unchanged.
+    """
+    def __init__(self, path=SNAPSHOT_STATE_PATH, max_age=FMP_TTL_FUNDAMENTALS):
+        self.path = path
+        self.max_age = max_age
+        self.rows = {}
+        self._next = {}
+        self.counts = {ROW_NEW: 0, ROW_CHANGED: 0, ROW_UPDATED: 0, ROW_UNCHANGED: 0}
+
+    def load(self):
+        try:
+            if self.path and os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.rows = json.load(f).get("rows", {})
+        except Exception as e:
+            print(f"[DELTA] Snapshot anterior ilegível, processando tudo: {e}")
+            self.rows = {}
+        return self
+
+    def row_keys(self, df):
+        mercado = df["Mercado"].astype(object).map(str) if "Mercado" in df.columns else pd.Series("", index=df.index)
+        ticker = df["Ticker"].astype(object).map(str) if "Ticker" in df.columns else pd.Series("", index=df.index)
+        if "Link" in df.columns:
+            isin = df["Link"].astype(object).map(str).str.extract(LINK_ISIN_RE, expand=False).str.upper()
+            return isin.where(isin.notna(), ticker).astype(object) + "|" + mercado
+        return ticker + "|" + mercado
+
+    @staticmethod
+    def _hash(df, columns):
+        columns = [col for col in columns if col in df.columns]
+        source = df[columns].astype(object).where(df[columns].notna(), None)
+        return pd.util.hash_pandas_object(source, index=False).astype(str)
+
+    def fingerprints(self, df):
+        """(identidade, linha inteira) por linha."""
+        return list(zip(
+            self._hash(df, IDENTITY_COLUMNS).tolist(),
+            self._hash(df, SOURCE_COLUMNS).tolist(),
+        ))
+
+    def classify(self, df):
+        """
+        Devolve (keys, fingerprints, status) para cada linha do chunk mapeado.
+        Linhas sem enriquecimento guardado, ou com enriquecimento expirado, contam
+        como alteradas (voltam a ser enriquecidas).
+        """
+        keys = self.row_keys(df).tolist()
+        fps = self.fingerprints(df)
+        status = self._status(keys, fps)
+        for state in status:
+            self.counts[state] += 1
+        return keys, fps, status
+
+    @staticmethod
+    def _needs_enrichment(previous, oldest):
+        """Enriquecimento guardado expirado ou vazio: a linha volta a ser enriquecida."""
+        return (
+            previous.get("ts", 0) < oldest
+            or not any(v is not None for v in previous.get("enriched", {}).values())
+        )
+
+    def planning_candidates(self):
+        """
+        (símbolo, mercado) das linhas do snapshot que voltam a ser enriquecidas mesmo
+        sem mudar de identidade, para o EnrichmentPlan ordenar antes do stream começar.
+        """
+        oldest = time.time() - self.max_age
+        return [
+            (previous["symbol"], previous.get("market"))
+            for previous in self.rows.values()
+            if previous.get("symbol") and self._needs_enrichment(previous, oldest)
+        ]
+
+    def _status(self, keys, fps):
+        oldest = time.time() - self.max_age
+        status = []
+        for key, (identity, row) in zip(keys, fps):
+            previous = self.rows.get(key)
+            if previous is None:
+                status.append(ROW_NEW)
+            elif previous.get("fp") != identity or self._needs_enrichment(previous, oldest):
+                status.append(ROW_CHANGED)
+            elif previous.get("row") != row:
+                status.append(ROW_UPDATED)
+            else:
+                status.append(ROW_UNCHANGED)
+        return status
+
+    def stored_enrichment(self, keys):
+        empty = dict.fromkeys(ENRICHED_COLUMNS)
+        return [dict(self.rows.get(key, {}).get("enriched") or empty) for key in keys]
+
+    def remember(self, keys, fps, records, refreshed, symbols=None, markets=None):
+        """
+        Guarda o estado das linhas; `refreshed` marca as que foram enriquecidas agora.
+        `symbols`/`markets` (símbolo FMP e mercado por linha) servem o planeamento.
+        """
+        now = time.time()
+        symbols = symbols or [None] * len(keys)
+        markets = markets or [None] * len(keys)
+        rows = zip(keys, fps, records, refreshed, symbols, markets)
+        for key, (identity, row), record, fresh, symbol, market in rows:
+            previous_ts = self.rows.get(key, {}).get("ts", now)
+            self._next[key] = {
+                "fp": identity,
+                "row": row,
+                "enriched": {col: _clean(record.get(col)) for col in ENRICHED_COLUMNS},
+                "ts": now if fresh else previous_ts,
+                "symbol": symbol,
+                "market": _clean(market),
+            }
+
+    def commit(self):
+        """Substitui o snapshot anterior pelo atual e persiste-o (tickers removidos saem)."""
+        self.rows, self._next = self._next, {}
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows}, f, ensure_ascii=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# Os módulos do processador importam-se pelo nome (correm a partir desta pasta)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Estado em disco (snapshot, caches, pedidos) numa pasta temporária, nunca em data/
+_STATE_DIR = tempfile.mkdtemp(prefix="processor_tests_")
+os.environ.setdefault("PROCESSED_PATH", os.path.join(_STATE_DIR, "Processed", "acoes_enriched.csv"))
+os.environ.setdefault("FMP_CACHE_PATH", os.path.join(_STATE_DIR, "cache", "fmp_cache.json"))
+os.environ.setdefault("FMP_CACHE_DB_PATH", os.path.join(_STATE_DIR, "cache", "fmp_cache.sqlite3"))
+os.environ.setdefault("ISIN_INDEX_PATH", os.path.join(_STATE_DIR, "cache", "isin_index.json.gz"))
+os.environ.setdefault("CPU_WORKERS", "0")
@@ -0,0 +1,35 @@
+import bucket
+
+
+class FailedStream:
+    def __init__(self, digest, size=10):
+        self.digest = digest
+        self.complete = digest is not None
+        self.bytes_read = size
+
+
+def test_snapshot_is_handled_after_max_failures(monkeypatch):
+    monkeypatch.setattr(bucket, "BUCKET_MAX_FAILURES", 3)
+    validators = {"etag": '"v2"', "last_modified": None}
+    state = {"etag": '"v1"', "last_modified": None, "sha256": "old", "size": 5}
+
+    state = bucket._record_failure(state, FailedStream("new"), validators)
+    state = bucket._record_failure(state, FailedStream("new"), validators)
+    # Ainda por tratar: o estado anterior fica, com a contagem de falhas
+    assert state["sha256"] == "old"
+    assert state["failures"] == {"new": 2}
+    assert bucket._load_bucket_state() == state
+
+    state = bucket._record_failure(state, FailedStream("new"), validators)
+    assert state == {**validators, "sha256": "new", "size": 10}
+
+
+def test_failures_are_counted_per_content():
+    validators = {"etag": '"v2"', "last_modified": None}
+    state = bucket._record_failure({}, FailedStream("a"), validators)
+    state = bucket._record_failure(state, FailedStream("b"), validators)
+    assert state["failures"] == {"b": 1}
+
+    # Stream interrompido: sem SHA-256, conta pelo ETag
+    state = bucket._record_failure(state, FailedStream(None), validators)
+    assert state["failures"] == {'etag:"v2"': 1}
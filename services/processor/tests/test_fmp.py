@@ -0,0 +1,157 @@
+import asyncio
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import utils
+
+
+class FakeResponse:
+    def __init__(self, status, data=None, headers=None):
+        self.status = status
+        self._data = data
+        self.headers = headers or {}
+
+    async def json(self):
+        return self._data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Responde a cada URL com `handler(path, params)` -> FakeResponse e regista os pedidos."""
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        parsed = urlparse(url)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        self.requests.append((parsed.path.rsplit("/", 1)[-1], params))
+        return self.handler(parsed.path.rsplit("/", 1)[-1], params)
+
+
+def _profile(symbol):
+    return {"symbol": symbol, "mktCap": 1.0, "sector": "Tech", "industry": "Software"}
+
+
+@pytest.fixture(autouse=True)
+def fmp_state(monkeypatch):
+    monkeypatch.setattr(utils, "FMP_API_KEY", "test")
+    monkeypatch.setattr(utils, "FMP_DAILY_LIMIT", 0)
+    monkeypatch.setattr(utils, "FMP_RATE_LIMITER", utils.TokenBucket(1000, 1000))
+    monkeypatch.setattr(utils, "_BATCH_DISABLED_UNTIL", 0.0)
+    monkeypatch.setattr(utils, "_BATCH_SUSPECT", 0)
+    utils._ensure_cache_loaded()
+    utils.API_CACHE.clear()
+    utils.ISIN_CACHE.clear()
+    utils.NEGATIVE_CACHE.clear()
+    yield
+    # Cada teste corre no seu event loop: não deixa flushes agendados no anterior
+    utils.flush_cache()
+
+
+def test_suspicious_batch_falls_back_and_marks_unknown_symbols():
+    known = {"AAA"}
+
+    def handler(path, params):
+        symbols = params["symbol"].split(",")
+        return FakeResponse(200, [_profile(s) for s in symbols if s in known])
+
+    session = FakeSession(handler)
+    results = asyncio.run(utils._fetch_profiles(session, ["AAA", "BBB", "CCC"], delay=0))
+
+    assert set(results) == {"AAA"}
+    # Um lote suspeito não desativa os lotes, mas confirma os restantes um a um
+    assert utils._batching_enabled()
+    assert [p["symbol"] for _, p in session.requests[1:]] == ["BBB", "CCC"]
+    assert utils._negative_reason("profile", "BBB", count=False) == utils.NEGATIVE_NOT_FOUND
+
+
+def test_batching_disabled_after_consecutive_suspicious_batches(monkeypatch):
+    monkeypatch.setattr(utils, "FMP_BATCH_SUSPECT_LIMIT", 2)
+    monkeypatch.setattr(utils, "FMP_BATCH_REPROBE", 0.05)
+
+    def handler(path, params):
+        # Plano sem lotes: só responde ao primeiro símbolo
+        return FakeResponse(200, [_profile(params["symbol"].split(",")[0])])
+
+    session = FakeSession(handler)
+    asyncio.run(utils._fetch_profiles(session, ["A1", "A2", "A3"], delay=0))
+    assert utils._batching_enabled()
+    asyncio.run(utils._fetch_profiles(session, ["B1", "B2", "B3"], delay=0))
+    assert not utils._batching_enabled()
+    assert utils.symbols_per_request() == 1
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert utils._batching_enabled()
+
+
+def test_batching_disabled_on_explicit_refusal():
+    def handler(path, params):
+        if "," in params["symbol"]:
+            return FakeResponse(402)
+        return FakeResponse(200, [_profile(params["symbol"])])
+
+    session = FakeSession(handler)
+    results = asyncio.run(utils._fetch_profiles(session, ["AAA", "BBB"], delay=0))
+
+    assert set(results) == {"AAA", "BBB"}
+    assert not utils._batching_enabled()
+
+
+def test_isin_lookup_retries_transient_errors():
+    responses = [FakeResponse(500), FakeResponse(200, [{"symbol": "ASML"}])]
+    session = FakeSession(lambda path, params: responses.pop(0))
+
+    symbol = asyncio.run(utils._lookup_isin(session, "NL0010273215", delay=0))
+
+    assert symbol == "ASML"
+    assert len(session.requests) == 2
+    assert utils._negative_reason("isin", "NL0010273215", count=False) is None
+
+
+def test_isin_lookup_never_negative_caches_rate_limits():
+    session = FakeSession(lambda path, params: FakeResponse(429, headers={"Retry-After": "0"}))
+
+    assert asyncio.run(utils._lookup_isin(session, "NL0010273215", delay=0)) is None
+    assert len(session.requests) == 3
+    assert utils._negative_reason("isin", "NL0010273215", count=False) is None
+
+
+def test_isin_lookup_negative_caches_after_retries():
+    session = FakeSession(lambda path, params: FakeResponse(503))
+    assert asyncio.run(utils._lookup_isin(session, "NL0010273215", delay=0)) is None
+    assert utils._negative_reason("isin", "NL0010273215", count=False) == utils.NEGATIVE_FAILED
+
+    session = FakeSession(lambda path, params: FakeResponse(200, []))
+    assert asyncio.run(utils._lookup_isin(session, "US0378331005", delay=0)) is None
+    assert len(session.requests) == 1
+    assert utils._negative_reason("isin", "US0378331005", count=False) == utils.NEGATIVE_NOT_FOUND
+
+
+def test_profile_never_negative_caches_rate_limits():
+    session = FakeSession(lambda path, params: FakeResponse(429, headers={"Retry-After": "0"}))
+
+    assert asyncio.run(utils._fetch_profile(session, "AAA", delay=0)) is None
+    assert len(session.requests) == 3
+    assert utils._negative_reason("profile", "AAA", count=False) is None
+
+
+def test_rate_limited_batch_does_not_negative_cache_its_symbols():
+    session = FakeSession(lambda path, params: FakeResponse(429, headers={"Retry-After": "0"}))
+
+    assert asyncio.run(utils._fetch_profiles(session, ["AAA", "BBB"], delay=0)) == {}
+    assert utils._negative_reason("profile", "AAA", count=False) is None
+    assert utils._negative_reason("profile", "BBB", count=False) is None
+
+
+def test_profile_negative_caches_after_failed_retries():
+    session = FakeSession(lambda path, params: FakeResponse(503))
+
+    assert asyncio.run(utils._fetch_profile(session, "AAA", delay=0)) is None
+    assert utils._negative_reason("profile", "AAA", count=False) == utils.NEGATIVE_FAILED
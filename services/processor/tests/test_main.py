@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+import main
+from snapshot import SnapshotStore
+
+
+class FakeStream:
+    etag = '"v1"'
+
+    async def matches_previous(self):
+        return False
+
+
+def _cycle(monkeypatch, tmp_path, send):
+    store = SnapshotStore(path=str(tmp_path / "snapshot.json"))
+
+    async def process(stream, snapshot=None, **kwargs):
+        snapshot.remember(["AAA|XPAR"], [("id", "row")], [{"Sector": "Tech"}], [True])
+        return "out.csv"
+
+    monkeypatch.setattr(main, "open_snapshot", lambda: store)
+    monkeypatch.setattr(main, "process_csv_stream_async", process)
+    monkeypatch.setattr(main, "send_to_xml_service_async", send)
+    return asyncio.run(main.process_cycle(FakeStream())), store
+
+
+def test_snapshot_is_kept_when_the_send_fails(monkeypatch, tmp_path):
+    async def send(csv_path, bucket_etag=None):
+        raise RuntimeError("XML Service em baixo e outbox indisponível")
+
+    handled, store = _cycle(monkeypatch, tmp_path, send)
+
+    # A repetição do mesmo objeto volta a ver as linhas como novas
+    assert not handled
+    assert store.rows == {}
+    assert not os.path.exists(store.path)
+
+
+def test_snapshot_is_committed_once_the_cycle_is_handled(monkeypatch, tmp_path):
+    async def send(csv_path, bucket_etag=None):
+        return "r1"
+
+    handled, store = _cycle(monkeypatch, tmp_path, send)
+
+    assert handled
+    assert SnapshotStore(path=store.path).load().rows["AAA|XPAR"]["enriched"]["Sector"] == "Tech"
@@ -0,0 +1,133 @@
+import asyncio
+import os
+
+import pytest
+
+import outbox
+import pending_store
+from outbox import Outbox
+from pending_store import PendingRequestStore
+from xml_client import XmlServiceError
+
+
+@pytest.fixture
+def box(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_BASE", 0.01)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_JITTER", 0)
+
+    def make(max_depth=10):
+        store = PendingRequestStore(path=str(tmp_path / "pending.sqlite3")).load()
+        return Outbox(store=store, directory=str(tmp_path / "outbox"), max_depth=max_depth).load()
+    return make
+
+
+async def _spool(box, tmp_path, ids):
+    for id_req in ids:
+        path = tmp_path / f"{id_req}.csv"
+        path.write_text(f"snapshot {id_req}\n")
+        box.store.add(id_req, str(path))
+        assert await box.spool(id_req, str(path), "503")
+
+
+def test_empty_store_is_not_replaced_by_the_singleton(tmp_path):
+    store = PendingRequestStore(path=str(tmp_path / "pending.sqlite3")).load()
+    assert len(store) == 0
+    assert Outbox(store=store, directory=str(tmp_path / "outbox")).store is store
+
+
+def test_delivery_is_fifo_with_one_in_flight(box, tmp_path):
+    box = box()
+    delivered = []
+    state = {"inflight": 0, "max": 0, "failures": 2}
+
+    async def deliver(record):
+        state["inflight"] += 1
+        state["max"] = max(state["max"], state["inflight"])
+        try:
+            await asyncio.sleep(0.01)
+            # O mais antigo falha as primeiras vezes: os outros têm de esperar por ele
+            if state["failures"]:
+                state["failures"] -= 1
+                raise RuntimeError("503")
+            delivered.append(record["id"])
+        finally:
+            state["inflight"] -= 1
+
+    async def run():
+        await _spool(box, tmp_path, ["r1", "r2", "r3"])
+        task = asyncio.create_task(box.run(deliver))
+        while len(box):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert delivered == ["r1", "r2", "r3"]
+    assert state["max"] == 1
+    assert [box.store.get(i)["state"] for i in delivered] == [pending_store.STATE_SENT] * 3
+
+
+def test_full_outbox_drops_the_oldest(box, tmp_path):
+    box = box(max_depth=2)
+    asyncio.run(_spool(box, tmp_path, ["r1", "r2", "r3"]))
+
+    assert [r["id"] for r in box.store.queued()] == ["r2", "r3"]
+    assert box.store.get("r1") is None
+    assert sorted(os.listdir(box.directory)) == ["r2.csv", "r3.csv"]
+
+
+def _run_until_empty(box, deliver):
+    async def run():
+        task = asyncio.create_task(box.run(deliver))
+        while len(box):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_rejected_upload_does_not_block_the_queue(box, tmp_path):
+    box = box()
+    asyncio.run(_spool(box, tmp_path, ["r1", "r2"]))
+    delivered = []
+
+    async def deliver(record):
+        if record["id"] == "r1":
+            raise XmlServiceError(413, "Ficheiro demasiado grande")
+        delivered.append(record["id"])
+
+    _run_until_empty(box, deliver)
+
+    assert delivered == ["r2"]
+    assert box.store.get("r1") is None
+    assert not os.path.exists(os.path.join(box.directory, "r1.csv"))
+
+
+def test_transient_errors_are_dropped_after_max_attempts(box, tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    box = box()
+    asyncio.run(_spool(box, tmp_path, ["r1"]))
+    attempts = []
+
+    async def deliver(record):
+        attempts.append(record["id"])
+        # 429 é transitório: conta para o limite mas não descarta logo
+        raise XmlServiceError(429, "Too Many Requests")
+
+    _run_until_empty(box, deliver)
+
+    # A primeira tentativa foi o envio original que levou ao spool
+    assert attempts == ["r1", "r1"]
+    assert box.store.get("r1") is None
+
+
+def test_spool_keeps_the_entry_in_flight_at_depth_one(box, tmp_path):
+    box = box(max_depth=1)
+    asyncio.run(_spool(box, tmp_path, ["r1"]))
+    box._inflight = "r1"
+
+    asyncio.run(_spool(box, tmp_path, ["r2"]))
+
+    assert [r["id"] for r in box.store.queued()] == ["r1", "r2"]
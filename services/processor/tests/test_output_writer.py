@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+from output_writer import CsvOutputWriter, ParquetOutputWriter
+
+pytest.importorskip("pyarrow")
+
+
+def test_columnar_schema_comes_from_output_columns(tmp_path):
+    writer = ParquetOutputWriter(str(tmp_path / "out.csv"), columns=["Ticker", "MarketCap", "Sector"])
+    writer.write(pd.DataFrame({"Ticker": ["AAA"], "MarketCap": ["1.5"]}))
+    # Coluna que não veio no primeiro chunk continua no ficheiro
+    writer.write(pd.DataFrame({"Ticker": ["BBB"], "MarketCap": [None], "Sector": ["Tech"]}))
+    path = writer.close()
+
+    table = pd.read_parquet(path)
+    assert list(table.columns) == ["Ticker", "MarketCap", "Sector"]
+    assert table["Sector"].isna().tolist() == [True, False]
+    assert table["MarketCap"].tolist()[0] == 1.5
+
+
+def test_unexpected_column_fails_loudly(tmp_path):
+    writer = CsvOutputWriter(str(tmp_path / "out.csv"))
+    writer.write(pd.DataFrame({"Ticker": ["AAA"], "Nome": ["Alfa"]}))
+    with pytest.raises(ValueError):
+        writer.write(pd.DataFrame({"Ticker": ["BBB"], "Extra": [1]}))
+    writer.abort()
+    assert not (tmp_path / "out.csv.tmp").exists()
@@ -0,0 +1,102 @@
+import asyncio
+import sqlite3
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import bucket
+import pending_store
+from pending_store import PendingRequestStore
+
+
+def test_request_lifecycle(tmp_path):
+    store = PendingRequestStore(path=str(tmp_path / "pending.sqlite3")).load()
+    store.add("r1", "out.csv", "Crawler/acoes.csv", bucket_etag='"v1"')
+
+    assert store.get("r1")["state"] == pending_store.STATE_SENT
+    assert store.queue("r1", "outbox/r1.csv")["state"] == pending_store.STATE_QUEUED
+    assert [r["id"] for r in store.queued()] == ["r1"]
+    assert store.mark_delivered("r1")["state"] == pending_store.STATE_SENT
+
+    info = store.acknowledge("r1", 7)
+    assert info["state"] == pending_store.STATE_ACKNOWLEDGED
+    assert info["bucket_etag"] == '"v1"'
+    assert store.acknowledge("r1", 7) is None  # webhook repetido
+    assert len(store) == 0
+
+    # Persistido: um restart não reabre o pedido fechado
+    reloaded = PendingRequestStore(path=store.path).load()
+    assert reloaded.get("r1") is None
+    with sqlite3.connect(store.path) as conn:
+        assert conn.execute("SELECT state FROM requests").fetchall() == [(pending_store.STATE_ACKNOWLEDGED,)]
+
+
+def test_retryable_failure_then_expiry(tmp_path, monkeypatch):
+    monkeypatch.setattr(pending_store, "PENDING_MAX_ATTEMPTS", 2)
+    store = PendingRequestStore(path=str(tmp_path / "pending.sqlite3")).load()
+    store.add("r1", "out.csv")
+
+    assert store.fail("r1", "ERRO_PERSISTENCIA")["state"] == pending_store.STATE_FAILED
+    assert [action for _, action in store.due(now=store.get("r1")["updated"] + 3600)] == ["retry"]
+    store.mark_retry("r1")
+    assert [action for _, action in store.due(now=store.get("r1")["updated"] + 3600)] == ["expire"]
+
+    store.add("r2", "other.csv")
+    assert store.fail("r2", "ERRO_VALIDACAO")["open"] == 0  # erro definitivo
+
+
+def test_new_send_for_same_file_expires_the_previous(tmp_path):
+    store = PendingRequestStore(path=str(tmp_path / "pending.sqlite3")).load()
+    store.add("r1", "out.csv")
+    store.add("r2", "out.csv")
+    assert store.get("r1") is None
+    assert store.get("r2")["state"] == pending_store.STATE_SENT
+
+
+def test_old_database_gains_bucket_etag_column(tmp_path):
+    path = str(tmp_path / "pending.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE requests (id TEXT PRIMARY KEY, state TEXT NOT NULL, open INTEGER NOT NULL,"
+        " csv TEXT, bucket TEXT, attempts INTEGER NOT NULL DEFAULT 1, created REAL NOT NULL,"
+        " updated REAL NOT NULL, status TEXT, doc_id TEXT, reason TEXT)"
+    )
+    conn.execute("INSERT INTO requests VALUES ('old', 'sent', 1, 'a.csv', 'b.csv', 1, 0, 0, NULL, NULL, NULL)")
+    conn.commit()
+    conn.close()
+
+    store = PendingRequestStore(path=path).load()
+    assert store.get("old")["bucket_etag"] is None
+    store.add("new", "c.csv", bucket_etag='"v2"')
+    assert PendingRequestStore(path=path).load().get("new")["bucket_etag"] == '"v2"'
+
+
+def _bucket_server(current_etag, deleted):
+    async def head(request):
+        return web.Response(headers={"ETag": current_etag})
+
+    async def delete(request):
+        deleted.append(request.headers.get("If-Match"))
+        return web.json_response({"message": "deleted"})
+
+    app = web.Application()
+    app.router.add_route("HEAD", "/storage/v1/object/{bucket}/{name:.*}", head)
+    app.router.add_delete("/storage/v1/object/{bucket}/{name:.*}", delete)
+    return app
+
+
+def _delete(monkeypatch, current_etag, etag):
+    deleted = []
+
+    async def run():
+        async with TestServer(_bucket_server(current_etag, deleted)) as server:
+            monkeypatch.setattr(bucket, "get_supabase_config", lambda: (str(server.make_url("")).rstrip("/"), "key"))
+            return await bucket.delete_from_bucket_async("data", "Crawler/acoes.csv", etag=etag)
+
+    return asyncio.run(run()), deleted
+
+
+def test_bucket_object_deleted_only_if_etag_matches(monkeypatch):
+    assert _delete(monkeypatch, 'W/"v1"', '"v1"') == (True, ['"v1"'])
+    # Entretanto o crawler subiu um snapshot novo com o mesmo nome
+    assert _delete(monkeypatch, '"v2"', '"v1"') == (False, [])
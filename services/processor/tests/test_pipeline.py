@@ -0,0 +1,115 @@
+import asyncio
+import random
+import pandas as pd
+import pytest
+import processing
+from processing import ProcessingError, _process_stream
+
+def _csv(rows):
+    lines = ["Nome,Ticker,Mercado"] + [f"Empresa {i},T{i},XPAR" for i in range(rows)]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+class RecordingWriter:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.frames = []
+        self.aborted = False
+
+    def write(self, df):
+        if self.fail_on is not None and len(self.frames) >= self.fail_on:
+            raise OSError("No space left on device")
+        self.frames.append(df)
+
+    def close(self):
+        return "out.csv" if self.frames else None
+
+    def abort(self):
+        self.aborted = True
+
+@pytest.fixture
+def writer(monkeypatch):
+    def install(**kwargs):
+        instance = RecordingWriter(**kwargs)
+        monkeypatch.setattr(processing, "get_output_writer", lambda path, **kwargs: instance)
+        return instance
+    return install
+
+def _passthrough(delay=0.0):
+    async def process_chunk(chunk, **kwargs):
+        if delay:
+            await asyncio.sleep(random.uniform(0, delay))
+        return chunk
+    return process_chunk
+
+def _run(coro, timeout=5):
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+def test_chunks_are_written_in_source_order(monkeypatch, writer):
+    out = writer()
+    monkeypatch.setattr(processing, "process_chunk", _passthrough(delay=0.01))
+    path = _run(_process_stream(_csv(50), 3, 20, 0, 4, None))
+    assert path == "out.csv"
+    result = pd.concat(out.frames)
+    assert result["Ticker"].tolist() == [f"T{i}" for i in range(50)]
+
+def test_writer_failure_stops_the_pipeline(monkeypatch, writer):
+    # Mais chunks do que os 2 * chunk_workers em voo: sem supervisão o produtor
+    # ficava bloqueado no semáforo para sempre
+    out = writer(fail_on=1)
+    monkeypatch.setattr(processing, "process_chunk", _passthrough())
+    with pytest.raises(ProcessingError, match="escrita"):
+        _run(_process_stream(_csv(100), 1, 20, 0, 2, None))
+    assert out.aborted
+
+def test_worker_failure_stops_the_pipeline(monkeypatch, writer):
+    out = writer()
+
+    async def broken(chunk, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(processing, "process_chunk", broken)
+    with pytest.raises(ProcessingError, match="worker"):
+        _run(_process_stream(_csv(100), 1, 20, 0, 2, None))
+    assert out.aborted
+
+def test_stream_failure_stops_the_pipeline(monkeypatch, writer):
+    out = writer()
+    monkeypatch.setattr(processing, "process_chunk", _passthrough())
+
+    async def truncated():
+        yield _csv(10)
+        raise ConnectionResetError("ligação perdida")
+
+    with pytest.raises(ProcessingError, match="leitura"):
+        _run(_process_stream(truncated(), 2, 20, 0, 2, None))
+    assert out.aborted
+
+
+def test_source_columns_are_typed_at_ingestion():
+    raw = pd.DataFrame({
+        "Name": ["Alfa", "Beta"],
+        "Símbolo": ["AAA", "BBB"],
+        "Mercado": ["XPAR", "XAMS"],
+        "Último (Preço)": ["EUR 1.234,50", "USD 10.00"],
+        "%": ["-1,23%", "−0,50%"],
+    })
+
+    mapped = asyncio.run(processing._ingest_chunk(raw))
+
+    assert mapped["Ultimo_Preco_Valor"].tolist() == [1234.5, 10.0]
+    assert mapped["Variacao_Valor"].tolist() == [-1.23, -0.5]
+    assert mapped["Moeda"].tolist() == ["EUR", "USD"]
+    assert isinstance(mapped["Mercado"].dtype, pd.CategoricalDtype)
+
+
+def test_demo_seeds_match_the_row_by_row_seed():
+    # None numa coluna de texto: o iterrows antigo via NaN nas linhas só com texto
+    # e None nas linhas com números
+    df = pd.DataFrame({
+        "Nome": pd.Series([None, None, "Beta", pd.NA, float("nan")], dtype=object),
+        "Ticker": pd.Series(["AAA", "BBB", None, "DDD", "EEE"], dtype=object),
+        "MarketCap": pd.Series([None, 2.5e9, None, None, 1.0], dtype=object),
+    })
+
+    expected = [processing._demo_seed(row) for _, row in df.iterrows()]
+    assert processing._demo_seeds(df).tolist() == expected
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import planner
+import utils
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Substitui os pedidos à FMP: regista cada chamada e devolve um perfil por símbolo."""
+    calls = []
+
+    async def fake_sentiments(session, symbols, use_cache=True):
+        calls.append(list(symbols))
+        await asyncio.sleep(0.01)
+        return [{"MarketCap": 1.0, "Sector": s, "Industry": None, "PERatio": None} for s in symbols]
+
+    monkeypatch.setattr(planner, "get_financial_sentiments", fake_sentiments)
+    utils._ensure_cache_loaded()
+    utils.API_CACHE.clear()
+    utils.NEGATIVE_CACHE.clear()
+    return calls
+
+
+@pytest.fixture
+def markets(monkeypatch):
+    # Só o mercado decide a prioridade (nenhum símbolo está em cache)
+    monkeypatch.setattr(planner, "ENRICH_PRIORITY", ["market"])
+    monkeypatch.setattr(planner, "ENRICH_PRIORITY_MARKETS", ["XPAR", "XAMS", "XBRU"])
+
+
+def test_quota_follows_priority_not_arrival(fetched, markets):
+    plan = planner.EnrichmentPlan(quota=1, per_request=1)
+    plan.reserve([("LOW", "XBRU"), ("HIGH", "XPAR")])
+
+    async def run():
+        # LOW chega primeiro, mas a quota já está reservada para HIGH
+        low = await plan.enrich(["LOW"], {"LOW": "XBRU"})
+        high = await plan.enrich(["HIGH"], {"HIGH": "XPAR"})
+        await plan.finish()
+        return low, high
+
+    low, high = asyncio.run(run())
+
+    assert fetched == [["HIGH"]]
+    assert low["LOW"]["Sector"] is None
+    assert high["HIGH"]["Sector"] == "HIGH"
+    assert plan.skipped == 1
+
+
+def test_new_symbols_get_what_is_left_at_end_of_stream(fetched, markets):
+    plan = planner.EnrichmentPlan(quota=2, per_request=1)
+    plan.reserve([("GONE", "XPAR"), ("KEPT", "XAMS")])
+
+    async def run():
+        await plan.enrich(["NEW1"], {"NEW1": "XBRU"})
+        await plan.enrich(["KEPT"], {"KEPT": "XAMS"})
+        await plan.enrich(["NEW2"], {"NEW2": "XPAR"})
+        await plan.finish()
+
+    asyncio.run(run())
+
+    # Sem quota livre os novos esperam pelo fim; a reserva de GONE (fora do ficheiro)
+    # vai para o novo mais prioritário, não para o primeiro a chegar
+    assert fetched == [["KEPT"], ["NEW2"]]
+    assert plan.late == ["NEW2"]
+    assert plan.skipped == 1
+
+
+def test_concurrent_chunks_share_in_flight_symbols(fetched):
+    plan = planner.EnrichmentPlan(quota=None, per_request=25)
+
+    async def run():
+        return await asyncio.gather(plan.enrich(["AAA", "BBB"]), plan.enrich(["BBB", "CCC"]))
+
+    first, second = asyncio.run(run())
+
+    assert sorted(sum(fetched, [])) == ["AAA", "BBB", "CCC"]
+    assert second["BBB"]["Sector"] == "BBB"
@@ -0,0 +1,77 @@
+import asyncio
+import time
+import pandas as pd
+import processing
+from snapshot import SnapshotStore, ROW_NEW, ROW_CHANGED, ROW_UPDATED, ROW_UNCHANGED
+
+def _frame(prices, names=None):
+    names = names or ["Alpha", "Beta", "Gamma"]
+    return pd.DataFrame({
+        "Nome": names,
+        "Ticker": ["AAA", "BBB", "CCC"],
+        "Mercado": ["XPAR"] * 3,
+        "Último_Preço": prices,
+        "Variacao_%": ["+1,0%"] * 3,
+        "Data_Hora": ["10:00"] * 3,
+        "Link": [
+            "https://live.euronext.com/pt/product/equities/FR0000000001-XPAR",
+            "https://live.euronext.com/pt/product/equities/FR0000000002-XPAR",
+            "https://live.euronext.com/pt/product/equities/FR0000000003-XPAR",
+        ],
+    })
+
+ENRICHED = {"MarketCap": 1e9, "Sector": "Tech", "Industry": "Software", "PERatio": 12.0}
+
+def _remember(store, df):
+    keys, fps, status = store.classify(df)
+    store.remember(keys, fps, [dict(ENRICHED) for _ in keys], [True] * len(keys))
+    store.commit()
+    return status
+
+def test_price_only_changes_keep_the_enrichment(tmp_path):
+    store = SnapshotStore(path=str(tmp_path / "snapshot.json"))
+    assert _remember(store, _frame(["EUR 1,00", "EUR 2,00", "EUR 3,00"])) == [ROW_NEW] * 3
+
+    reloaded = SnapshotStore(path=str(tmp_path / "snapshot.json")).load()
+    _, _, status = reloaded.classify(_frame(["EUR 1,10", "EUR 2,00", "EUR 3,00"], ["Alpha", "Beta", "Gamma SA"]))
+    assert status == [ROW_UPDATED, ROW_UNCHANGED, ROW_CHANGED]
+
+def test_expired_enrichment_is_refreshed(tmp_path):
+    store = SnapshotStore(path=str(tmp_path / "snapshot.json"), max_age=60)
+    _remember(store, _frame(["EUR 1,00"] * 3))
+    for row in store.rows.values():
+        row["ts"] = time.time() - 120
+    _, _, status = store.classify(_frame(["EUR 1,00"] * 3))
+    assert status == [ROW_CHANGED] * 3
+
+def test_only_identity_changes_are_enriched(tmp_path, monkeypatch):
+    store = SnapshotStore(path=str(tmp_path / "snapshot.json"))
+    _remember(store, _frame(["EUR 1,00", "EUR 2,00", "EUR 3,00"]))
+    enriched_rows = []
+
+    async def fake_enrich(chunk, **kwargs):
+        enriched_rows.extend(chunk["Ticker"].tolist())
+        return pd.DataFrame([{**ENRICHED, "Sector": "New"} for _ in range(len(chunk))])
+
+    monkeypatch.setattr(processing, "enrich_chunk", fake_enrich)
+    df = _frame(["EUR 1,50", "EUR 2,00", "EUR 3,00"], ["Alpha", "Beta", "Gamma SA"])
+    financial, changed = asyncio.run(processing._enrich_with_snapshot(df, store, 20, 0))
+
+    assert enriched_rows == ["CCC"]
+    assert financial["Sector"].tolist() == ["Tech", "Tech", "New"]
+    # Para DELTA_ONLY_OUTPUT a linha com preço novo conta como alterada
+    assert changed.tolist() == [True, False, True]
+
+def test_expired_rows_are_planning_candidates(tmp_path, monkeypatch):
+    store = SnapshotStore(path=str(tmp_path / "snapshot.json"), max_age=60)
+
+    async def fake_enrich(chunk, **kwargs):
+        return pd.DataFrame([dict(ENRICHED) for _ in range(len(chunk))])
+
+    monkeypatch.setattr(processing, "enrich_chunk", fake_enrich)
+    asyncio.run(processing._enrich_with_snapshot(_frame(["EUR 1,00"] * 3), store, 20, 0))
+    store.commit()
+    assert store.planning_candidates() == []
+
+    store.rows["FR0000000002|XPAR"]["ts"] = time.time() - 120
+    assert store.planning_candidates() == [("BBB", "XPAR")]
@@ -0,0 +1,22 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook
+
+
+def _post(path, **kwargs):
+    async def run():
+        async with TestClient(TestServer(webhook.create_app())) as client:
+            resp = await client.post(path, **kwargs)
+            return resp.status
+    return asyncio.run(run())
+
+
+def test_non_object_json_is_rejected():
+    assert _post("/webhook", json=["ID_Requisicao", "OK"]) == 400
+    assert _post("/ingest", json="novo.csv") == 400
+
+
+def test_unknown_request_is_acknowledged():
+    assert _post("/webhook", json={"ID_Requisicao": "desconhecido", "Status": "OK"}) == 200
@@ -0,0 +1,55 @@
+import asyncio
+import gzip
+
+import pytest
+
+import xml_client
+
+
+async def _read_chunked(reader):
+    body = b""
+    while True:
+        size = int((await reader.readline()).strip(), 16)
+        if size == 0:
+            await reader.readline()
+            return body
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+def test_zstd_rejected_with_415_falls_back_to_gzip(tmp_path, monkeypatch):
+    if xml_client.zstandard is None:
+        pytest.skip("zstandard não instalado")
+    csv_path = tmp_path / "acoes.csv"
+    csv_path.write_bytes(b"Nome,Ticker\nAlfa,AAA\n")
+    received = []
+
+    # Servidor HTTP mínimo: o parser do aiohttp recusa zstd antes de chegar ao handler
+    async def handle(reader, writer):
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+        encoding = head.split("content-encoding: ", 1)[1].split("\r\n", 1)[0]
+        received.append(encoding)
+        if encoding == "gzip":
+            assert gzip.decompress(await _read_chunked(reader)) == csv_path.read_bytes()
+            status = b"200 OK"
+        else:
+            status = b"415 Unsupported Media Type"
+        writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    monkeypatch.setattr(xml_client, "XML_UPLOAD_ENCODING", "zstd")
+    monkeypatch.setattr(xml_client, "_ZSTD_REJECTED", False)
+    monkeypatch.setattr(xml_client, "JAVA_WEBHOOK_URL", "http://processor/webhook")
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(xml_client, "WEBHOOK_XML_URL", f"http://127.0.0.1:{port}/process_csv")
+        async with server:
+            await xml_client._post_stream(str(csv_path), "r1", "1.0")
+            await xml_client._post_stream(str(csv_path), "r2", "1.0")
+
+    asyncio.run(run())
+    # Só o primeiro envio tenta zstd; os seguintes já vão em gzip
+    assert received == ["zstd", "gzip", "gzip"]
@@ -1,17 +1,17 @@
 import os
 import re
-import ssl
-import json
+import time
+import atexit
+from collections import OrderedDict
 from datetime import datetime, timezone
-import aiohttp
+from email.utils import parsedate_to_datetime
 import asyncio
 import pandas as pd
 from dotenv import load_dotenv
-
-try:
-    import certifi
-except ImportError:
-    certifi = None
+from cache_store import get_cache_store
+from isin_index import get_isin_index
+from http_client import SSL_CONTEXT, http_session
+import metrics
 
 def _load_env_files():
     paths = [".env", os.path.join("env", "tp3.env"), os.path.join("env", "tp3-1.env")]
@@ -25,68 +25,267 @@ def _load_env_files():
 
 _load_env_files()
 
-SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where()) if certifi else None
-
 # Variáveis da FMP API
 FMP_API_KEY = os.getenv("FMP_API_KEY")
 FMP_API_BASE = os.getenv("FMP_API_BASE", "https://financialmodelingprep.com/stable").rstrip("/")
 FMP_RESOLVE_ISIN = os.getenv("FMP_RESOLVE_ISIN", "0").lower() in ("1", "true", "yes")
 FMP_DAILY_LIMIT = int(os.getenv("FMP_DAILY_LIMIT", "250"))
-FMP_CACHE_PATH = os.getenv("FMP_CACHE_PATH", "data/cache/fmp_cache.json")
+FMP_CACHE_FLUSH_DELAY = float(os.getenv("FMP_CACHE_FLUSH_DELAY", "2.0"))
+FMP_CACHE_FLUSH_MAX = int(os.getenv("FMP_CACHE_FLUSH_MAX", "500"))
+# TTLs em segundos: sector/industry mudam pouco, market cap/PE ficam velhos depressa
+FMP_TTL_PROFILE = float(os.getenv("FMP_TTL_PROFILE", str(30 * 86400)))
+FMP_TTL_FUNDAMENTALS = float(os.getenv("FMP_TTL_FUNDAMENTALS", str(86400)))
+FMP_TTL_ISIN = float(os.getenv("FMP_TTL_ISIN", str(90 * 86400)))
+# Cache negativa: símbolos/ISINs sem resposta útil não voltam a gastar quota
+FMP_TTL_NEGATIVE = float(os.getenv("FMP_TTL_NEGATIVE", str(6 * 3600)))
+FMP_TTL_NEGATIVE_FAILED = float(os.getenv("FMP_TTL_NEGATIVE_FAILED", str(3600)))
+FMP_CACHE_MAX_ENTRIES = int(os.getenv("FMP_CACHE_MAX_ENTRIES", "5000"))
+FMP_CACHE_SWR = os.getenv("FMP_CACHE_SWR", "1").lower() in ("1", "true", "yes")
+# Símbolos por pedido /profile (separados por vírgula); 1 desliga os pedidos em lote
+FMP_BATCH_SYMBOLS = int(os.getenv("FMP_BATCH_SYMBOLS", "25"))
+# Lotes seguidos com no máximo um perfil até desativar os lotes, e segundos até voltar a testá-los
+FMP_BATCH_SUSPECT_LIMIT = int(os.getenv("FMP_BATCH_SUSPECT_LIMIT", "3"))
+FMP_BATCH_REPROBE = float(os.getenv("FMP_BATCH_REPROBE", "3600"))
+# Rate limiter (token bucket) partilhado por todos os pedidos à FMP
+FMP_RATE_PER_SEC = float(os.getenv("FMP_RATE_PER_SEC", "5"))
+FMP_RATE_BURST = float(os.getenv("FMP_RATE_BURST", "10"))
+FMP_RATE_MIN = float(os.getenv("FMP_RATE_MIN", "0.5"))
+FMP_RATE_RECOVERY = float(os.getenv("FMP_RATE_RECOVERY", "0.05"))
 ENRICH_MAX_TICKERS = int(os.getenv("ENRICH_MAX_TICKERS", "20"))
 ENRICH_TOTAL_MAX = int(os.getenv("ENRICH_TOTAL_MAX", "0"))
-if not FMP_API_KEY:
-    raise RuntimeError("FMP_API_KEY não definida. Configure a variável de ambiente.")
 
-API_CACHE = {}
-ISIN_CACHE = {}
+PROFILE_FIELDS = ("MarketCap", "Sector", "Industry", "PERatio")
+FUNDAMENTAL_FIELDS = ("MarketCap", "PERatio")
+
+# Entradas com timestamp "_ts"; a ordem do OrderedDict é a ordem LRU
+API_CACHE = OrderedDict()
+ISIN_CACHE = OrderedDict()
+NEGATIVE_CACHE = OrderedDict()
+NEGATIVE_NOT_FOUND = "not_found"
+NEGATIVE_FORBIDDEN = "forbidden"
+NEGATIVE_FAILED = "failed"
 ISIN_RE = re.compile(r"^[A-Z]{2}[A-Z0-9]{10}$")
 LINK_ISIN_RE = re.compile(r"/([A-Z]{2}[A-Z0-9]{10})(?:-|$)", re.IGNORECASE)
 _ENRICH_REMAINING = ENRICH_TOTAL_MAX
 _ENRICH_LOCK = None
 _CACHE_LOCK = None
 _CACHE_LOADED = False
+_CACHE_STORE = None
+_CACHE_DIRTY = {}
+_FLUSH_HANDLE = None
+_REFRESH_QUEUE = None
+_REFRESH_TASK = None
+_REFRESHING = set()
 _REQUEST_COUNT = 0
 _CACHE_DATE = None
 _LIMIT_WARNED = False
+_KEY_WARNED = False
+_BATCH_DISABLED_UNTIL = 0.0
+_BATCH_SUSPECT = 0
+# Single-flight: pedidos FMP em curso por (namespace, chave) e quantos foram partilhados
+_INFLIGHT = {}
+_COALESCED = {"profile": 0, "isin": 0}
+_NEGATIVE_HITS = {"profile": 0, "isin": 0}
+
+class TokenBucket:
+    """
+    Rate limiter token bucket adaptativo. `rate` pedidos/s com rajadas até `burst`.
+    Um 429 corta a taxa para metade (mínimo `min_rate`) e bloqueia até ao Retry-After;
+    cada pedido bem-sucedido recupera `recovery` pedidos/s até à taxa nominal.
+    """
+    def __init__(self, rate, burst, min_rate=0.5, recovery=0.05):
+        self.max_rate = max(rate, 0.001)
+        self.rate = self.max_rate
+        self.burst = max(burst, 1.0)
+        self.min_rate = min(min_rate, self.max_rate)
+        self.recovery = recovery
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_rate_limited(self, retry_after=None):
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+FMP_RATE_LIMITER = TokenBucket(
+    FMP_RATE_PER_SEC, FMP_RATE_BURST, min_rate=FMP_RATE_MIN, recovery=FMP_RATE_RECOVERY
+)
+
+def _retry_after_seconds(resp):
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
 
 def _today_key():
     return datetime.now(timezone.utc).date().isoformat()
 
 def _ensure_cache_loaded():
-    global _CACHE_LOADED, _REQUEST_COUNT, _CACHE_DATE
+    global _CACHE_LOADED, _CACHE_STORE, _REQUEST_COUNT, _CACHE_DATE
     if _CACHE_LOADED:
         return
-    data = {}
+    _CACHE_STORE = get_cache_store()
     try:
-        if FMP_CACHE_PATH and os.path.exists(FMP_CACHE_PATH):
-            with open(FMP_CACHE_PATH, "r", encoding="utf-8") as f:
-                data = json.load(f)
-    except Exception:
-        data = {}
-
-    API_CACHE.update(data.get("api", {}))
-    ISIN_CACHE.update(data.get("isin", {}))
-
-    _CACHE_DATE = data.get("date") or _today_key()
-    _REQUEST_COUNT = int(data.get("count") or 0)
+        data = _CACHE_STORE.load(("api", "isin", "negative"))
+    except Exception as e:
+        print(f"[CACHE] Falha ao carregar cache: {e}")
+        data = {"meta": {}, "api": {}, "isin": {}, "negative": {}}
+
+    _load_timestamped(API_CACHE, "api", data.get("api", {}))
+    _load_timestamped(ISIN_CACHE, "isin", data.get("isin", {}), value_key="symbol")
+    _load_timestamped(NEGATIVE_CACHE, "negative", data.get("negative", {}))
+
+    meta = data.get("meta", {})
+    _CACHE_DATE = meta.get("date") or _today_key()
+    _REQUEST_COUNT = int(meta.get("count") or 0)
     if _CACHE_DATE != _today_key():
         _CACHE_DATE = _today_key()
         _REQUEST_COUNT = 0
     _CACHE_LOADED = True
 
-def _save_cache():
-    if not FMP_CACHE_PATH:
+def _load_timestamped(cache, namespace, entries, value_key=None):
+    """
+    Carrega entradas da cache por ordem de timestamp (mais antigas primeiro, para a
+    evicção LRU). Entradas antigas sem "_ts" ficam com idade desconhecida (_ts 0):
+    contam como expiradas e são revalidadas no primeiro uso (SWR) em vez de passarem
+    por frescas durante um TTL inteiro.
+    """
+    for key, entry in entries.items():
+        if value_key and not isinstance(entry, dict):
+            entry = {value_key: entry}
+        if not isinstance(entry, dict):
+            continue
+        if "_ts" not in entry:
+            entry = {**entry, "_ts": 0}
+            _mark_dirty(namespace, key)
+        cache[key] = entry
+    ordered = sorted(cache.items(), key=lambda item: item[1].get("_ts", 0))
+    cache.clear()
+    cache.update(ordered)
+    _evict_lru(cache, namespace)
+
+def _evict_lru(cache, namespace):
+    if FMP_CACHE_MAX_ENTRIES <= 0:
+        return
+    while len(cache) > FMP_CACHE_MAX_ENTRIES:
+        key, _ = cache.popitem(last=False)
+        _mark_dirty(namespace, key)
+
+def _cache_get(cache, key):
+    entry = cache.get(key)
+    if entry is not None:
+        cache.move_to_end(key)
+    return entry
+
+def _cache_put(cache, namespace, key, entry):
+    cache[key] = {**entry, "_ts": time.time()}
+    cache.move_to_end(key)
+    _mark_dirty(namespace, key)
+    _evict_lru(cache, namespace)
+
+def _entry_age(entry):
+    return time.time() - float(entry.get("_ts") or 0)
+
+def _profile_state(entry):
+    """fresh: tudo válido; stale: só sector/industry válidos; expired: nada válido."""
+    age = _entry_age(entry)
+    if age < FMP_TTL_FUNDAMENTALS:
+        return "fresh"
+    if age < FMP_TTL_PROFILE:
+        return "stale"
+    return "expired"
+
+def _public_profile(entry, drop_fundamentals=False):
+    profile = {field: entry.get(field) for field in PROFILE_FIELDS}
+    if drop_fundamentals:
+        for field in FUNDAMENTAL_FIELDS:
+            profile[field] = None
+    return profile
+
+def _mark_dirty(namespace, key=None):
+    """
+    Regista uma alteração e agenda um flush agrupado (write-behind): as escritas
+    dentro de FMP_CACHE_FLUSH_DELAY segundos vão para disco de uma só vez.
+    """
+    global _FLUSH_HANDLE
+    if namespace == "meta":
+        _CACHE_DIRTY["meta"] = True
+    else:
+        _CACHE_DIRTY.setdefault(namespace, set()).add(key)
+
+    pending = sum(len(keys) for ns, keys in _CACHE_DIRTY.items() if ns != "meta")
+    if pending >= FMP_CACHE_FLUSH_MAX:
+        flush_cache()
         return
-    os.makedirs(os.path.dirname(FMP_CACHE_PATH), exist_ok=True)
-    payload = {
-        "date": _CACHE_DATE,
-        "count": _REQUEST_COUNT,
+    if _FLUSH_HANDLE is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            flush_cache()
+            return
+        _FLUSH_HANDLE = loop.call_later(FMP_CACHE_FLUSH_DELAY, flush_cache)
+
+def flush_cache():
+    """Grava em disco as alterações pendentes da cache FMP."""
+    global _FLUSH_HANDLE
+    if _FLUSH_HANDLE is not None:
+        _FLUSH_HANDLE.cancel()
+        _FLUSH_HANDLE = None
+    if not _CACHE_DIRTY or _CACHE_STORE is None:
+        return
+    dirty = dict(_CACHE_DIRTY)
+    _CACHE_DIRTY.clear()
+    state = {
+        "meta": {"date": _CACHE_DATE, "count": _REQUEST_COUNT},
         "api": API_CACHE,
         "isin": ISIN_CACHE,
+        "negative": NEGATIVE_CACHE,
     }
-    with open(FMP_CACHE_PATH, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=True, indent=2, sort_keys=True)
+    try:
+        _CACHE_STORE.flush(state, dirty)
+    except Exception as e:
+        print(f"[CACHE] Falha ao gravar cache: {e}")
+        for namespace, keys in dirty.items():
+            if namespace == "meta":
+                _CACHE_DIRTY["meta"] = True
+            else:
+                _CACHE_DIRTY.setdefault(namespace, set()).update(keys)
+
+atexit.register(flush_cache)
 
 def _get_cache_lock():
     global _CACHE_LOCK
@@ -100,6 +299,7 @@ def _reset_daily_count_if_needed():
     if _CACHE_DATE != today:
         _CACHE_DATE = today
         _REQUEST_COUNT = 0
+        _mark_dirty("meta")
 
 def _warn_limit_once():
     global _LIMIT_WARNED
@@ -107,8 +307,26 @@ def _warn_limit_once():
         print("[API] Limite diario atingido. Enriquecimento suspenso ate amanha.")
         _LIMIT_WARNED = True
 
+def _publish_quota():
+    metrics.set_gauge("fmp_quota_used", _REQUEST_COUNT)
+    if FMP_DAILY_LIMIT > 0:
+        metrics.set_gauge("fmp_quota_remaining", max(0, FMP_DAILY_LIMIT - _REQUEST_COUNT))
+
+def _api_key_available():
+    """Sem FMP_API_KEY o processador corre na mesma, mas sem pedidos à FMP (só cache)."""
+    global _KEY_WARNED
+    if FMP_API_KEY:
+        return True
+    if not _KEY_WARNED:
+        print("[API] FMP_API_KEY não definida. Enriquecimento via FMP desativado.")
+        _KEY_WARNED = True
+    return False
+
 async def _reserve_request_slot():
+    if not _api_key_available():
+        return False
     if FMP_DAILY_LIMIT <= 0:
+        metrics.inc("fmp_requests_total")
         return True
     _ensure_cache_loaded()
     async with _get_cache_lock():
@@ -118,112 +336,499 @@ async def _reserve_request_slot():
             _warn_limit_once()
             return False
         _REQUEST_COUNT += 1
-        _save_cache()
+        _mark_dirty("meta")
+        metrics.inc("fmp_requests_total")
+        _publish_quota()
+        return True
+
+def _quota_available():
+    if FMP_DAILY_LIMIT <= 0:
         return True
+    _reset_daily_count_if_needed()
+    return _REQUEST_COUNT < FMP_DAILY_LIMIT
+
+def remaining_quota():
+    """Pedidos à FMP ainda disponíveis hoje (None se FMP_DAILY_LIMIT estiver desligado)."""
+    if not FMP_API_KEY:
+        return 0
+    if FMP_DAILY_LIMIT <= 0:
+        return None
+    _ensure_cache_loaded()
+    _reset_daily_count_if_needed()
+    _publish_quota()
+    return max(0, FMP_DAILY_LIMIT - _REQUEST_COUNT)
+
+def symbols_per_request():
+    """Símbolos cobertos por um pedido /profile (1 se os lotes estiverem desativados)."""
+    return max(1, FMP_BATCH_SYMBOLS) if _batching_enabled() else 1
 
 async def _update_api_cache(symbol, sentiment):
     _ensure_cache_loaded()
     async with _get_cache_lock():
-        API_CACHE[symbol] = sentiment
-        _save_cache()
+        _cache_put(API_CACHE, "api", symbol, sentiment)
+        _forget_failure("profile", symbol)
 
 async def _update_isin_cache(isin, symbol):
     _ensure_cache_loaded()
     async with _get_cache_lock():
-        ISIN_CACHE[isin] = symbol
-        _save_cache()
+        _cache_put(ISIN_CACHE, "isin", isin, {"symbol": symbol})
+        _forget_failure("isin", isin)
 
-async def get_financial_sentiment(session, ticker: str, retries: int = 3, delay: float = 0.5):
+def _negative_valid(entry):
+    ttl = FMP_TTL_NEGATIVE_FAILED if entry.get("reason") == NEGATIVE_FAILED else FMP_TTL_NEGATIVE
+    return _entry_age(entry) < ttl
+
+def _negative_reason(kind, key, count=True):
     """
-    Pega dados financeiros de um ticker usando FMP API.
-    Trata erros 403, 429 e outros de forma segura.
+    Motivo (not_found / forbidden / failed) de uma entrada negativa ainda válida para
+    `kind` (profile | isin), ou None. Deve ser consultado antes de _reserve_request_slot.
     """
     _ensure_cache_loaded()
-    if not ticker or pd.isna(ticker):
-        return {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+    entry = NEGATIVE_CACHE.get(f"{kind}:{key}")
+    if entry is None or not _negative_valid(entry):
+        return None
+    if count:
+        _NEGATIVE_HITS[kind] += 1
+        metrics.inc("fmp_negative_hits_total", kind=kind)
+    return entry.get("reason")
+
+async def _remember_failure(kind, key, reason):
+    _ensure_cache_loaded()
+    async with _get_cache_lock():
+        _cache_put(NEGATIVE_CACHE, "negative", f"{kind}:{key}", {"reason": reason})
+
+def _forget_failure(kind, key):
+    if NEGATIVE_CACHE.pop(f"{kind}:{key}", None) is not None:
+        _mark_dirty("negative", f"{kind}:{key}")
+
+def cache_stats():
+    """Entradas em cache por namespace, negativas válidas por motivo e hits negativos."""
+    _ensure_cache_loaded()
+    negative = {}
+    for entry in NEGATIVE_CACHE.values():
+        if _negative_valid(entry):
+            reason = entry.get("reason") or NEGATIVE_FAILED
+            negative[reason] = negative.get(reason, 0) + 1
+    return {
+        "profile": len(API_CACHE),
+        "isin": len(ISIN_CACHE),
+        "isin_index": len(get_isin_index()),
+        "negative": negative,
+        "negative_hits": dict(_NEGATIVE_HITS),
+        "requests_today": _REQUEST_COUNT,
+    }
 
+def _join_inflight(namespace, key):
+    """
+    Single-flight: devolve o future de um pedido igual já em curso (e conta-o como
+    coalescido), ou None se o chamador passa a ser o dono do pedido e tem de o
+    resolver com _settle_inflight.
+    """
+    future = _INFLIGHT.get((namespace, key))
+    if future is not None:
+        _COALESCED[namespace] += 1
+        metrics.inc("fmp_coalesced_total", namespace=namespace)
+        return future
+    _INFLIGHT[(namespace, key)] = asyncio.get_running_loop().create_future()
+    return None
+
+def _settle_inflight(namespace, key, result):
+    future = _INFLIGHT.pop((namespace, key), None)
+    if future is not None and not future.done():
+        future.set_result(result)
+
+def coalesce_stats(reset=False):
+    """Pedidos FMP evitados por single-flight, por namespace (profile / isin)."""
+    stats = dict(_COALESCED)
+    if reset:
+        for namespace in _COALESCED:
+            _COALESCED[namespace] = 0
+    return stats
+
+def _schedule_refresh(symbol):
+    """
+    Stale-while-revalidate: agenda a atualização de uma entrada expirada em
+    background, só enquanto houver quota diária disponível.
+    """
+    global _REFRESH_QUEUE, _REFRESH_TASK
+    if symbol in _REFRESHING or not _quota_available():
+        return
+    if _REFRESH_QUEUE is None:
+        _REFRESH_QUEUE = asyncio.Queue()
+    _REFRESHING.add(symbol)
+    _REFRESH_QUEUE.put_nowait(symbol)
+    if _REFRESH_TASK is None or _REFRESH_TASK.done():
+        _REFRESH_TASK = asyncio.create_task(_refresh_worker())
+
+async def _refresh_worker(idle_timeout=30):
+    async with http_session() as session:
+        while True:
+            try:
+                symbol = await asyncio.wait_for(_REFRESH_QUEUE.get(), timeout=idle_timeout)
+            except asyncio.TimeoutError:
+                return
+            try:
+                if _quota_available():
+                    await _fetch_profile(session, symbol)
+            finally:
+                _REFRESHING.discard(symbol)
+
+async def _resolve_symbol(session, ticker):
+    """Normaliza o ticker (resolvendo ISINs se ativo). Devolve None se não for consultável."""
+    if not ticker or pd.isna(ticker):
+        return None
     symbol = _normalize_symbol(str(ticker))
     if ISIN_RE.match(symbol):
         if not FMP_RESOLVE_ISIN:
-            return {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+            return None
         symbol = await resolve_isin_to_symbol(session, symbol)
+    return symbol or None
+
+def _cached_profile(symbol, refresh=True):
+    """
+    Consulta a cache respeitando os TTLs. Devolve (perfil, fallback): `perfil` quando a
+    cache pode responder já (fresca, ou velha com FMP_CACHE_SWR); `fallback` com
+    sector/industry de uma entrada velha, para usar se a atualização falhar.
+    Com refresh=False as entradas velhas não são agendadas para atualização.
+    """
+    cached = _cache_get(API_CACHE, symbol)
+    if cached is None:
+        return None, None
+    state = _profile_state(cached)
+    if state == "fresh":
+        return _public_profile(cached), None
+    if FMP_CACHE_SWR:
+        if refresh:
+            _schedule_refresh(symbol)
+        return _public_profile(cached), None
+    if state == "stale":
+        return None, _public_profile(cached, drop_fundamentals=True)
+    return None, None
+
+def cached_sentiment(symbol):
+    """Resposta só a partir da cache, sem pedidos à FMP nem atualizações em background."""
+    _ensure_cache_loaded()
+    empty = {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+    if ISIN_RE.match(symbol):
+        mapping = ISIN_CACHE.get(symbol)
+        symbol = mapping.get("symbol") if mapping else get_isin_index().get(symbol)
         if not symbol:
-            return {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+            return empty
+    profile, fallback = _cached_profile(symbol, refresh=False)
+    return profile or fallback or empty
+
+def symbol_cache_status(symbol):
+    """
+    Estado de um símbolo na cache, para o planeamento: state (fresh / stale / expired /
+    missing), idade em segundos, MarketCap conhecido, se um ISIN ainda precisa de
+    ser resolvido (um pedido extra) e o motivo de uma entrada negativa válida.
+    """
+    _ensure_cache_loaded()
+    isin_lookup = False
+    negative = None
+    if ISIN_RE.match(symbol):
+        mapping = ISIN_CACHE.get(symbol)
+        indexed = get_isin_index().get(symbol)
+        if indexed:
+            mapping = {"symbol": indexed, "_ts": time.time()}
+        isin_lookup = mapping is None or _entry_age(mapping) >= FMP_TTL_ISIN
+        if mapping is None:
+            negative = _negative_reason("isin", symbol, count=False)
+        symbol = mapping.get("symbol") if mapping else None
+    if symbol and negative is None:
+        negative = _negative_reason("profile", symbol, count=False)
+    entry = API_CACHE.get(symbol) if symbol else None
+    if entry is None:
+        return {
+            "state": "missing", "age": None, "market_cap": None,
+            "isin_lookup": isin_lookup, "negative": negative,
+        }
+    return {
+        "state": _profile_state(entry),
+        "age": _entry_age(entry),
+        "market_cap": entry.get("MarketCap"),
+        "isin_lookup": isin_lookup,
+        "negative": negative,
+    }
+
+def _sentiment_from_profile(profile):
+    return {
+        "MarketCap": profile.get("mktCap"),
+        "Sector": profile.get("sector"),
+        "Industry": profile.get("industry"),
+        "PERatio": profile.get("trailingPE")
+    }
+
+async def get_financial_sentiment(session, ticker: str, retries: int = 3, delay: float = 0.5):
+    """
+    Pega dados financeiros de um ticker usando FMP API.
+    Trata erros 403, 429 e outros de forma segura.
+    Entradas em cache seguem FMP_TTL_FUNDAMENTALS / FMP_TTL_PROFILE; com FMP_CACHE_SWR
+    as entradas velhas são devolvidas logo e atualizadas em background.
+    """
+    _ensure_cache_loaded()
+    symbol = await _resolve_symbol(session, ticker)
     if not symbol:
         return {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
 
-    # Usa cache se já consultado
-    if symbol in API_CACHE:
-        return API_CACHE[symbol]
+    # Usa cache se já consultado e ainda válido
+    profile, fallback = _cached_profile(symbol)
+    if profile is not None:
+        metrics.inc("fmp_cache_hits_total")
+        return profile
+    metrics.inc("fmp_cache_misses_total")
+    if _negative_reason("profile", symbol):
+        return fallback or {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+
+    future = _join_inflight("profile", symbol)
+    if future is not None:
+        sentiment = await asyncio.shield(future)
+    else:
+        sentiment = None
+        try:
+            sentiment = await _fetch_profile(session, symbol, retries=retries, delay=delay)
+        finally:
+            _settle_inflight("profile", symbol, sentiment)
+    if sentiment is not None:
+        return sentiment
+    return fallback or {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+
+async def get_financial_sentiments(session, tickers, retries: int = 3, delay: float = 0.5, use_cache=True):
+    """
+    Versão em lote de get_financial_sentiment: os símbolos que não estão em cache são
+    pedidos em grupos de FMP_BATCH_SYMBOLS por chamada /profile (um slot da quota por
+    grupo). Símbolos já pedidos por outro chunk aguardam esse pedido (single-flight).
+    Com use_cache=False todos são pedidos (a cache só serve de fallback).
+    Devolve a lista de resultados pela ordem de `tickers`.
+    """
+    _ensure_cache_loaded()
+    symbols = await asyncio.gather(*[_resolve_symbol(session, ticker) for ticker in tickers])
+    results = {}
+    fallbacks = {}
+    missing = []
+    for symbol in symbols:
+        if not symbol or symbol in results or symbol in fallbacks:
+            continue
+        profile, fallback = _cached_profile(symbol, refresh=use_cache)
+        if use_cache and profile is not None:
+            results[symbol] = profile
+            metrics.inc("fmp_cache_hits_total")
+        else:
+            fallbacks[symbol] = fallback if profile is None else profile
+            metrics.inc("fmp_cache_misses_total")
+            if not _negative_reason("profile", symbol):
+                missing.append(symbol)
+
+    owned = []
+    joined = {}
+    for symbol in missing:
+        future = _join_inflight("profile", symbol)
+        if future is not None:
+            joined[symbol] = future
+        else:
+            owned.append(symbol)
+
+    # Resolve primeiro os próprios pedidos, para nunca esperar por quem espera por nós
+    size = max(1, FMP_BATCH_SYMBOLS)
+    groups = [owned[i:i + size] for i in range(0, len(owned), size)]
+    try:
+        fetched = await asyncio.gather(*[
+            _fetch_profiles(session, group, retries=retries, delay=delay) for group in groups
+        ])
+        for group_result in fetched:
+            results.update(group_result)
+    finally:
+        for symbol in owned:
+            _settle_inflight("profile", symbol, results.get(symbol))
+
+    for symbol, future in joined.items():
+        sentiment = await asyncio.shield(future)
+        if sentiment is not None:
+            results[symbol] = sentiment
+
+    empty = {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+    return [
+        results.get(symbol) or fallbacks.get(symbol) or dict(empty) if symbol else dict(empty)
+        for symbol in symbols
+    ]
+
+def _batching_enabled():
+    """Lotes ativos, ou desativados há mais de FMP_BATCH_REPROBE segundos (volta a testar)."""
+    global _BATCH_DISABLED_UNTIL
+    if not _BATCH_DISABLED_UNTIL:
+        return True
+    if time.monotonic() < _BATCH_DISABLED_UNTIL:
+        return False
+    print("[API] A testar de novo os pedidos em lote.")
+    _BATCH_DISABLED_UNTIL = 0.0
+    return True
+
+def _disable_batching(reason):
+    global _BATCH_DISABLED_UNTIL, _BATCH_SUSPECT
+    if not _BATCH_DISABLED_UNTIL:
+        print(f"[API] Pedidos em lote desativados por {FMP_BATCH_REPROBE:.0f}s: {reason}")
+    _BATCH_DISABLED_UNTIL = time.monotonic() + FMP_BATCH_REPROBE
+    _BATCH_SUSPECT = 0
+
+def _note_batch_result(suspect):
+    """
+    Um lote com no máximo um perfil é ambíguo (plano sem lotes ou símbolos
+    desconhecidos): só FMP_BATCH_SUSPECT_LIMIT lotes assim seguidos desativam os lotes.
+    """
+    global _BATCH_SUSPECT
+    if not suspect:
+        _BATCH_SUSPECT = 0
+        return
+    _BATCH_SUSPECT += 1
+    if _BATCH_SUSPECT >= FMP_BATCH_SUSPECT_LIMIT:
+        _disable_batching(f"{_BATCH_SUSPECT} lotes seguidos com no máximo um perfil")
+
+async def _fetch_profiles(session, symbols, retries: int = 3, delay: float = 0.5):
+    """
+    Pede vários perfis numa só chamada (/profile?symbol=A,B,C) e guarda cada símbolo
+    na cache. Se o lote falhar, vier suspeito (no máximo um perfil) ou os lotes
+    estiverem desativados, recorre a pedidos individuais para os símbolos em falta.
+    Devolve {símbolo: sentiment} só com os obtidos.
+    """
+    if len(symbols) == 1 or not _batching_enabled():
+        fetched = await asyncio.gather(*[
+            _fetch_profile(session, symbol, retries=retries, delay=delay) for symbol in symbols
+        ])
+        return {symbol: sentiment for symbol, sentiment in zip(symbols, fetched) if sentiment}
+
+    url = f"{FMP_API_BASE}/profile?symbol={','.join(symbols)}&apikey={FMP_API_KEY}"
+    results = {}
+    suspect = False
+    for attempt in range(1, retries + 1):
+        try:
+            if not await _reserve_request_slot():
+                return results
+            await FMP_RATE_LIMITER.acquire()
+            async with session.get(url, timeout=20, ssl=SSL_CONTEXT) as resp:
+                if resp.status == 429:
+                    print(f"[API] Erro 429 (rate-limit) no lote de {len(symbols)} símbolos, tentativa {attempt}")
+                    metrics.inc("fmp_rate_limited_total")
+                    FMP_RATE_LIMITER.on_rate_limited(_retry_after_seconds(resp))
+                    continue
+                if resp.status == 200:
+                    FMP_RATE_LIMITER.on_success()
+                    data = await resp.json()
+                    profiles = {
+                        str(item.get("symbol", "")).upper(): item
+                        for item in (data if isinstance(data, list) else [])
+                    }
+                    # Possível plano sem lotes (símbolos extra ignorados): confirma-se
+                    # com pedidos individuais, que também marcam os desconhecidos
+                    suspect = len(symbols) > 2 and len(profiles) <= 1
+                    _note_batch_result(suspect)
+                    for symbol in symbols:
+                        profile = profiles.get(symbol.upper())
+                        if profile:
+                            sentiment = _sentiment_from_profile(profile)
+                            await _update_api_cache(symbol, sentiment)
+                            results[symbol] = sentiment
+                    if results and not suspect:
+                        # Lote válido: os símbolos em falta não existem na FMP
+                        for symbol in symbols:
+                            if symbol not in results:
+                                await _remember_failure("profile", symbol, NEGATIVE_NOT_FOUND)
+                    break
+                if resp.status in (400, 402, 403):
+                    _disable_batching(f"HTTP {resp.status}")
+                    break
+                print(f"[API] Erro {resp.status} no lote de {len(symbols)} símbolos, tentativa {attempt}")
+                await asyncio.sleep(delay * attempt)
+        except asyncio.TimeoutError:
+            print(f"[API] Timeout no lote de {len(symbols)} símbolos, tentativa {attempt}")
+            await asyncio.sleep(delay * attempt)
+        except Exception as e:
+            print(f"[API] Exceção no lote de {len(symbols)} símbolos: {e}, tentativa {attempt}")
+            await asyncio.sleep(delay * attempt)
+
+    # Fallback para pedidos individuais dos símbolos que ficaram sem resposta
+    remaining = [symbol for symbol in symbols if symbol not in results]
+    if remaining and (suspect or len(results) == 0 or not _batching_enabled()):
+        fetched = await asyncio.gather(*[
+            _fetch_profile(session, symbol, retries=retries, delay=delay) for symbol in remaining
+        ])
+        results.update({symbol: sentiment for symbol, sentiment in zip(remaining, fetched) if sentiment})
+    return results
 
+async def _fetch_profile(session, symbol, retries: int = 3, delay: float = 0.5):
+    """
+    Pede o perfil de um símbolo à FMP e atualiza a cache. Devolve None em caso de falha.
+    Como em _lookup_isin, um 429 nunca fica na cache negativa: só timeouts e erros na
+    última tentativa contam como "failed".
+    """
+    if _negative_reason("profile", symbol):
+        return None
     url = f"{FMP_API_BASE}/profile?symbol={symbol}&apikey={FMP_API_KEY}"
 
+    failed = False
     for attempt in range(1, retries + 1):
         try:
             if not await _reserve_request_slot():
-                return {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+                break
+            await FMP_RATE_LIMITER.acquire()
             async with session.get(url, timeout=10, ssl=SSL_CONTEXT) as resp:
                     if resp.status == 200:
+                        FMP_RATE_LIMITER.on_success()
                         data = await resp.json()
                         if not data:
-                            raise ValueError("Resposta vazia da API")
-
-                        profile = data[0]
-                        sentiment = {
-                            "MarketCap": profile.get("mktCap"),
-                            "Sector": profile.get("sector"),
-                            "Industry": profile.get("industry"),
-                            "PERatio": profile.get("trailingPE")
-                        }
+                            # Símbolo desconhecido (ex.: deslistado)
+                            await _remember_failure("profile", symbol, NEGATIVE_NOT_FOUND)
+                            return None
+
+                        sentiment = _sentiment_from_profile(data[0])
                         await _update_api_cache(symbol, sentiment)
                         return sentiment
 
                     elif resp.status == 403:
                         # Key inválida ou endpoint proibido
                         print(f"[API] Erro 403 para {symbol}: API key inválida ou sem permissão")
-                        return {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+                        await _remember_failure("profile", symbol, NEGATIVE_FORBIDDEN)
+                        return None
 
                     elif resp.status == 429:
-                        # Rate-limit, espera antes de tentar de novo
+                        # Rate-limit: o limiter abranda e respeita o Retry-After
                         print(f"[API] Erro 429 (rate-limit) para {symbol}, tentativa {attempt}")
-                        await asyncio.sleep(delay * attempt)
+                        metrics.inc("fmp_rate_limited_total")
+                        FMP_RATE_LIMITER.on_rate_limited(_retry_after_seconds(resp))
+                        failed = False
                         continue
 
                     else:
                         print(f"[API] Erro {resp.status} para {symbol}, tentativa {attempt}")
+                        failed = True
                         await asyncio.sleep(delay * attempt)
                         continue
 
         except asyncio.TimeoutError:
             print(f"[API] Timeout para {symbol}, tentativa {attempt}")
+            failed = True
             await asyncio.sleep(delay * attempt)
         except Exception as e:
             print(f"[API] Exceção para {symbol}: {e}, tentativa {attempt}")
+            failed = True
             await asyncio.sleep(delay * attempt)
 
-    # Se falhar todas as tentativas
-    return {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+    # Se a última tentativa falhou (um 429 no fim não conta)
+    if failed:
+        await _remember_failure("profile", symbol, NEGATIVE_FAILED)
+    return None
 
 
-async def enrich_chunk(chunk: pd.DataFrame, batch_size: int = 20, batch_delay: float = 0.05):
+def chunk_symbols(chunk: pd.DataFrame, max_tickers=None):
     """
-    Enriquecimento assíncrono de um DataFrame de tickers.
-    Processa em batches para evitar rate-limit.
+    Símbolos consultáveis de um chunk mapeado, como lista de (posição, símbolo).
+    Com FMP_RESOLVE_ISIN, tickers inválidos são substituídos pelo ISIN do Link.
     """
-    results = [
-        {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
-        for _ in range(len(chunk))
-    ]
-
-    tickers = chunk["Ticker"].tolist()
+    tickers = chunk["Ticker"].tolist() if "Ticker" in chunk.columns else [None] * len(chunk)
     links = chunk["Link"].tolist() if "Link" in chunk.columns else [None] * len(chunk)
-    batch_size = int(os.getenv("ENRICH_BATCH_SIZE", str(batch_size)))
-    batch_delay = float(os.getenv("ENRICH_BATCH_DELAY", str(batch_delay)))
-    max_tickers = int(os.getenv("ENRICH_MAX_TICKERS", str(ENRICH_MAX_TICKERS)))
 
     eligible = []
     for idx, ticker in enumerate(tickers):
-        if len(eligible) >= max_tickers:
+        if max_tickers is not None and len(eligible) >= max_tickers:
             continue
         symbol = str(ticker).strip().upper() if ticker and not pd.isna(ticker) else ""
         symbol = _normalize_symbol(symbol) if symbol else ""
@@ -238,46 +843,125 @@ async def enrich_chunk(chunk: pd.DataFrame, batch_size: int = 20, batch_delay: f
         if ISIN_RE.match(symbol) and not FMP_RESOLVE_ISIN:
             continue
         eligible.append((idx, symbol))
+    return eligible
+
+async def enrich_chunk(chunk: pd.DataFrame, batch_size: int = 20, batch_delay: float = 0.05, plan=None):
+    """
+    Enriquecimento assíncrono de um DataFrame de tickers.
+    Processa em batches de batch_size pedidos; o ritmo é imposto pelo FMP_RATE_LIMITER
+    (batch_delay mantém-se na assinatura por compatibilidade com os hints).
+    Com `plan` (EnrichmentPlan do ficheiro) os símbolos do chunk passam pelo plano,
+    que decide quais vão à FMP; ENRICH_MAX_TICKERS deixa de se aplicar.
+    """
+    results = [
+        {"MarketCap": None, "Sector": None, "Industry": None, "PERatio": None}
+        for _ in range(len(chunk))
+    ]
+
+    batch_size = int(os.getenv("ENRICH_BATCH_SIZE", str(batch_size)))
+    max_tickers = int(os.getenv("ENRICH_MAX_TICKERS", str(ENRICH_MAX_TICKERS)))
+    eligible = chunk_symbols(chunk, max_tickers=None if plan is not None else max_tickers)
 
     symbol_to_indices = {}
     for idx, symbol in eligible:
         symbol_to_indices.setdefault(symbol, []).append(idx)
 
-    reserved = await _reserve_slots([(0, symbol) for symbol in symbol_to_indices.keys()])
-    reserved_symbols = [symbol for _, symbol in reserved]
+    if plan is not None:
+        markets = chunk["Mercado"].tolist() if "Mercado" in chunk.columns else [None] * len(chunk)
+        symbol_markets = {symbol: markets[indices[0]] for symbol, indices in symbol_to_indices.items()}
+        for symbol, payload in (await plan.enrich(list(symbol_to_indices), symbol_markets)).items():
+            for idx in symbol_to_indices.get(symbol, []):
+                results[idx] = payload
+        return pd.DataFrame(results)
+
+    reserved_symbols = await reserve_enrichment_slots(list(symbol_to_indices))
 
-    async with aiohttp.ClientSession() as session:
-        n_batches = (len(reserved_symbols) + batch_size - 1) // batch_size
+    # Cada grupo faz até batch_size pedidos, cada um com até FMP_BATCH_SYMBOLS símbolos
+    group_size = batch_size * max(1, FMP_BATCH_SYMBOLS)
+    async with http_session() as session:
+        n_batches = (len(reserved_symbols) + group_size - 1) // group_size
         for i in range(n_batches):
-            batch = reserved_symbols[i * batch_size:(i + 1) * batch_size]
-            tasks = [get_financial_sentiment(session, symbol) for symbol in batch]
-            batch_results = await asyncio.gather(*tasks)
+            batch = reserved_symbols[i * group_size:(i + 1) * group_size]
+            batch_results = await get_financial_sentiments(session, batch)
             for symbol, payload in zip(batch, batch_results):
                 for idx in symbol_to_indices.get(symbol, []):
                     results[idx] = payload
-            await asyncio.sleep(batch_delay)  # evita rate-limit
 
     return pd.DataFrame(results)
 
 async def resolve_isin_to_symbol(session, isin: str):
+    """
+    ISIN -> símbolo: cache (dentro de FMP_TTL_ISIN), depois o índice local (isin_index)
+    e só em último caso um pedido /search-symbol.
+    """
     _ensure_cache_loaded()
-    if isin in ISIN_CACHE:
-        return ISIN_CACHE[isin]
-    url = f"{FMP_API_BASE}/search-symbol?query={isin}&apikey={FMP_API_KEY}"
+    cached = _cache_get(ISIN_CACHE, isin)
+    if cached is not None and _entry_age(cached) < FMP_TTL_ISIN:
+        return cached.get("symbol")
+    indexed = get_isin_index().get(isin)
+    if indexed:
+        return indexed
+    # Mapeamento expirado continua a servir se a atualização falhar
+    fallback = cached.get("symbol") if cached is not None else None
+    if _negative_reason("isin", isin):
+        return fallback
+    future = _join_inflight("isin", isin)
+    if future is not None:
+        return await asyncio.shield(future) or fallback
+    symbol = None
     try:
-        if not await _reserve_request_slot():
-            return None
-        async with session.get(url, timeout=10, ssl=SSL_CONTEXT) as resp:
-            if resp.status != 200:
-                return None
-            data = await resp.json()
-            if isinstance(data, list) and data:
-                symbol = data[0].get("symbol")
-                if symbol:
-                    await _update_isin_cache(isin, symbol)
-                    return symbol
-    except Exception:
-        return None
+        symbol = await _lookup_isin(session, isin)
+    finally:
+        _settle_inflight("isin", isin, symbol)
+    return symbol or fallback
+
+async def _lookup_isin(session, isin, retries: int = 3, delay: float = 0.5):
+    """
+    Pedido /search-symbol com o mesmo ciclo de tentativas de _fetch_profile. Um 429
+    nunca fica na cache negativa (o limiter abranda e tenta de novo); timeouts e erros
+    só ficam como "failed" se a última tentativa também falhar.
+    """
+    url = f"{FMP_API_BASE}/search-symbol?query={isin}&apikey={FMP_API_KEY}"
+    failed = False
+    for attempt in range(1, retries + 1):
+        try:
+            if not await _reserve_request_slot():
+                break
+            await FMP_RATE_LIMITER.acquire()
+            async with session.get(url, timeout=10, ssl=SSL_CONTEXT) as resp:
+                if resp.status == 200:
+                    FMP_RATE_LIMITER.on_success()
+                    data = await resp.json()
+                    symbol = data[0].get("symbol") if isinstance(data, list) and data else None
+                    if symbol:
+                        await _update_isin_cache(isin, symbol)
+                        return symbol
+                    await _remember_failure("isin", isin, NEGATIVE_NOT_FOUND)
+                    return None
+                if resp.status == 403:
+                    print(f"[API] Erro 403 para o ISIN {isin}: API key inválida ou sem permissão")
+                    await _remember_failure("isin", isin, NEGATIVE_FORBIDDEN)
+                    return None
+                if resp.status == 429:
+                    print(f"[API] Erro 429 (rate-limit) para o ISIN {isin}, tentativa {attempt}")
+                    metrics.inc("fmp_rate_limited_total")
+                    FMP_RATE_LIMITER.on_rate_limited(_retry_after_seconds(resp))
+                    failed = False
+                    continue
+                print(f"[API] Erro {resp.status} para o ISIN {isin}, tentativa {attempt}")
+                failed = True
+                await asyncio.sleep(delay * attempt)
+        except asyncio.TimeoutError:
+            print(f"[API] Timeout para o ISIN {isin}, tentativa {attempt}")
+            failed = True
+            await asyncio.sleep(delay * attempt)
+        except Exception as e:
+            print(f"[API] Exceção para o ISIN {isin}: {e}, tentativa {attempt}")
+            failed = True
+            await asyncio.sleep(delay * attempt)
+
+    if failed:
+        await _remember_failure("isin", isin, NEGATIVE_FAILED)
     return None
 
 def _normalize_symbol(value: str) -> str:
@@ -293,6 +977,13 @@ def _extract_isin_from_link(value: str):
         return None
     return match.group(1).upper()
 
+async def reserve_enrichment_slots(symbols):
+    """
+    Reserva símbolos no limite ENRICH_TOTAL_MAX (partilhado pelo processo) e devolve
+    os que couberam, pela ordem recebida. Sem limite devolve todos.
+    """
+    return [symbol for _, symbol in await _reserve_slots([(0, symbol) for symbol in symbols])]
+
 async def _reserve_slots(eligible):
     if ENRICH_TOTAL_MAX <= 0:
         return eligible
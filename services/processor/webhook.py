@@ -1,31 +1,154 @@
 import asyncio
 import os
-from flask import Flask, request
-from config import PENDING_REQUESTS
+from aiohttp import web
+from pending_store import get_pending_store
 from bucket import delete_from_bucket_async
+from metrics import render_prometheus
+from ingest import INGEST_TOKEN, INGEST_TRIGGER
 
-app = Flask(__name__)
+WEBHOOK_CLEANUP_WORKERS = int(os.getenv("WEBHOOK_CLEANUP_WORKERS", "2"))
+WEBHOOK_CLEANUP_TIMEOUT = float(os.getenv("WEBHOOK_CLEANUP_TIMEOUT", "30"))
 
-@app.route("/webhook", methods=["POST"])
-def webhook_handler():
-    data = request.json
+class CleanupQueue:
+    """
+    Tarefas em background dos callbacks (remover o CSV local, apagar o objeto do
+    bucket): o callback responde logo e as tarefas correm no mesmo event loop.
+    """
+    def __init__(self, workers=WEBHOOK_CLEANUP_WORKERS):
+        self.workers = max(1, workers)
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, func, *args, **kwargs):
+        self._queue.put_nowait((func, args, kwargs))
+
+    async def _worker(self):
+        while True:
+            func, args, kwargs = await self._queue.get()
+            try:
+                await func(*args, **kwargs)
+            except Exception as e:
+                print(f"[WEBHOOK] Erro na tarefa de limpeza {func.__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def close(self, timeout=WEBHOOK_CLEANUP_TIMEOUT):
+        """Espera (até `timeout`) pelas tarefas pendentes e pára os workers."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[WEBHOOK] {self._queue.qsize()} tarefas de limpeza por concluir.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+CLEANUP_QUEUE = CleanupQueue()
+
+async def remove_local_file(path):
+    if path and await asyncio.to_thread(os.path.exists, path):
+        await asyncio.to_thread(os.remove, path)
+        print(f"[WEBHOOK] CSV removido: {path}")
+
+def _bad_payload():
+    return web.json_response({"message": "Payload JSON tem de ser um objeto"}, status=400)
+
+async def webhook_handler(request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        return _bad_payload()
     id_req = data.get("ID_Requisicao")
     status = data.get("Status")
     doc_id = data.get("Doc_ID")
     print(f"[WEBHOOK] Requisição {id_req} status={status}, doc_id={doc_id}")
 
-    if id_req in PENDING_REQUESTS:
-        info = PENDING_REQUESTS.pop(id_req)
-        if status == "OK":
-            csv_path = info.get("csv")
-            if csv_path and os.path.exists(csv_path):
-                os.remove(csv_path)
-                print(f"[WEBHOOK] CSV removido: {csv_path}")
-            bucket_file = info.get("bucket")
-            if bucket_file:
-                asyncio.run(delete_from_bucket_async(file_name=bucket_file))
-    return {"message": "OK"}, 200
-
-def start_flask_webhook(port=5000):
-    import threading
-    threading.Thread(target=lambda: app.run(host="0.0.0.0", port=port), daemon=True).start()
+    store = get_pending_store()
+    if status == "OK":
+        info = store.acknowledge(id_req, doc_id)
+        if info is not None:
+            if info.get("csv"):
+                CLEANUP_QUEUE.submit(remove_local_file, info["csv"])
+            if info.get("bucket"):
+                CLEANUP_QUEUE.submit(
+                    delete_from_bucket_async, file_name=info["bucket"], etag=info.get("bucket_etag")
+                )
+    else:
+        info = store.fail(id_req, status)
+    if info is None:
+        print(f"[WEBHOOK] Requisição {id_req} desconhecida ou já fechada, ignorando.")
+    return web.json_response({"message": "OK"})
+
+async def ingest_handler(request):
+    """
+    Aviso de objeto novo no bucket: {"bucket", "path", "sha256"} (crawler) ou o
+    payload do webhook do Supabase Storage ({"record": {"bucket_id", "name"}}).
+    """
+    if INGEST_TOKEN and request.headers.get("X-Ingest-Token") != INGEST_TOKEN:
+        return web.json_response({"message": "Unauthorized"}, status=401)
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        return _bad_payload()
+    record = data.get("record")
+    if not isinstance(record, dict):
+        record = {}
+    bucket = data.get("bucket") or record.get("bucket_id")
+    path = data.get("path") or data.get("name") or record.get("name")
+    digest = data.get("sha256") or data.get("digest")
+    print(f"[WEBHOOK] Ingestão notificada: bucket={bucket} path={path} sha256={digest}")
+
+    if not INGEST_TRIGGER.notify(path=path, digest=digest, bucket=bucket):
+        return web.json_response({"message": "Ignored"}, status=202)
+    return web.json_response({"message": "OK"}, status=202)
+
+async def metrics_handler(request):
+    return web.Response(
+        body=render_prometheus().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+async def _start_cleanup(app):
+    CLEANUP_QUEUE.start()
+
+async def _stop_cleanup(app):
+    await CLEANUP_QUEUE.close()
+
+def create_app():
+    app = web.Application()
+    app.router.add_post("/webhook", webhook_handler)
+    app.router.add_post("/ingest", ingest_handler)
+    app.router.add_get("/metrics", metrics_handler)
+    app.on_startup.append(_start_cleanup)
+    app.on_cleanup.append(_stop_cleanup)
+    return app
+
+async def start_webhook_server(port=5000):
+    """
+    Servidor dos webhooks (aiohttp) no event loop do processador. Devolve o runner,
+    a fechar com stop_webhook_server.
+    """
+    runner = web.AppRunner(create_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+    except BaseException:
+        # Porta ocupada, por exemplo: não deixa o runner (e a fila de limpeza) aberto
+        await runner.cleanup()
+        raise
+    print(f"[WEBHOOK] A escutar na porta {port} (/webhook, /ingest, /metrics)")
+    return runner
+
+async def stop_webhook_server(runner):
+    if runner is not None:
+        await runner.cleanup()
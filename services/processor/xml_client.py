@@ -1,25 +1,164 @@
+import os
 import uuid
-import ssl
+import zlib
+import asyncio
 import aiohttp
+from config import WEBHOOK_XML_URL, JAVA_WEBHOOK_URL, FILE_NAME
+from rpc_client import fetch_mapper_version
+from http_client import SSL_CONTEXT, http_session
+from output_writer import content_type_for
+from pending_store import get_pending_store
+from outbox import get_outbox
+import metrics
+
 try:
-    import certifi
+    import zstandard
 except ImportError:
-    certifi = None
-from config import WEBHOOK_XML_URL, JAVA_WEBHOOK_URL, PENDING_REQUESTS, FILE_NAME
-from rpc_client import fetch_mapper_version
+    zstandard = None
 
-async def send_to_xml_service_async(csv_path):
-    id_req = str(uuid.uuid4())
+# gzip | zstd | identity: corpo em stream com Content-Encoding e metadados em headers;
+# multipart: formulário original (XML Service antigo)
+XML_UPLOAD_ENCODING = os.getenv("XML_UPLOAD_ENCODING", "gzip").lower()
+XML_UPLOAD_LEVEL = int(os.getenv("XML_UPLOAD_LEVEL", "6"))
+XML_UPLOAD_BLOCK_SIZE = int(os.getenv("XML_UPLOAD_BLOCK_SIZE", str(256 * 1024)))
+# XML Service sem zstd (415): os envios seguintes vão em gzip
+_ZSTD_REJECTED = False
+
+class XmlServiceError(RuntimeError):
+    """Resposta de erro do XML Service; `status` é o código HTTP (o outbox decide por ele)."""
+    def __init__(self, status, text):
+        super().__init__(f"[ERROR] XML Service: {text}")
+        self.status = status
+
+async def send_to_xml_service_async(csv_path, id_req=None, bucket_etag=None):
+    """
+    Envia o ficheiro processado ao XML Service e regista o pedido no PendingRequestStore.
+    Se o envio falhar, o ficheiro fica no outbox para novas tentativas e o pedido conta
+    como entregue ao outbox (devolve o ID na mesma); a exceção só segue se não for possível
+    guardá-lo. Se o outbox já tiver envios em fila, o novo entra atrás deles.
+    Com `id_req` é um reenvio (sweeper ou outbox) de um pedido já registado.
+    `bucket_etag` identifica o objeto do bucket de onde veio o ficheiro.
+    """
+    resend = id_req is not None
+    id_req = id_req or str(uuid.uuid4())
     if not WEBHOOK_XML_URL:
         raise RuntimeError("WEBHOOK_XML_URL nao definido no .env")
     if not JAVA_WEBHOOK_URL:
         raise RuntimeError("JAVA_WEBHOOK_URL nao definido no .env")
     mapper_version = fetch_mapper_version()
-    ssl_context = ssl.create_default_context(cafile=certifi.where()) if certifi else None
-    async with aiohttp.ClientSession() as session:
+
+    # Registado antes do POST: o XML Service chama o webhook antes de responder
+    store = get_pending_store()
+    if not resend:
+        store.add(id_req, csv_path, FILE_NAME, bucket_etag=bucket_etag)
+        # Com envios anteriores no outbox, o snapshot novo entra na fila atrás deles:
+        # o XML Service recebe-os pela ordem em que foram gerados
+        if len(get_outbox()) and await get_outbox().spool(id_req, csv_path, "outbox com envios anteriores"):
+            print(f"[PROCESSOR] Outbox com envios anteriores, pedido {id_req} em fila.")
+            return id_req
+    try:
+        with metrics.timed("xml_send"):
+            if XML_UPLOAD_ENCODING == "multipart":
+                await _post_multipart(csv_path, id_req, mapper_version)
+                metrics.inc("bytes_uploaded_total", os.path.getsize(csv_path))
+            else:
+                await _post_stream(csv_path, id_req, mapper_version)
+    except Exception as e:
+        if resend:
+            raise
+        metrics.inc("xml_send_errors_total")
+        if not await get_outbox().spool(id_req, csv_path, str(e)):
+            store.fail(id_req, "ERRO_ENVIO")
+            raise
+        print(f"[PROCESSOR] Envio falhou ({e}), pedido {id_req} em fila no outbox.")
+    return id_req
+
+async def resend_pending_request(record):
+    """Callback do sweeper de pedidos pendentes e do outbox."""
+    return await send_to_xml_service_async(record["csv"], id_req=record["id"])
+
+def _upload_encoding():
+    if XML_UPLOAD_ENCODING == "zstd" and zstandard is None:
+        print("[PROCESSOR] zstandard não instalado, upload com gzip.")
+        return "gzip"
+    if XML_UPLOAD_ENCODING == "zstd" and _ZSTD_REJECTED:
+        return "gzip"
+    if XML_UPLOAD_ENCODING not in ("gzip", "zstd", "identity"):
+        print(f"[PROCESSOR] XML_UPLOAD_ENCODING desconhecido '{XML_UPLOAD_ENCODING}', usando gzip.")
+        return "gzip"
+    return XML_UPLOAD_ENCODING
+
+def _compressor(encoding):
+    if encoding == "gzip":
+        return zlib.compressobj(XML_UPLOAD_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=XML_UPLOAD_LEVEL).compressobj()
+    return None
+
+async def _encoded_blocks(path, encoding):
+    """Lê o ficheiro em blocos e devolve-os já comprimidos (nunca o ficheiro inteiro)."""
+    compressor = _compressor(encoding)
+    with open(path, "rb") as f:
+        while True:
+            block = await asyncio.to_thread(f.read, XML_UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            if compressor is not None:
+                block = compressor.compress(block)
+            if block:
+                metrics.inc("bytes_uploaded_total", len(block))
+                yield block
+    if compressor is not None:
+        tail = compressor.flush()
+        if tail:
+            metrics.inc("bytes_uploaded_total", len(tail))
+            yield tail
+
+async def _post_stream(csv_path, id_req, mapper_version):
+    """
+    POST do ficheiro como corpo em stream (chunked), comprimido com Content-Encoding;
+    os campos do formulário vão em headers X-*. Se o XML Service recusar zstd (415),
+    o envio repete-se em gzip e os seguintes já seguem em gzip.
+    """
+    global _ZSTD_REJECTED
+    encoding = _upload_encoding()
+    extension = os.path.splitext(csv_path)[1] or ".csv"
+    headers = {
+        "Content-Type": content_type_for(csv_path),
+        "X-Filename": f"acoes{extension}",
+        "X-ID-Requisicao": str(id_req),
+        "X-Mapper-Version": str(mapper_version),
+        "X-Webhook-Url": JAVA_WEBHOOK_URL,
+    }
+    async with http_session() as session:
+        while True:
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            async with session.post(
+                WEBHOOK_XML_URL,
+                data=_encoded_blocks(csv_path, encoding),
+                headers=headers,
+                timeout=60,
+                ssl=SSL_CONTEXT
+            ) as resp:
+                if resp.status == 415 and encoding == "zstd":
+                    print("[PROCESSOR] XML Service não aceita zstd (415), upload com gzip.")
+                    _ZSTD_REJECTED = True
+                    encoding = "gzip"
+                    continue
+                if resp.status != 200:
+                    text = await resp.text()
+                    raise XmlServiceError(resp.status, text)
+                return
+
+async def _post_multipart(csv_path, id_req, mapper_version):
+    async with http_session() as session:
         with open(csv_path, "rb") as f:
             data = aiohttp.FormData()
-            data.add_field("file", f, filename="acoes.csv", content_type="text/csv")
+            extension = os.path.splitext(csv_path)[1] or ".csv"
+            data.add_field(
+                "file", f, filename=f"acoes{extension}", content_type=content_type_for(csv_path)
+            )
             data.add_field("ID_Requisicao", id_req)
             data.add_field("MAPPER_VERSION", mapper_version)
             data.add_field("WEBHOOK_URL", JAVA_WEBHOOK_URL)
@@ -28,11 +167,8 @@ async def send_to_xml_service_async(csv_path):
                 WEBHOOK_XML_URL,
                 data=data,
                 timeout=60,
-                ssl=ssl_context
+                ssl=SSL_CONTEXT
             ) as resp:
                 if resp.status != 200:
                     text = await resp.text()
-                    raise RuntimeError(f"[ERROR] XML Service: {text}")
-
-    PENDING_REQUESTS[id_req] = {"csv": csv_path, "bucket": FILE_NAME}
-    return id_req
+                    raise XmlServiceError(resp.status, text)
@@ -21,18 +21,32 @@ def get_connection():
     )
 
 def insert_xml_document(request_id, xml_data, mapper_version, status="OK"):
+    """
+    Grava o XML de um pedido e devolve o id. Idempotente por request_id: se o pedido
+    já foi gravado (reenvio depois de um webhook perdido) devolve o id existente.
+    """
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO xml_documents (request_id, xml_document, mapper_version, status)
-        VALUES (%s, %s::xml, %s, %s)
-        RETURNING id;
-    """, (request_id, xml_data, mapper_version, status))
-    doc_id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
-    return doc_id
+    try:
+        cur.execute("SELECT id FROM xml_documents WHERE request_id = %s ORDER BY id LIMIT 1;", (request_id,))
+        row = cur.fetchone()
+        if row is None:
+            # Dois envios em simultâneo: o índice único faz o segundo cair no SELECT
+            cur.execute("""
+                INSERT INTO xml_documents (request_id, xml_document, mapper_version, status)
+                VALUES (%s, %s::xml, %s, %s)
+                ON CONFLICT DO NOTHING
+                RETURNING id;
+            """, (request_id, xml_data, mapper_version, status))
+            row = cur.fetchone()
+        if row is None:
+            cur.execute("SELECT id FROM xml_documents WHERE request_id = %s ORDER BY id LIMIT 1;", (request_id,))
+            row = cur.fetchone()
+        conn.commit()
+        return row[0]
+    finally:
+        cur.close()
+        conn.close()
 
 def query_xml(xpath_query, latest=False, doc_id=None):
     """
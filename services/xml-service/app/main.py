@@ -1,26 +1,113 @@
-from fastapi import FastAPI, UploadFile, Form, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from app.xml_handler import csv_to_xml_string, validate_xml
 from app.db_client import insert_xml_document
 from app.webhook_client import send_webhook
 import asyncio
 import os
+import tempfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+UPLOAD_BLOCK_SIZE = 256 * 1024
+# zstd não tem max_length: a entrada vai às fatias. Cada bloco zstd (>= 4 bytes) dá no
+# máximo 128 KiB, por isso 256 bytes de entrada nunca geram mais de 8 MiB de uma vez
+ZSTD_INPUT_SLICE = 256
+_ZLIB_DECOMPRESS = type(zlib.decompressobj())
+# Limite do ficheiro descomprimido (protege contra "gzip bombs")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
 
 app = FastAPI()
 
+def _decompressor(encoding):
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise HTTPException(status_code=415, detail=f"Content-Encoding não suportado: {encoding}")
+
+def _write_limited(f, data, written):
+    written += len(data)
+    if written > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Ficheiro demasiado grande")
+    f.write(data)
+    return written
+
+def _inflate(decompressor, data):
+    """
+    Descomprime `data` em pedaços de tamanho limitado, para a memória não crescer com
+    a taxa de compressão: gzip com max_length (o resto fica em unconsumed_tail), zstd
+    com a entrada às fatias de ZSTD_INPUT_SLICE.
+    """
+    if isinstance(decompressor, _ZLIB_DECOMPRESS):
+        while data:
+            yield decompressor.decompress(data, UPLOAD_BLOCK_SIZE)
+            data = decompressor.unconsumed_tail
+        return
+    for start in range(0, len(data), ZSTD_INPUT_SLICE):
+        yield decompressor.decompress(data[start:start + ZSTD_INPUT_SLICE])
+
+async def _spool_body(request, path):
+    """Grava o corpo do pedido em disco à medida que chega, descomprimindo-o se preciso."""
+    decompressor = _decompressor(request.headers.get("content-encoding"))
+    written = 0
+    with open(path, "wb") as f:
+        async for chunk in request.stream():
+            if decompressor is None:
+                written = _write_limited(f, chunk, written)
+                continue
+            for block in _inflate(decompressor, chunk):
+                written = _write_limited(f, block, written)
+        if decompressor is not None and hasattr(decompressor, "flush"):
+            written = _write_limited(f, decompressor.flush(), written)
+        if decompressor is not None and getattr(decompressor, "eof", True) is False:
+            raise HTTPException(status_code=400, detail="Corpo comprimido incompleto")
+
+async def _spool_upload(file, path):
+    written = 0
+    with open(path, "wb") as f:
+        while chunk := await file.read(UPLOAD_BLOCK_SIZE):
+            written = _write_limited(f, chunk, written)
+
+async def _read_upload(request, tmp_dir):
+    """
+    Aceita o formulário multipart original (file + campos) ou um corpo em stream,
+    opcionalmente comprimido (Content-Encoding gzip/zstd), com os campos nos headers
+    X-ID-Requisicao, X-Mapper-Version, X-Webhook-Url e X-Filename.
+    Devolve (caminho, content type, ID_Requisicao, MAPPER_VERSION, WEBHOOK_URL).
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        file = form.get("file")
+        fields = [form.get(name) for name in ("ID_Requisicao", "MAPPER_VERSION", "WEBHOOK_URL")]
+        if file is None or not hasattr(file, "read") or not all(fields):
+            raise HTTPException(status_code=422, detail="Campos file, ID_Requisicao, MAPPER_VERSION e WEBHOOK_URL obrigatórios")
+        path = os.path.join(tmp_dir, os.path.basename(file.filename or "acoes.csv"))
+        await _spool_upload(file, path)
+        return (path, file.content_type, *fields)
+
+    fields = [request.headers.get(name) for name in ("x-id-requisicao", "x-mapper-version", "x-webhook-url")]
+    if not all(fields):
+        raise HTTPException(status_code=422, detail="Headers X-ID-Requisicao, X-Mapper-Version e X-Webhook-Url obrigatórios")
+    filename = os.path.basename(request.headers.get("x-filename") or "acoes.csv")
+    path = os.path.join(tmp_dir, filename)
+    await _spool_body(request, path)
+    return (path, content_type.split(";")[0].strip() or None, *fields)
+
 @app.post("/process_csv")
-async def process_csv(
-    file: UploadFile,
-    ID_Requisicao: str = Form(...),
-    MAPPER_VERSION: str = Form(...),
-    WEBHOOK_URL: str = Form(...)
-):
-    content = await file.read()
-    tmp_path = f"/tmp/{file.filename}"
-    with open(tmp_path, "wb") as f:
-        f.write(content)
-
-    # Gerar XML
-    xml_string = csv_to_xml_string(tmp_path, MAPPER_VERSION, ID_Requisicao)
+async def process_csv(request: Request):
+    with tempfile.TemporaryDirectory(prefix="xml_upload_") as tmp_dir:
+        tmp_path, content_type, ID_Requisicao, MAPPER_VERSION, WEBHOOK_URL = await _read_upload(request, tmp_dir)
+
+        # Gerar XML
+        xml_string = csv_to_xml_string(tmp_path, MAPPER_VERSION, ID_Requisicao, content_type)
 
     # Validar XML
     if not validate_xml(xml_string):
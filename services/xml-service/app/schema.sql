@@ -6,3 +6,6 @@ CREATE TABLE IF NOT EXISTS xml_documents (
     mapper_version VARCHAR(32) NOT NULL,
     status VARCHAR(24) NOT NULL
 );
+
+-- Um documento por ID_Requisicao: reenvios do processador devolvem o doc já gravado
+CREATE UNIQUE INDEX IF NOT EXISTS xml_documents_request_id_key ON xml_documents (request_id);
@@ -1,16 +1,30 @@
 import os
 from datetime import datetime, timezone
+import numpy as np
 import pandas as pd
 from lxml import etree
 
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.xsd")
 _SCHEMA_CACHE = None
 
-def csv_to_xml_string(csv_path, mapper_version, request_id):
+def read_table(path, content_type=None):
     """
-    Converte CSV em um XML do dominio (desacoplado da origem).
+    Lê o ficheiro enviado pelo processador: CSV, Parquet ou Arrow IPC (pela extensão
+    ou pelo content type).
     """
-    df = pd.read_csv(csv_path)
+    extension = os.path.splitext(path)[1].lower()
+    content_type = (content_type or "").lower()
+    if extension == ".parquet" or "parquet" in content_type:
+        return pd.read_parquet(path)
+    if extension in (".arrow", ".feather") or "arrow" in content_type:
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+def csv_to_xml_string(csv_path, mapper_version, request_id, content_type=None):
+    """
+    Converte CSV (ou Parquet/Arrow) em um XML do dominio (desacoplado da origem).
+    """
+    df = read_table(csv_path, content_type)
 
     root = etree.Element("RelatorioMercado")
     root.set("dataGeracao", datetime.now(timezone.utc).isoformat(timespec="seconds"))
@@ -39,6 +53,10 @@ def csv_to_xml_string(csv_path, mapper_version, request_id):
         _set_text(negociacao, "UltimoPreco", _safe_text(row.get("Último_Preço")))
         _set_text(negociacao, "VariacaoPercentual", _safe_text(row.get("Variacao_%")))
         _set_text(negociacao, "DataHora", _safe_text(row.get("Data_Hora")))
+        # Valores já separados pelo processador (ingestão tipada), quando presentes
+        _set_text_if(negociacao, "Moeda", _safe_text(row.get("Moeda")))
+        _set_text_if(negociacao, "UltimoPrecoValor", _decimal_text(row.get("Ultimo_Preco_Valor")))
+        _set_text_if(negociacao, "VariacaoValor", _decimal_text(row.get("Variacao_Valor")))
 
         fundamentos = etree.SubElement(ativo, "Fundamentos")
         _set_text(fundamentos, "MarketCap", _safe_text(row.get("MarketCap")))
@@ -86,6 +104,21 @@ def _safe_text(value):
         return ""
     return str(value)
 
+def _decimal_text(value):
+    """Número em formato xs:decimal (sem notação científica); "" se vazio/inválido."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return ""
+    if not np.isfinite(number):
+        return ""
+    return np.format_float_positional(number, trim="-")
+
+def _set_text_if(parent, tag, value):
+    if value:
+        return _set_text(parent, tag, value)
+    return None
+
 def _set_text(parent, tag, value):
     child = etree.SubElement(parent, tag)
     child.text = value